@@ -1,7 +1,8 @@
 """
 WebSocket URL routing for Django Channels.
 
-This file defines the WebSocket URL patterns for the chat functionality.
+This file defines the WebSocket URL patterns for the chat functionality
+and the per-user notification socket.
 """
 
 from django.urls import re_path
@@ -12,5 +13,9 @@ websocket_urlpatterns = [
     # URL pattern: ws://server/ws/chat/<conversation_id>/
     # conversation_id can be integer or UUID string
     re_path(r'ws/chat/(?P<conversation_id>[0-9]+)/$', consumers.ChatConsumer.as_asgi()),
+    
+    # Per-user notifications for all conversations (inbox, unread badge)
+    # URL pattern: ws://server/ws/notifications/
+    re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
 ]
 
@@ -321,9 +321,81 @@ else:
         },
     }
 
+# Cache - Redis when REDIS_URL is set, per-process memory otherwise.
+# Keys for post/user/purchase data are versioned (see authentication/cache_utils.py).
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'inzulink',
+            'TIMEOUT': 300,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'inzulink',
+            'TIMEOUT': 300,
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+
+HOME_SNAPSHOT_TIMEOUT = 300   # Featured listings and counts, shared by all visitors
+HOME_PAGE_CACHE_TIMEOUT = 60  # Whole rendered home page, anonymous visitors only
+
+# Background jobs (authentication/jobs.py), run by `manage.py run_jobs` workers
+JOBS_POLL_INTERVAL = 2           # Seconds an idle worker waits before checking the queue again
+JOBS_DEFAULT_CONCURRENCY = 2     # Running jobs per task, across all workers, unless the task sets one
+JOBS_CONCURRENCY = {}            # Per-task overrides, e.g. {'reports.pdf': 1}
+JOBS_RETRY_BACKOFF = 30          # First retry delay in seconds, doubled on each further attempt
+JOBS_MAX_BACKOFF = 3600
+JOBS_STALE_AFTER = 900           # Running this long without finishing means the worker died
+JOBS_KEEP_FINISHED = 7 * 24 * 3600  # Seconds succeeded and failed jobs are kept before workers delete them
+# Let the send-OTP APIs queue the email when asked to (async=true). Only
+# enable this where a run_jobs worker is running, or codes are never sent.
+OTP_SEND_ASYNC = os.environ.get('OTP_SEND_ASYNC', 'False') == 'True'
+
+# Streaming CSV exports fetch rows from the database this many at a time
+EXPORT_CHUNK_SIZE = 2000
+
+# Listing location search (?near=lat,lng&radius_km=, see authentication/geo_utils.py)
+GEO_DEFAULT_RADIUS_KM = 10
+GEO_MAX_RADIUS_KM = 100
+
+# Listing view counting (see authentication/view_tracking.py). Dedupe keys
+# live in the default cache; views are buffered per process between flushes.
+VIEW_COUNT_DEDUPE_WINDOW = 1800   # Seconds during which repeat views by one viewer count once
+VIEW_COUNT_FLUSH_THRESHOLD = 500  # Write buffered views once this many are pending
+VIEW_COUNT_FLUSH_INTERVAL = 10    # ...or once the oldest is this many seconds old
+
+# Trending listings (sort=trending, see authentication/trending.py)
+TRENDING_HALF_LIFE_HOURS = 48     # Engagement counts half as much after this long
+TRENDING_WINDOW_DAYS = 14         # ...and not at all after this
+TRENDING_REFRESH_INTERVAL = 900   # Seconds between recomputes by the listings.trending job
+TRENDING_WEIGHTS = {'views': 1, 'likes': 3, 'bookmarks': 4, 'inquiries': 8, 'purchases': 12}
+
+# "Similar properties" on listing pages (see authentication/similar_listings.py)
+SIMILAR_LISTINGS_COUNT = 6
+SIMILAR_LISTINGS_CACHE_TIMEOUT = 600
+# Relative importance of each feature, see the module docstring for the units
+SIMILAR_LISTINGS_WEIGHTS = {'category': 4.0, 'district': 3.0, 'price': 2.0, 'size': 1.0, 'bedrooms': 0.5}
+
 # Chat Settings
 CHAT_MESSAGE_MAX_LENGTH = 2000  # Maximum message length
 CHAT_MESSAGES_PER_PAGE = 50    # Messages to load per page
+# 'sync' saves each message before broadcasting it; 'write_behind' broadcasts
+# immediately and bulk-inserts in batches (see authentication/chat_persistence.py)
+CHAT_PERSISTENCE_MODE = os.environ.get('CHAT_PERSISTENCE_MODE', 'sync')
+CHAT_WRITE_BEHIND_BATCH_SIZE = 100       # Flush once this many messages are pending
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = 0.05  # ...or after this many seconds
+CHAT_WRITE_BEHIND_MAX_ATTEMPTS = 3       # Drop (and log) a message after this many failed flushes
+# Presence and typing (see authentication/chat_presence.py). Presence is kept
+# in the default cache, which must be shared (e.g. Redis) across workers.
+CHAT_PRESENCE_TTL = 60        # Seconds a socket counts as online without a frame
+CHAT_TYPING_THROTTLE = 3      # At most one "typing" broadcast per user per this many seconds
+CHAT_TYPING_STOP_GRACE = 1    # "Stopped typing" is dropped if typing resumes within this
 
 # ==============================================
 # MTN MoMo Payment Configuration
@@ -3,7 +3,7 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import (
     User, Post, Purchase, Bookmark, ProductImage, 
     UserQRCode, OTPVerification, ProductReview,
-    PropertyInquiry, ListingFee, Conversation, Message
+    PropertyInquiry, ListingFee, Conversation, Message, Job, ReportArtifact
 )
 
 class UserAdmin(BaseUserAdmin):
@@ -87,6 +87,18 @@ class MessageAdmin(admin.ModelAdmin):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
     short_content.short_description = 'Content Preview'
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'status', 'user', 'attempts', 'max_attempts', 'run_at', 'created_at', 'finished_at')
+    list_filter = ('status', 'task', 'created_at')
+    search_fields = ('task', 'user__username', 'error')
+    readonly_fields = ('created_at', 'finished_at', 'locked_by', 'locked_at', 'result', 'error')
+
+class ReportArtifactAdmin(admin.ModelAdmin):
+    list_display = ('id', 'report_type', 'subject', 'date_from', 'date_to', 'status', 'row_count', 'size', 'created_at')
+    list_filter = ('report_type', 'status', 'created_at')
+    search_fields = ('subject__username', 'key')
+    readonly_fields = ('key', 'data_version', 'file', 'size', 'row_count', 'build_seconds', 'created_at', 'completed_at')
+
 # Register your models here.
 admin.site.register(User, UserAdmin)
 admin.site.register(Post, PostAdmin)
@@ -102,3 +114,7 @@ admin.site.register(OTPVerification)
 # Chat models
 admin.site.register(Conversation, ConversationAdmin)
 admin.site.register(Message, MessageAdmin)
+
+# Background jobs
+admin.site.register(Job, JobAdmin)
+admin.site.register(ReportArtifact, ReportArtifactAdmin)
@@ -1,12 +1,15 @@
+from django.conf import settings
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.contrib.auth import authenticate
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
+from .jobs import job_reference
 from .models import Purchase, User
 from .qr_utils import decode_qr_data, get_user_purchases_from_qr
 from .otp_utils import create_otp, verify_otp as verify_otp_util
+from .sales_rollups import property_sales_breakdown, vendor_sales_summary
 import json
 from django.db.models import Sum, Count, Avg
 from decimal import Decimal
@@ -135,6 +138,16 @@ def send_otp(request):
         except User.DoesNotExist:
             return JsonResponse({'error': 'User not found'}, status=404)
         
+        if data.get('async') and getattr(settings, 'OTP_SEND_ASYNC', False):
+            # The email is sent by a background job; poll status_url for the outcome
+            otp_result = create_otp(user, 'purchase_confirmation', send_async=True)
+            return JsonResponse({
+                'success': True,
+                'message': f'OTP queued for {user.email}',
+                'session_id': otp_result.get('otp_id'),
+                **job_reference(otp_result['email_job'])
+            }, status=202)
+        
         # Create and send OTP
         otp_result = create_otp(user, 'purchase_confirmation')
         print(otp_result)
@@ -262,48 +275,17 @@ def get_vendor_statistics_modal(request, vendor_id):
         
         # Get all purchases for this vendor
         purchases = Purchase.objects.filter(
-            product__user=vendor,
+            property__user=vendor,
             status='completed'
-        ).select_related('product', 'buyer', 'koraquest_user')
-        
-        # Calculate vendor statistics
-        total_sales = purchases.count()
-        total_revenue = purchases.aggregate(
-            total=Sum('final_price')
-        )['total'] or 0
-        
-        # Monthly statistics
-        current_month = timezone.now().month
-        current_year = timezone.now().year
-        monthly_purchases = purchases.filter(
-            completed_at__month=current_month,
-            completed_at__year=current_year
-        )
-        monthly_revenue = monthly_purchases.aggregate(
-            total=Sum('final_price')
-        )['total'] or 0
+        ).select_related('property', 'buyer')
+        
+        # Sales and listing fee totals come from the daily rollups
+        summary = vendor_sales_summary(vendor)
+        total_revenue = summary['total_revenue']
+        vendor_listing_fees = summary['listing_fees']
         
         # Property-wise breakdown
-        product_stats = list(purchases.values('property__title').annotate(
-            total_sales=Count('id'),
-            total_revenue=Sum('final_price'),
-            avg_price=Avg('final_price')
-        ).order_by('-total_revenue')[:5])  # Limit to top 5 properties
-        
-        # Get listing fees paid by this vendor
-        from .models import ListingFee
-        vendor_listing_fees = ListingFee.objects.filter(
-            vendor=vendor,
-            payment_status='paid'
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        # Monthly listing fees
-        monthly_listing_fees = ListingFee.objects.filter(
-            vendor=vendor,
-            payment_status='paid',
-            start_date__month=current_month,
-            start_date__year=current_year
-        ).aggregate(total=Sum('amount'))['total'] or 0
+        product_stats = property_sales_breakdown(vendor, limit=5)  # Limit to top 5 properties
         
         # Recent transactions
         recent_transactions = list(purchases.order_by('-completed_at')[:5].values(
@@ -334,12 +316,12 @@ def get_vendor_statistics_modal(request, vendor_id):
                 'email': vendor.email
             },
             'statistics': {
-                'total_sales': total_sales,
+                'total_sales': summary['total_sales'],
                 'total_revenue': float(total_revenue),
-                'monthly_revenue': float(monthly_revenue),
-                'monthly_sales': monthly_purchases.count(),
+                'monthly_revenue': float(summary['monthly_total_revenue']),
+                'monthly_sales': summary['monthly_total_sales'],
                 'listing_fees': float(vendor_listing_fees),
-                'monthly_listing_fees': float(monthly_listing_fees),
+                'monthly_listing_fees': float(summary['monthly_listing_fees']),
                 'net_earnings': float(total_revenue - vendor_listing_fees)
             },
             'product_stats': product_stats,
@@ -3,8 +3,11 @@ from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.settings import api_settings
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Q, Sum, Count, Avg
 from django.utils import timezone
@@ -28,6 +31,12 @@ from .serializers import (
 )
 from .qr_utils import update_user_qr_code, decode_qr_data, get_user_purchases_from_qr
 from .otp_utils import create_otp, verify_otp
+from .jobs import job_reference
+from .pagination_utils import COUNT_MODES, InvalidCursor, count_results, keyset_paginate
+from .sales_rollups import vendor_sales_summary
+from .search_backends import RELEVANCE_ORDERING, search_posts
+from .tasks import update_user_qr_code_async
+from .geo_utils import DISTANCE_ORDERING, InvalidGeoQuery, filter_bbox, filter_near, parse_bbox, parse_near
 
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -37,6 +46,106 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class KeysetResultsSetPagination(BasePagination):
+    """
+    Opt-in keyset pagination keyed on the active ordering plus ``id``.
+
+    Returns opaque ``next``/``previous`` cursor links; the total is
+    approximate by default and controlled with ``?count=exact|approx|none``.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    default_count_mode = 'approx'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size < 1:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        try:
+            self.page = keyset_paginate(
+                queryset, ordering,
+                request.query_params.get(self.cursor_query_param),
+                self.get_page_size(request)
+            )
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+
+        count_mode = request.query_params.get(self.count_query_param, self.default_count_mode)
+        if count_mode not in COUNT_MODES:
+            count_mode = self.default_count_mode
+        self.count, self.count_is_exact = count_results(queryset, count_mode)
+        return list(self.page)
+
+    def _cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'count_is_exact': self.count_is_exact,
+            'next': self._cursor_link(self.page.next_cursor),
+            'previous': self._cursor_link(self.page.prev_cursor),
+            'results': data,
+        })
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    ``?search=`` backed by the listing full-text index.
+
+    Results are ordered by relevance unless ``?ordering=`` is given, so this
+    backend must run after ``OrderingFilter``.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        queryset = search_posts(queryset, query)
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by(*RELEVANCE_ORDERING)
+        return queryset
+
+
+class GeoFilter(filters.BaseFilterBackend):
+    """
+    ``?near=lat,lng&radius_km=`` and ``?bbox=west,south,east,north`` filters.
+
+    With ``near``, results are nearest first when ``?ordering=distance`` is
+    given, or when neither ``ordering`` nor ``search`` is; this backend must
+    run after ``OrderingFilter`` and ``FullTextSearchFilter``.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        near, bbox = params.get('near', '').strip(), params.get('bbox', '').strip()
+        try:
+            if near:
+                queryset = filter_near(queryset, *parse_near(near, params.get('radius_km')))
+            if bbox:
+                queryset = filter_bbox(queryset, *parse_bbox(bbox))
+        except InvalidGeoQuery as e:
+            raise ValidationError({'location': [str(e)]})
+
+        ordering = params.get(api_settings.ORDERING_PARAM)
+        if near and (ordering == 'distance' or not (ordering or params.get(api_settings.SEARCH_PARAM))):
+            queryset = queryset.order_by(*DISTANCE_ORDERING)
+        return queryset
+
+
 # Authentication Views
 class UserRegistrationView(generics.CreateAPIView):
     """User registration endpoint"""
@@ -143,12 +252,22 @@ class PostViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated]
     pagination_class = StandardResultsSetPagination
     parser_classes = [MultiPartParser, FormParser]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, FullTextSearchFilter, GeoFilter]
     filterset_fields = ['category', 'user', 'price']
-    search_fields = ['title', 'description']
-    ordering_fields = ['created_at', 'price', 'total_purchases']
+    ordering_fields = ['created_at', 'price', 'total_purchases', 'rating_avg', 'likes_count', 'trending_score']
     ordering = ['-created_at']
     
+    @property
+    def paginator(self):
+        """Switch to keyset pagination for ?pagination=cursor or ?cursor=..."""
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if 'cursor' in params or params.get('pagination') == 'cursor':
+                self._paginator = KeysetResultsSetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+    
     def get_serializer_class(self):
         if self.action == 'create':
             return PostCreateSerializer
@@ -349,6 +468,11 @@ class UserQRCodeViewSet(ModelViewSet):
         """Generate QR code for current user"""
         user = request.user
         
+        if request.data.get('async'):
+            # Rendered by a background job, which replaces the current code when done
+            job = update_user_qr_code_async(user)
+            return Response(job_reference(job), status=status.HTTP_202_ACCEPTED)
+        
         # Delete existing QR code
         UserQRCode.objects.filter(user=user).delete()
         
@@ -399,6 +523,15 @@ class OTPVerificationViewSet(ModelViewSet):
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         
         try:
+            if request.data.get('async') and getattr(settings, 'OTP_SEND_ASYNC', False):
+                # The email is sent by a background job; poll status_url for the outcome
+                otp_result = create_otp(user, purpose, send_async=True)
+                return Response({
+                    'message': f'OTP queued for {user.email}',
+                    'session_id': otp_result.get('otp_id'),
+                    **job_reference(otp_result['email_job'])
+                }, status=status.HTTP_202_ACCEPTED)
+            
             otp_result = create_otp(user, purpose)
             if otp_result.get('email_sent'):
                 return Response({
@@ -512,48 +645,19 @@ def vendor_statistics(request, vendor_id):
     except User.DoesNotExist:
         return Response({'error': 'Vendor not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    # Get vendor's completed purchases
-    purchases = Purchase.objects.filter(
-        product__user=vendor,
-        status='completed'
-    )
-    
-    total_sales = purchases.count()
-    total_revenue = purchases.aggregate(total=Sum('final_price'))['total'] or 0
-    
-    # Monthly statistics
-    current_month = timezone.now().month
-    current_year = timezone.now().year
-    monthly_purchases = purchases.filter(
-        completed_at__month=current_month,
-        completed_at__year=current_year
-    )
-    monthly_revenue = monthly_purchases.aggregate(total=Sum('final_price'))['total'] or 0
-    
-    # Get listing fees paid by this vendor
-    from .models import ListingFee
-    vendor_listing_fees = ListingFee.objects.filter(
-        vendor=vendor,
-        payment_status='paid'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    monthly_listing_fees = ListingFee.objects.filter(
-        vendor=vendor,
-        payment_status='paid',
-        start_date__month=current_month,
-        start_date__year=current_year
-    ).aggregate(total=Sum('amount'))['total'] or 0
+    # Sales and listing fee totals come from the daily rollups
+    summary = vendor_sales_summary(vendor)
     
     data = {
         'vendor': UserSerializer(vendor).data,
         'statistics': {
-            'total_sales': total_sales,
-            'total_revenue': total_revenue,
-            'monthly_revenue': monthly_revenue,
-            'monthly_sales': monthly_purchases.count(),
-            'listing_fees': vendor_listing_fees,
-            'monthly_listing_fees': monthly_listing_fees,
-            'net_earnings': total_revenue - vendor_listing_fees
+            'total_sales': summary['total_sales'],
+            'total_revenue': summary['total_revenue'],
+            'monthly_revenue': summary['monthly_total_revenue'],
+            'monthly_sales': summary['monthly_total_sales'],
+            'listing_fees': summary['listing_fees'],
+            'monthly_listing_fees': summary['monthly_listing_fees'],
+            'net_earnings': summary['total_revenue'] - summary['listing_fees']
         }
     }
     
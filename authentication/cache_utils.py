@@ -0,0 +1,147 @@
+"""
+Versioned caching for data derived from posts, users and purchases.
+
+Cached values are keyed by the current version of every namespace they were
+computed from (``post``, ``user``, ``purchase``). Signal handlers in
+``signals.py`` call ``bump`` whenever a row in a namespace changes, which
+moves all keys built on it to fresh names; stale entries are never read
+again and age out with their timeout. There is no key scanning, so this
+works the same on the local-memory default and on Redis (``REDIS_URL``).
+
+Version counters start from the current time in milliseconds, so a counter
+evicted from the cache never comes back at an old value that could revive
+stale entries.
+
+``cache_anonymous_page`` stores whole rendered pages for anonymous visitors
+under the same versioned keys. Logged-in users always get a fresh render.
+
+Hits and misses are counted per metric name in this process; staff can read
+them from ``api_cache_stats``.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+NAMESPACES = ('post', 'user', 'purchase')
+VERSION_KEY = 'cache_version:{namespace}'
+DEFAULT_TIMEOUT = 300
+
+_metrics = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_metrics_lock = threading.Lock()
+
+
+def _initial_version():
+    return int(time.time() * 1000)
+
+
+def namespace_versions(namespaces):
+    """Current version of each namespace, from one cache round-trip."""
+    keys = {VERSION_KEY.format(namespace=namespace): namespace for namespace in namespaces}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, namespace in keys.items():
+        if key not in found:
+            cache.add(key, _initial_version(), None)
+            found[key] = cache.get(key, _initial_version())
+        versions[namespace] = found[key]
+    return versions
+
+
+def bump(*namespaces):
+    """Invalidate everything cached from ``namespaces``."""
+    for namespace in namespaces:
+        key = VERSION_KEY.format(namespace=namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), None)
+
+
+def versioned_key(name, parts=(), depends_on=NAMESPACES):
+    versions = namespace_versions(depends_on)
+    version = '.'.join(str(versions[namespace]) for namespace in depends_on)
+    return ':'.join([name, *(str(part) for part in parts), version])
+
+
+def cached(name, compute, parts=(), depends_on=NAMESPACES, timeout=DEFAULT_TIMEOUT):
+    """
+    Return the cached result of ``compute()``, recomputing it on a miss.
+
+    ``name`` is also the metric the hit or miss is counted under; ``parts``
+    distinguish variants (a vendor id, a filter) within it.
+    """
+    key = versioned_key(name, parts, depends_on)
+    value = cache.get(key)
+    if value is not None:
+        record(name, hit=True)
+        return value
+    record(name, hit=False)
+    value = compute()
+    cache.set(key, value, timeout)
+    return value
+
+
+def cache_anonymous_page(name, depends_on=NAMESPACES, timeout=DEFAULT_TIMEOUT):
+    """
+    Cache a view's full GET response for anonymous visitors.
+
+    Authenticated requests bypass the cache; every response varies on
+    ``Cookie`` so shared caches in front of the site can't hand one user's
+    page to another. Only the body and content type are stored, never the
+    cookies set while rendering it, and pages that use a CSRF token are not
+    stored at all.
+    """
+    metric = f'page:{name}'
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            key = versioned_key(metric, (request.get_full_path(),), depends_on)
+            page = cache.get(key)
+            if page is not None:
+                record(metric, hit=True)
+                response = HttpResponse(page['content'], content_type=page['content_type'])
+                response['X-Cache'] = 'HIT'
+            else:
+                record(metric, hit=False)
+                response = view(request, *args, **kwargs)
+                if callable(getattr(response, 'render', None)):
+                    response.render()
+                # Pages that handed out a CSRF token are per visitor
+                if (response.status_code == 200 and not response.streaming
+                        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')):
+                    cache.set(key, {'content': response.content, 'content_type': response['Content-Type']}, timeout)
+                response['X-Cache'] = 'MISS'
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
+
+
+def record(name, hit):
+    with _metrics_lock:
+        _metrics[name]['hits' if hit else 'misses'] += 1
+
+
+def cache_metrics():
+    """``{name: {'hits', 'misses', 'hit_rate'}}`` for this process."""
+    with _metrics_lock:
+        snapshot = {name: dict(counts) for name, counts in _metrics.items()}
+    for counts in snapshot.values():
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_rate'] = round(counts['hits'] / lookups, 4) if lookups else None
+    return snapshot
+
+
+def reset_cache_metrics():
+    with _metrics_lock:
+        _metrics.clear()
@@ -0,0 +1,95 @@
+"""
+Per-user chat notifications.
+
+Every authenticated page can hold one ``NotificationConsumer`` socket
+(``ws/notifications/``) joined to the ``user_<id>`` group, instead of polling
+``api_unread_count``/``api_conversations`` or opening a socket per
+conversation. The helpers here push, after the surrounding transaction commits:
+
+- ``new_message`` to both participants, with the receiving user's unread
+  count for that conversation;
+- ``unread_count`` to a reader whose counter dropped (other tabs, inbox);
+- ``conversation_update`` to both participants when a conversation is
+  created or its status changes.
+
+Unread counts are read back from the stored counters after the update, so
+clients can replace their value rather than increment it.
+"""
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+
+def user_group(user_id):
+    return f'user_{user_id}'
+
+
+def send_to_users(events):
+    """Send ``[(user_id, event_dict), ...]`` to the users' notification sockets."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    send = async_to_sync(channel_layer.group_send)
+    for user_id, event in events:
+        send(user_group(user_id), {'type': 'notify', 'event': event})
+
+
+def message_summary(message):
+    return {
+        'id': message.pk,
+        'sender_id': message.sender_id,
+        'preview': message.content[:100],
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+def notify_new_messages(last_messages):
+    """
+    On commit, tell both participants about the newest message of each conversation.
+
+    ``last_messages`` maps conversation id to the last message written in it;
+    one query reads back all the unread counters.
+    """
+    def send():
+        from .models import Conversation
+
+        conversations = Conversation.objects.filter(pk__in=list(last_messages)).values(
+            'id', 'buyer_id', 'seller_id', 'buyer_unread_count', 'seller_unread_count'
+        )
+        events = []
+        for conversation in conversations:
+            summary = message_summary(last_messages[conversation['id']])
+            for role in ('buyer', 'seller'):
+                events.append((conversation[f'{role}_id'], {
+                    'type': 'new_message',
+                    'conversation_id': conversation['id'],
+                    'message': summary,
+                    'unread_count': conversation[f'{role}_unread_count'],
+                }))
+        send_to_users(events)
+
+    if last_messages:
+        transaction.on_commit(send)
+
+
+def notify_unread_count(user_id, conversation_id, unread_count):
+    """On commit, tell ``user_id`` their unread count for a conversation changed."""
+    transaction.on_commit(lambda: send_to_users([(user_id, {
+        'type': 'unread_count',
+        'conversation_id': conversation_id,
+        'unread_count': unread_count,
+    })]))
+
+
+def notify_conversation_update(conversation, created=False):
+    """On commit, tell both participants a conversation was created or changed status."""
+    event = {
+        'type': 'conversation_update',
+        'conversation_id': conversation.pk,
+        'status': conversation.status,
+        'created': created,
+    }
+    transaction.on_commit(lambda: send_to_users(
+        [(conversation.buyer_id, event), (conversation.seller_id, event)]
+    ))
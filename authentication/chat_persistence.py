@@ -0,0 +1,260 @@
+"""
+Write-behind persistence for WebSocket chat messages.
+
+In the default ``sync`` mode ``ChatConsumer`` saves each message before
+broadcasting it, which costs several database round-trips per message. With
+``CHAT_PERSISTENCE_MODE = 'write_behind'`` the consumer broadcasts straight
+away, tagged with the client-generated ``client_id``, and hands the message
+to the per-process ``MessageWriteBehindQueue``. The queue bulk-inserts
+pending messages and updates each conversation (last message, unread
+counters) once per batch, then tells each conversation group which
+``client_id`` got which database ``id`` (sent to clients as ``message_ack``).
+
+Delivery: the queue is flushed when it reaches ``CHAT_WRITE_BEHIND_BATCH_SIZE``,
+after ``CHAT_WRITE_BEHIND_FLUSH_INTERVAL`` seconds, whenever a consumer
+disconnects, and at interpreter exit. A message is only lost if the process
+dies without running exit handlers, or if it cannot be written at all.
+
+When a batch fails, its messages are retried one at a time so a single bad
+row (e.g. for a conversation deleted in the meantime) cannot hold back the
+rest. A message that fails ``CHAT_WRITE_BEHIND_MAX_ATTEMPTS`` flushes in a
+row is dropped and logged with its content.
+"""
+
+import asyncio
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from .chat_notifications import notify_new_messages
+
+logger = logging.getLogger(__name__)
+
+
+def write_message_batch(pending):
+    """
+    Persist a batch of pending messages.
+
+    ``pending`` is a list of dicts with ``conversation_id``, ``sender_id``,
+    ``content``, ``created_at`` and ``client_id``. Messages a sender already
+    stored under the same ``client_id`` (client retries) are not inserted
+    twice. Returns ``{(sender_id, client_id): message_id}`` for the rows
+    written and for those duplicates, so a retried message is acknowledged
+    with the id it was first stored under.
+    """
+    from .models import Conversation, Message
+
+    if not pending:
+        return {}
+
+    messages = [
+        Message(
+            conversation_id=item['conversation_id'],
+            sender_id=item['sender_id'],
+            content=item['content'],
+            created_at=item['created_at'],
+            client_id=item['client_id'],
+        )
+        for item in pending
+    ]
+
+    duplicates = []
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(messages)
+        except IntegrityError:
+            # A client_id was already stored; fall back to row-by-row inserts
+            saved = []
+            for message in messages:
+                try:
+                    with transaction.atomic():
+                        message.save()
+                    saved.append(message)
+                except IntegrityError:
+                    logger.info('Skipping duplicate chat message %s', message.client_id)
+                    duplicates.append(message)
+            messages = saved
+
+        by_conversation = OrderedDict()
+        last_messages = {}
+        for message in messages:
+            by_conversation.setdefault(message.conversation_id, []).append(message)
+
+        for conversation_id, conversation_messages in by_conversation.items():
+            last = max(conversation_messages, key=lambda m: (m.created_at, m.pk))
+            sent_by = {}
+            for message in conversation_messages:
+                sent_by[message.sender_id] = sent_by.get(message.sender_id, 0) + 1
+            # Messages from the seller are unread for the buyer and vice versa
+            buyer_unread, seller_unread = Value(0), Value(0)
+            for sender_id, count in sent_by.items():
+                buyer_unread = buyer_unread + _count_if('seller_id', sender_id, count)
+                seller_unread = seller_unread + _count_if('buyer_id', sender_id, count)
+            Conversation.objects.filter(pk=conversation_id).update(
+                last_message=last,
+                last_message_at=last.created_at,
+                buyer_unread_count=F('buyer_unread_count') + buyer_unread,
+                seller_unread_count=F('seller_unread_count') + seller_unread,
+            )
+            last_messages[conversation_id] = last
+
+        # One notification per conversation per batch, not per message
+        notify_new_messages(last_messages)
+
+    stored = {(message.sender_id, message.client_id): message.pk for message in messages}
+    if duplicates:
+        stored.update(_stored_ids(duplicates))
+    return stored
+
+
+def _stored_ids(messages):
+    """``{(sender_id, client_id): id}`` of the rows already stored for ``messages``."""
+    from .models import Message
+
+    lookup = Q()
+    for message in messages:
+        lookup |= Q(conversation_id=message.conversation_id, sender_id=message.sender_id,
+                    client_id=message.client_id)
+    return {
+        (sender_id, client_id): pk
+        for pk, sender_id, client_id in Message.objects.filter(lookup).values_list('pk', 'sender_id', 'client_id')
+    }
+
+
+def _count_if(field, user_id, count):
+    """``count`` when the conversation's ``field`` equals ``user_id``, else 0."""
+    return Case(When(**{field: user_id}, then=Value(count)), default=Value(0), output_field=IntegerField())
+
+
+def _write_rows(batch):
+    """Write ``batch`` one message per transaction; returns ``(saved, failed_items)``."""
+    saved, failed = {}, []
+    for item in batch:
+        try:
+            saved.update(write_message_batch([item]))
+        except Exception:
+            failed.append(item)
+    return saved, failed
+
+
+def _drop(item):
+    logger.error(
+        'Dropping chat message %s from user %s in conversation %s after %d failed attempts: %r',
+        item['client_id'], item['sender_id'], item['conversation_id'], item.get('attempts', 1), item['content'],
+    )
+
+
+class MessageWriteBehindQueue:
+    """Per-process buffer of chat messages waiting to be written in batches."""
+
+    def __init__(self, batch_size=None, flush_interval=None, max_attempts=None):
+        self.batch_size = batch_size or getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 100)
+        self.flush_interval = flush_interval or getattr(settings, 'CHAT_WRITE_BEHIND_FLUSH_INTERVAL', 0.05)
+        self.max_attempts = max_attempts or getattr(settings, 'CHAT_WRITE_BEHIND_MAX_ATTEMPTS', 3)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def enqueue(self, item):
+        with self._lock:
+            self._pending.append(item)
+            size = len(self._pending)
+        if size >= self.batch_size:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception('Failed to acknowledge chat messages')
+
+    def _take(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        return batch
+
+    async def flush(self):
+        """Write everything pending and acknowledge it to the conversation groups."""
+        async with self._flush_lock:
+            batch = self._take()
+            if not batch:
+                return {}
+            try:
+                saved = await database_sync_to_async(write_message_batch)(batch)
+            except Exception:
+                logger.exception('Failed to write %d chat messages, retrying them one by one', len(batch))
+                saved, failed = await database_sync_to_async(_write_rows)(batch)
+                if self._requeue(failed):
+                    # Retry even if no new message arrives to trigger a flush
+                    self._timer = asyncio.ensure_future(self._flush_later())
+        await self._acknowledge(batch, saved)
+        return saved
+
+    def _requeue(self, failed):
+        """Put failed messages back for the next flush, dropping those out of attempts."""
+        retry = []
+        for item in failed:
+            item['attempts'] = item.get('attempts', 0) + 1
+            if item['attempts'] < self.max_attempts:
+                retry.append(item)
+            else:
+                _drop(item)
+        with self._lock:
+            self._pending[:0] = retry
+        return len(retry)
+
+    async def _acknowledge(self, batch, saved):
+        channel_layer = get_channel_layer()
+        acks = OrderedDict()
+        for item in batch:
+            key = (item['sender_id'], item['client_id'])
+            if key in saved:
+                acks.setdefault(item['conversation_id'], []).append({
+                    'client_id': item['client_id'],
+                    'sender_id': item['sender_id'],
+                    'id': saved[key],
+                })
+        for conversation_id, messages in acks.items():
+            await channel_layer.group_send(f'chat_{conversation_id}', {
+                'type': 'message_persisted',
+                'messages': messages,
+            })
+
+    def flush_sync(self):
+        """Write everything pending without an event loop (used at exit)."""
+        batch = self._take()
+        if not batch:
+            return
+        try:
+            write_message_batch(batch)
+        except Exception:
+            logger.exception('Failed to write %d chat messages, retrying them one by one', len(batch))
+            # No later flush at exit, so whatever still fails is dropped
+            for item in _write_rows(batch)[1]:
+                _drop(item)
+
+
+_queue = None
+
+
+def get_write_behind_queue():
+    global _queue
+    if _queue is None:
+        _queue = MessageWriteBehindQueue()
+        atexit.register(_queue.flush_sync)
+    return _queue
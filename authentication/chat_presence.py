@@ -0,0 +1,169 @@
+"""
+Presence and typing throttling for WebSocket chat.
+
+Presence lives in the Django cache instead of being inferred from
+``user_join``/``user_leave`` broadcasts. Every update is a single atomic
+cache operation (``add``, ``incr``, ``decr``, ``touch``), never a
+read-modify-write. Sockets of the same user connecting or disconnecting
+at once therefore cannot overwrite each other. Per participant of a
+conversation the cache holds:
+
+- an "online" key with a TTL. Every socket pushes the TTL forward when it
+  sends a frame (``static/js/chat.js`` pings every 30 seconds), and
+  ``cache.add`` on it tells whether the user just came online;
+- a count of open sockets, incremented on connect and decremented on
+  disconnect, which expires together with the online key;
+- the "last seen" time.
+
+A socket that dies without disconnecting simply ages out after
+``CHAT_PRESENCE_TTL`` seconds. The consumer only broadcasts a ``presence``
+event when a user goes from no live sockets to one or back, so reconnects
+and extra tabs cost no group traffic. Clients (and the HTTP fallback) can
+ask for the current state at any time.
+
+``TypingThrottle`` decides which typing toggles from one socket reach the
+group: a "started typing" is forwarded at most once per
+``CHAT_TYPING_THROTTLE`` seconds, and "stopped typing" is held for
+``CHAT_TYPING_STOP_GRACE`` seconds so a quick stop/start pair is never sent.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+PRESENCE_KEY = 'chat:presence:{conversation_id}:{user_id}'
+SOCKETS_KEY = 'chat:presence_sockets:{conversation_id}:{user_id}'
+LAST_SEEN_KEY = 'chat:last_seen:{conversation_id}:{user_id}'
+# How long "last seen" is remembered once every socket has gone
+LAST_SEEN_TTL = 7 * 24 * 60 * 60
+
+
+def presence_ttl():
+    return getattr(settings, 'CHAT_PRESENCE_TTL', 60)
+
+
+class PresenceStore:
+    """Who is connected to which conversation, kept in a cache with a TTL."""
+
+    def __init__(self, alias=None, ttl=None):
+        self.alias = alias or getattr(settings, 'CHAT_PRESENCE_CACHE', 'default')
+        self.ttl = ttl or presence_ttl()
+
+    @property
+    def cache(self):
+        # Cache connections are per thread; look it up on every use
+        return caches[self.alias]
+
+    def keys(self, conversation_id, user_id):
+        """The online, socket count and last seen keys of one participant."""
+        return tuple(
+            template.format(conversation_id=conversation_id, user_id=user_id)
+            for template in (PRESENCE_KEY, SOCKETS_KEY, LAST_SEEN_KEY)
+        )
+
+    def _refresh(self, conversation_id, user_id, now):
+        online_key, sockets_key, last_seen_key = self.keys(conversation_id, user_id)
+        came_online = self.cache.add(online_key, now, self.ttl)
+        if not came_online and not self.cache.touch(online_key, self.ttl):
+            # Expired between the two calls
+            came_online = self.cache.add(online_key, now, self.ttl)
+        self.cache.touch(sockets_key, self.ttl)
+        self.cache.set(last_seen_key, now, LAST_SEEN_TTL)
+        return came_online
+
+    def join(self, conversation_id, user_id, now=None):
+        """
+        Count a newly connected socket of ``user_id``.
+
+        Returns True when this makes the user go online in the conversation.
+        """
+        _, sockets_key, _ = self.keys(conversation_id, user_id)
+        if not self.cache.add(sockets_key, 1, self.ttl):
+            try:
+                self.cache.incr(sockets_key)
+            except ValueError:
+                # Expired since the add
+                self.cache.add(sockets_key, 1, self.ttl)
+        return self._refresh(conversation_id, user_id, now or time.time())
+
+    def touch(self, conversation_id, user_id, now=None):
+        """
+        Keep an already connected socket of ``user_id`` alive.
+
+        Returns True when the user had aged out and is online again.
+        """
+        came_online = self._refresh(conversation_id, user_id, now or time.time())
+        if came_online:
+            # The socket count expired with the online key; this socket is live
+            _, sockets_key, _ = self.keys(conversation_id, user_id)
+            self.cache.add(sockets_key, 1, self.ttl)
+        return came_online
+
+    def leave(self, conversation_id, user_id, now=None):
+        """
+        Forget one socket. Returns True when the user has no live socket left.
+        """
+        online_key, sockets_key, last_seen_key = self.keys(conversation_id, user_id)
+        self.cache.set(last_seen_key, now or time.time(), LAST_SEEN_TTL)
+        try:
+            remaining = self.cache.decr(sockets_key)
+        except ValueError:
+            remaining = 0
+        if remaining > 0:
+            return False
+        # A socket joining right now may lose its keys here; its next touch
+        # finds the user offline and announces them again
+        self.cache.delete_many([online_key, sockets_key])
+        return True
+
+    def snapshot(self, conversation_id, user_ids):
+        """
+        ``{user_id: {'online': bool, 'last_seen': timestamp or None}}`` for ``user_ids``.
+
+        One cache round-trip regardless of the number of users.
+        """
+        keys = {user_id: self.keys(conversation_id, user_id) for user_id in user_ids}
+        entries = self.cache.get_many([
+            key for online_key, _, last_seen_key in keys.values() for key in (online_key, last_seen_key)
+        ])
+        return {
+            user_id: {'online': online_key in entries, 'last_seen': entries.get(last_seen_key)}
+            for user_id, (online_key, _, last_seen_key) in keys.items()
+        }
+
+
+class TypingThrottle:
+    """Typing state of one socket and which toggles are worth broadcasting."""
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else getattr(settings, 'CHAT_TYPING_THROTTLE', 3)
+        self.active = False
+        self.last_sent = None
+
+    def start(self, now=None):
+        """Returns True when "started typing" should be broadcast."""
+        now = now or time.monotonic()
+        if self.active and now - self.last_sent < self.interval:
+            return False
+        self.active = True
+        self.last_sent = now
+        return True
+
+    def stop(self):
+        """Returns True when "stopped typing" should be broadcast."""
+        if not self.active:
+            return False
+        self.active = False
+        self.last_sent = None
+        return True
+
+
+_store = None
+
+
+def get_presence_store():
+    global _store
+    if _store is None:
+        _store = PresenceStore()
+    return _store
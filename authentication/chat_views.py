@@ -5,58 +5,93 @@ This module contains views for the real-time chat functionality
 between buyers and sellers.
 """
 
+import hashlib
 import json
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import HttpResponseNotModified, JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Q, Max, Count
+from django.db.models import Q, Max, Count, Case, When, F, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from django.core.paginator import Paginator
 from django.conf import settings
 
+from .chat_presence import get_presence_store
 from .models import Conversation, Message, User, Post, PropertyInquiry
+from .pagination_utils import InvalidCursor, keyset_paginate
+
+# Inbox order: most recent activity first. Conversations without messages
+# sort by creation time, so the cursor key is never NULL.
+INBOX_ORDERING = ('-activity_at', '-id')
+INBOX_PAGE_SIZE = 50
+INBOX_MAX_PAGE_SIZE = 100
+# Message history pages (api_get_messages)
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 100
+
+
+def inbox_queryset(user):
+    """
+    Active conversations of ``user`` with everything an inbox row needs.
+    
+    Participants, property and the denormalized last message are joined,
+    so any page of the inbox is a single query.
+    """
+    return Conversation.objects.filter(
+        Q(buyer=user) | Q(seller=user),
+        status='active'
+    ).select_related(
+        'buyer', 'seller', 'property', 'last_message'
+    ).annotate(
+        activity_at=Coalesce('last_message_at', 'created_at')
+    )
+
+
+def unread_conversations(user):
+    """Active conversations with unread messages for ``user``, annotated with ``unread``."""
+    # The partial unread indexes only cover conversations with something unread
+    return Conversation.objects.filter(
+        Q(buyer=user, buyer_unread_count__gt=0) | Q(seller=user, seller_unread_count__gt=0),
+        status='active'
+    ).annotate(
+        unread=Case(When(buyer=user, then=F('buyer_unread_count')), default=F('seller_unread_count'))
+    ).order_by()
 
 
 @login_required
 def chat_list(request):
     """
     Display list of all conversations for the current user.
-    Shows both buyer and seller conversations.
+    Shows both buyer and seller conversations, newest activity first,
+    a page at a time (``?cursor=`` loads older conversations).
     """
     user = request.user
     
-    # Get all conversations where user is either buyer or seller
-    conversations = Conversation.objects.filter(
-        Q(buyer=user) | Q(seller=user),
-        status='active'
-    ).select_related(
-        'buyer', 'seller', 'property'
-    ).prefetch_related(
-        'messages'
-    ).order_by('-last_message_at', '-created_at')
-    
-    # Add unread counts and last message to each conversation
-    conversations_with_data = []
-    total_unread = 0
-    
-    for conv in conversations:
-        unread_count = conv.get_unread_count(user)
-        total_unread += unread_count
-        last_message = conv.get_last_message()
-        other_user = conv.get_other_participant(user)
-        
-        conversations_with_data.append({
+    try:
+        page = keyset_paginate(inbox_queryset(user), INBOX_ORDERING, request.GET.get('cursor'), INBOX_PAGE_SIZE)
+    except InvalidCursor:
+        page = keyset_paginate(inbox_queryset(user), INBOX_ORDERING, None, INBOX_PAGE_SIZE)
+    
+    # Unread counts and last message come from the stored columns
+    conversations_with_data = [
+        {
             'conversation': conv,
-            'unread_count': unread_count,
-            'last_message': last_message,
-            'other_user': other_user,
-        })
+            'unread_count': conv.get_unread_count(user),
+            'last_message': conv.last_message,
+            'other_user': conv.get_other_participant(user),
+        }
+        for conv in page
+    ]
+    
+    total_unread = unread_conversations(user).aggregate(total=Sum('unread'))['total'] or 0
     
     context = {
         'conversations': conversations_with_data,
         'total_unread': total_unread,
+        'next_cursor': page.next_cursor,
     }
     
     return render(request, 'authentication/chat_list.html', context)
@@ -254,13 +289,12 @@ def start_conversation_from_inquiry(request, inquiry_id):
     )
     
     # Create initial system message with inquiry context
-    Message.objects.create(
+    message = Message.objects.create(
         conversation=conversation,
         sender=inquiry.buyer,
         content=f"📋 Inquiry Reference: {inquiry.inquiry_id}\n\n{inquiry.message}"
     )
-    conversation.last_message_at = timezone.now()
-    conversation.save()
+    conversation.record_new_message(message)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
@@ -280,56 +314,124 @@ def start_conversation_from_inquiry(request, inquiry_id):
 @require_http_methods(['GET'])
 def api_get_messages(request, conversation_id):
     """
-    API endpoint to get messages for a conversation.
-    Supports pagination with 'before' parameter for loading older messages.
+    API endpoint to get messages for a conversation, oldest first.
+    
+    Cursor by message id in either direction: ``before=<id>`` pages back
+    through history, ``after=<id>`` fetches what arrived since (e.g. after a
+    reconnect). ``limit`` is capped at ``HISTORY_MAX_PAGE_SIZE``, and
+    ``fields=compact`` drops the per-message sender details and attachment
+    metadata. Responses carry an ETag built from the page parameters and the
+    state of the conversation (see ``history_etag``), so an unchanged page
+    answers ``304``.
     """
     user = request.user
     
     # Verify conversation access
     conversation = get_object_or_404(
-        Conversation,
+        Conversation.objects.only('last_message_at', 'buyer_last_read', 'seller_last_read'),
         Q(buyer=user) | Q(seller=user),
         id=conversation_id
     )
     
-    # Get pagination params
-    before_id = request.GET.get('before')
-    limit = min(int(request.GET.get('limit', 50)), 100)
-    
-    # Build query
-    messages_qs = conversation.messages.filter(is_deleted=False).select_related('sender')
-    
-    if before_id:
-        messages_qs = messages_qs.filter(id__lt=before_id)
-    
-    messages = messages_qs.order_by('-created_at')[:limit]
-    
-    # Format messages for JSON response
-    messages_data = []
-    for msg in reversed(list(messages)):
-        messages_data.append({
-            'id': msg.id,
-            'content': msg.get_display_content(),
-            'sender_id': msg.sender.id,
-            'sender_name': msg.sender.get_full_name() or msg.sender.username,
-            'sender_avatar': msg.sender.profile_picture.url if msg.sender.profile_picture else None,
-            'is_mine': msg.sender == user,
-            'is_read': msg.is_read,
-            'timestamp': msg.created_at.isoformat(),
-            'has_attachment': bool(msg.attachment),
-            'attachment_url': msg.attachment.url if msg.attachment else None,
-            'attachment_type': msg.attachment_type,
-        })
-    
-    # Reverse again to show oldest first (for display)
-    messages_data = list(reversed(messages_data))
+    compact = request.GET.get('fields') == 'compact'
     
-    return JsonResponse({
+    # Get pagination params
+    try:
+        before_id = int(request.GET['before']) if request.GET.get('before') else None
+        after_id = int(request.GET['after']) if request.GET.get('after') else None
+        limit = int(request.GET.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor or limit'}, status=400)
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    
+    etag = history_etag(conversation, compact, before_id, after_id, limit)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+    
+    # Build query; ids increase with send order, so they are the cursor
+    messages_qs = Message.objects.filter(conversation_id=conversation.id, is_deleted=False)
+    if not compact:
+        messages_qs = messages_qs.select_related('sender')
+    
+    if after_id is not None:
+        messages_qs = messages_qs.filter(id__gt=after_id)
+        if before_id is not None:
+            messages_qs = messages_qs.filter(id__lt=before_id)
+        # Oldest first, continuing forward from the cursor
+        messages = list(messages_qs.order_by('id')[:limit + 1])
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        if before_id is not None:
+            messages_qs = messages_qs.filter(id__lt=before_id)
+        # Newest page before the cursor, shown oldest first
+        messages = list(messages_qs.order_by('-id')[:limit + 1])
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
+    
+    serialize = compact_message if compact else full_message
+    response = JsonResponse({
         'success': True,
-        'messages': messages_data,
-        'has_more': len(messages) == limit,
+        'messages': [serialize(msg, user) for msg in messages],
+        'has_more': has_more,
+        'oldest_id': messages[0].id if messages else None,
+        'newest_id': messages[-1].id if messages else None,
         'conversation_id': conversation.id
     })
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def history_etag(conversation, compact=False, before_id=None, after_id=None, limit=HISTORY_PAGE_SIZE):
+    """
+    ETag for one page of a conversation's message history.
+    
+    The page is identified by its normalized parameters. New messages move
+    ``last_message_at`` and read receipts move the participants'
+    ``*_last_read``; deleting or editing a message moves the newest
+    ``updated_at`` among the messages, and hard deletes change their count.
+    """
+    changes = Message.objects.filter(conversation_id=conversation.id).aggregate(
+        last_change=Max('updated_at'), total=Count('pk'),
+    )
+    parts = [conversation.id, conversation.last_message_at, conversation.buyer_last_read,
+             conversation.seller_last_read, changes['last_change'], changes['total'],
+             'compact' if compact else 'full', before_id, after_id, limit]
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode(), usedforsecurity=False).hexdigest()
+    return quote_etag(digest)
+
+
+def full_message(msg, user):
+    return {
+        'id': msg.id,
+        'content': msg.get_display_content(),
+        'sender_id': msg.sender_id,
+        'sender_name': msg.sender.get_full_name() or msg.sender.username,
+        'sender_avatar': msg.sender.profile_picture.url if msg.sender.profile_picture else None,
+        'is_mine': msg.sender_id == user.id,
+        'is_read': msg.is_read,
+        'timestamp': msg.created_at.isoformat(),
+        'has_attachment': bool(msg.attachment),
+        'attachment_url': msg.attachment.url if msg.attachment else None,
+        'attachment_type': msg.attachment_type,
+    }
+
+
+def compact_message(msg, user):
+    """Just what a client that already knows both participants needs."""
+    data = {
+        'id': msg.id,
+        'content': msg.content,
+        'sender_id': msg.sender_id,
+        'is_read': msg.is_read,
+        'timestamp': msg.created_at.isoformat(),
+    }
+    if msg.attachment:
+        data['attachment_url'] = msg.attachment.url
+    return data
 
 
 @login_required
@@ -374,9 +476,8 @@ def api_send_message(request, conversation_id):
         content=content
     )
     
-    # Update conversation timestamp
-    conversation.last_message_at = timezone.now()
-    conversation.save(update_fields=['last_message_at'])
+    # Update conversation timestamp and the recipient's unread counter
+    conversation.record_new_message(message)
     
     return JsonResponse({
         'success': True,
@@ -415,27 +516,38 @@ def api_mark_read(request, conversation_id):
 
 @login_required
 @require_http_methods(['GET'])
-def api_unread_count(request):
+def api_presence(request, conversation_id):
     """
-    API endpoint to get total unread message count for the current user.
-    Useful for updating notification badges.
+    API endpoint for who is online in a conversation, for clients without a socket.
     """
     user = request.user
     
-    # Get all active conversations
-    conversations = Conversation.objects.filter(
+    conversation = get_object_or_404(
+        Conversation.objects.only('buyer_id', 'seller_id'),
         Q(buyer=user) | Q(seller=user),
-        status='active'
+        id=conversation_id
     )
     
-    total_unread = 0
-    unread_by_conversation = {}
+    state = get_presence_store().snapshot(conversation.id, [conversation.buyer_id, conversation.seller_id])
     
-    for conv in conversations:
-        count = conv.get_unread_count(user)
-        if count > 0:
-            total_unread += count
-            unread_by_conversation[conv.id] = count
+    return JsonResponse({
+        'success': True,
+        'users': {str(user_id): entry for user_id, entry in state.items()},
+    })
+
+
+@login_required
+@require_http_methods(['GET'])
+def api_unread_count(request):
+    """
+    API endpoint to get total unread message count for the current user.
+    Useful for updating notification badges.
+    """
+    user = request.user
+    
+    # One query over the stored counters
+    unread_by_conversation = dict(unread_conversations(user).values_list('id', 'unread'))
+    total_unread = sum(unread_by_conversation.values())
     
     return JsonResponse({
         'success': True,
@@ -449,20 +561,28 @@ def api_unread_count(request):
 def api_conversations(request):
     """
     API endpoint to get list of conversations for the current user.
+    Paginated with ``limit`` and an opaque ``cursor`` from ``next_cursor``.
     """
     user = request.user
     
-    conversations = Conversation.objects.filter(
-        Q(buyer=user) | Q(seller=user),
-        status='active'
-    ).select_related(
-        'buyer', 'seller', 'property'
-    ).order_by('-last_message_at', '-created_at')
+    try:
+        limit = int(request.GET.get('limit', INBOX_PAGE_SIZE))
+    except ValueError:
+        limit = INBOX_PAGE_SIZE
+    limit = max(1, min(limit, INBOX_MAX_PAGE_SIZE))
+    
+    try:
+        page = keyset_paginate(inbox_queryset(user), INBOX_ORDERING, request.GET.get('cursor'), limit)
+    except InvalidCursor:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid cursor'
+        }, status=400)
     
     conversations_data = []
-    for conv in conversations:
+    for conv in page:
         other_user = conv.get_other_participant(user)
-        last_message = conv.get_last_message()
+        last_message = conv.last_message
         
         conversations_data.append({
             'id': conv.id,
@@ -480,16 +600,20 @@ def api_conversations(request):
             } if conv.property else None,
             'unread_count': conv.get_unread_count(user),
             'last_message': {
-                'content': last_message.get_display_content()[:100] if last_message else None,
-                'timestamp': last_message.created_at.isoformat() if last_message else None,
-                'is_mine': last_message.sender == user if last_message else False,
+                'id': last_message.id,
+                'content': last_message.get_display_content()[:100],
+                'timestamp': last_message.created_at.isoformat(),
+                'sender_id': last_message.sender_id,
+                'is_mine': last_message.sender_id == user.id,
             } if last_message else None,
             'created_at': conv.created_at.isoformat(),
         })
     
     return JsonResponse({
         'success': True,
-        'conversations': conversations_data
+        'conversations': conversations_data,
+        'has_more': page.has_next(),
+        'next_cursor': page.next_cursor,
     })
 
 
@@ -5,11 +5,26 @@ This module contains the WebSocket consumers that handle real-time
 chat communication between buyers and sellers.
 """
 
+import asyncio
 import json
+import time
+import uuid
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.utils import timezone
 
+from .chat_notifications import notify_unread_count, user_group
+from .chat_persistence import get_write_behind_queue
+from .chat_presence import TypingThrottle, get_presence_store, presence_ttl
+
+
+def write_behind_enabled():
+    return getattr(settings, 'CHAT_PERSISTENCE_MODE', 'sync') == 'write_behind'
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
     """
@@ -18,8 +33,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
     This consumer handles:
     - Connection/disconnection to chat rooms
     - Sending and receiving messages
-    - Typing indicators
-    - Read receipts
+    - Typing indicators (throttled, see chat_presence.TypingThrottle)
+    - Presence (cache-backed, see chat_presence.PresenceStore)
+    - Read receipts (per message, or coalesced "read up to message N")
     """
     
     async def connect(self):
@@ -30,6 +46,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # Get conversation ID from URL route
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
         self.room_group_name = f'chat_{self.conversation_id}'
+        self.joined = False
         
         # Get the user from the scope (set by AuthMiddlewareStack)
         self.user = self.scope.get('user')
@@ -39,6 +56,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
+        # Highest message id this socket has already marked read
+        self.last_read_up_to = 0
+        self.typing = TypingThrottle()
+        self.typing_stop_task = None
+        self.presence_refresh_at = 0
+        
         # Verify user has access to this conversation
         has_access = await self.verify_conversation_access()
         if not has_access:
@@ -53,38 +76,42 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         # Accept the WebSocket connection
         await self.accept()
+        self.joined = True
         
-        # Notify others that user has joined
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_join',
-                'user_id': self.user.id,
-                'username': self.user.username,
-            }
-        )
+        # Only announce the user if this is their first live socket here
+        self.presence_refresh_at = time.monotonic() + presence_ttl() / 2
+        if await sync_to_async(get_presence_store().join)(self.conversation_id, self.user.id):
+            await self.broadcast_presence(online=True)
+        await self.send_presence_state()
     
     async def disconnect(self, close_code):
         """
         Called when a WebSocket connection is closed.
         Removes the user from the conversation's channel group.
         """
-        # Notify others that user has left
-        if hasattr(self, 'room_group_name'):
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_leave',
-                    'user_id': self.user.id,
-                    'username': self.user.username,
-                }
-            )
+        if self.joined:
+            # Don't leave the other side looking at "typing..."
+            if self.typing_stop_task:
+                self.typing_stop_task.cancel()
+            if self.typing.stop():
+                await self.broadcast_typing(False)
+            
+            # Only announce the user leaving once their last socket here is gone
+            if await sync_to_async(get_presence_store().leave)(self.conversation_id, self.user.id):
+                await self.broadcast_presence(online=False)
             
             # Leave the room group
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
             )
+            
+            # Don't leave this user's messages sitting in the write-behind buffer
+            if write_behind_enabled():
+                try:
+                    await get_write_behind_queue().flush()
+                except Exception:
+                    pass  # logged by the queue; retried on the next flush or at exit
     
     async def receive(self, text_data):
         """
@@ -95,12 +122,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
             data = json.loads(text_data)
             message_type = data.get('type', 'chat_message')
             
+            # Any frame proves the socket is alive; announce a user who had aged out
+            if await self.touch_presence():
+                await self.broadcast_presence(online=True)
+            
             if message_type == 'chat_message':
                 await self.handle_chat_message(data)
             elif message_type == 'typing':
                 await self.handle_typing(data)
             elif message_type == 'read_receipt':
                 await self.handle_read_receipt(data)
+            elif message_type == 'read_up_to':
+                await self.handle_read_up_to(data)
+            elif message_type == 'presence':
+                await self.send_presence_state()
             elif message_type == 'ping':
                 # Respond to ping for connection keep-alive
                 await self.send(text_data=json.dumps({'type': 'pong'}))
@@ -118,14 +153,35 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not message_content:
             return
         
+        if self.status != 'active':
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'This conversation is no longer active'
+            }))
+            return
+        
         # Truncate message if too long
-        from django.conf import settings
         max_length = getattr(settings, 'CHAT_MESSAGE_MAX_LENGTH', 2000)
         if len(message_content) > max_length:
             message_content = message_content[:max_length]
         
-        # Save message to database
-        message_data = await self.save_message(message_content)
+        # Client-generated id lets the sender match the broadcast and the later ack
+        client_id = str(data.get('client_id') or uuid.uuid4())[:64]
+        
+        if write_behind_enabled():
+            # Broadcast first; the message is persisted with the next batch
+            created_at = timezone.now()
+            message_data = self.message_payload(None, message_content, created_at, client_id)
+            await get_write_behind_queue().enqueue({
+                'conversation_id': int(self.conversation_id),
+                'sender_id': self.user.id,
+                'content': message_content,
+                'created_at': created_at,
+                'client_id': client_id,
+            })
+        else:
+            # Save message to database
+            message_data = await self.save_message(message_content, client_id)
         
         if message_data:
             # Broadcast message to room group
@@ -138,9 +194,29 @@ class ChatConsumer(AsyncWebsocketConsumer):
             )
     
     async def handle_typing(self, data):
-        """Handle typing indicator."""
-        is_typing = data.get('is_typing', False)
+        """
+        Handle typing indicator.
         
+        "Started" is forwarded at most once per ``CHAT_TYPING_THROTTLE``
+        seconds; "stopped" is delayed by ``CHAT_TYPING_STOP_GRACE`` and
+        dropped if typing resumes in the meantime.
+        """
+        if data.get('is_typing', False):
+            if self.typing_stop_task:
+                self.typing_stop_task.cancel()
+                self.typing_stop_task = None
+            if self.typing.start():
+                await self.broadcast_typing(True)
+        elif self.typing.active and self.typing_stop_task is None:
+            self.typing_stop_task = asyncio.ensure_future(self.stop_typing_later())
+    
+    async def stop_typing_later(self):
+        await asyncio.sleep(getattr(settings, 'CHAT_TYPING_STOP_GRACE', 1))
+        self.typing_stop_task = None
+        if self.typing.stop():
+            await self.broadcast_typing(False)
+    
+    async def broadcast_typing(self, is_typing):
         await self.channel_layer.group_send(
             self.room_group_name,
             {
@@ -151,6 +227,39 @@ class ChatConsumer(AsyncWebsocketConsumer):
             }
         )
     
+    async def touch_presence(self):
+        """
+        Refresh this socket in the presence store, at most twice per TTL.
+        
+        Returns True when the user had aged out and is online again.
+        """
+        now = time.monotonic()
+        if now < self.presence_refresh_at:
+            return False
+        self.presence_refresh_at = now + presence_ttl() / 2
+        return await sync_to_async(get_presence_store().touch)(self.conversation_id, self.user.id)
+    
+    async def broadcast_presence(self, online):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'presence_changed',
+                'user_id': self.user.id,
+                'username': self.user.username,
+                'online': online,
+            }
+        )
+    
+    async def send_presence_state(self):
+        """Send this socket who of the two participants is online."""
+        state = await sync_to_async(get_presence_store().snapshot)(
+            self.conversation_id, [self.buyer_id, self.seller_id]
+        )
+        await self.send(text_data=json.dumps({
+            'type': 'presence_state',
+            'users': {str(user_id): entry for user_id, entry in state.items()},
+        }))
+    
     async def handle_read_receipt(self, data):
         """Handle read receipt for messages."""
         message_id = data.get('message_id')
@@ -169,6 +278,34 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 }
             )
     
+    async def handle_read_up_to(self, data):
+        """
+        Handle a coalesced receipt: everything up to ``message_id`` has been seen.
+        
+        Receipts at or below the last one handled on this socket are dropped
+        without touching the database; otherwise one bulk update marks the
+        messages read and one event tells the other participant.
+        """
+        try:
+            message_id = int(data.get('message_id'))
+        except (TypeError, ValueError):
+            return
+        
+        if message_id <= self.last_read_up_to:
+            return
+        self.last_read_up_to = message_id
+        
+        marked = await self.mark_read_up_to(message_id)
+        if marked:
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'messages_read',
+                    'up_to': message_id,
+                    'read_by': self.user.id,
+                }
+            )
+    
     # ==========================================
     # Channel layer message handlers
     # ==========================================
@@ -180,6 +317,23 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'message': event['message']
         }))
     
+    async def message_persisted(self, event):
+        """Tell clients which database ids write-behind messages were stored under."""
+        await self.send(text_data=json.dumps({
+            'type': 'message_ack',
+            'messages': event['messages'],
+        }))
+    
+    async def conversation_status(self, event):
+        """Control message: the conversation was archived, blocked or reactivated."""
+        self.status = event['status']
+        await self.send(text_data=json.dumps({
+            'type': 'conversation_status',
+            'status': event['status'],
+        }))
+        if event['status'] != 'active':
+            await self.close()
+    
     async def typing_indicator(self, event):
         """Send typing indicator to WebSocket."""
         # Don't send typing indicator to the user who is typing
@@ -199,22 +353,23 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'read_by': event['read_by'],
         }))
     
-    async def user_join(self, event):
-        """Notify that a user has joined."""
-        if event['user_id'] != self.user.id:
+    async def messages_read(self, event):
+        """Send a coalesced read receipt to the sender's WebSocket."""
+        if event['read_by'] != self.user.id:
             await self.send(text_data=json.dumps({
-                'type': 'user_join',
-                'user_id': event['user_id'],
-                'username': event['username'],
+                'type': 'read_up_to',
+                'message_id': event['up_to'],
+                'read_by': event['read_by'],
             }))
     
-    async def user_leave(self, event):
-        """Notify that a user has left."""
+    async def presence_changed(self, event):
+        """Notify that the other participant came online or went offline."""
         if event['user_id'] != self.user.id:
             await self.send(text_data=json.dumps({
-                'type': 'user_leave',
+                'type': 'presence',
                 'user_id': event['user_id'],
                 'username': event['username'],
+                'online': event['online'],
             }))
     
     # ==========================================
@@ -226,19 +381,43 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """
         Verify that the current user has access to this conversation.
         Returns True if user is a participant, False otherwise.
+        
+        Participants and status are kept on the consumer for the life of the
+        socket; status changes arrive as ``conversation_status`` events.
         """
         from authentication.models import Conversation
         
         try:
             # Convert conversation_id to integer
             conv_id = int(self.conversation_id)
-            conversation = Conversation.objects.get(id=conv_id)
-            return conversation.buyer == self.user or conversation.seller == self.user
-        except (Conversation.DoesNotExist, ValueError):
+        except ValueError:
             return False
+        
+        conversation = Conversation.objects.filter(id=conv_id).values('buyer_id', 'seller_id', 'status').first()
+        if conversation is None or self.user.id not in (conversation['buyer_id'], conversation['seller_id']):
+            return False
+        
+        self.buyer_id = conversation['buyer_id']
+        self.seller_id = conversation['seller_id']
+        self.status = conversation['status']
+        return True
+    
+    def message_payload(self, message_id, content, created_at, client_id):
+        """Build the broadcast dictionary for a message sent by the connected user."""
+        return {
+            'id': message_id,
+            'client_id': client_id,
+            'content': content,
+            'sender_id': self.user.id,
+            'sender_name': self.user.get_full_name() or self.user.username,
+            'sender_avatar': self.user.profile_picture.url if self.user.profile_picture else None,
+            'timestamp': created_at.isoformat(),
+            'is_read': False,
+            'is_mine': True,
+        }
     
     @database_sync_to_async
-    def save_message(self, content):
+    def save_message(self, content, client_id=None):
         """
         Save a message to the database.
         Returns message data dictionary.
@@ -246,30 +425,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
         from authentication.models import Conversation, Message
         
         try:
-            # Convert conversation_id to integer
-            conv_id = int(self.conversation_id)
-            conversation = Conversation.objects.get(id=conv_id)
+            # Participants were loaded at connect; no need to refetch the row
+            conversation = Conversation(
+                id=int(self.conversation_id), buyer_id=self.buyer_id, seller_id=self.seller_id
+            )
             
             message = Message.objects.create(
                 conversation=conversation,
                 sender=self.user,
-                content=content
+                content=content,
+                client_id=client_id
             )
             
-            # Update conversation's last message timestamp
-            conversation.last_message_at = timezone.now()
-            conversation.save(update_fields=['last_message_at'])
+            # Update conversation's last message timestamp and unread counter
+            conversation.record_new_message(message)
             
-            return {
-                'id': message.id,
-                'content': message.content,
-                'sender_id': message.sender.id,
-                'sender_name': message.sender.get_full_name() or message.sender.username,
-                'sender_avatar': message.sender.profile_picture.url if message.sender.profile_picture else None,
-                'timestamp': message.created_at.isoformat(),
-                'is_read': message.is_read,
-                'is_mine': message.sender == self.user,
-            }
+            return self.message_payload(message.id, message.content, message.created_at, client_id)
         except Exception as e:
             print(f"Error saving message: {e}")
             return None
@@ -277,17 +448,93 @@ class ChatConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def mark_message_read(self, message_id):
         """Mark a message as read."""
-        from authentication.models import Message
+        from authentication.models import Conversation, Message
         
-        try:
-            message = Message.objects.get(id=message_id)
-            # Only mark as read if the user is not the sender
-            if message.sender != self.user and not message.is_read:
-                message.is_read = True
-                message.read_at = timezone.now()
-                message.save(update_fields=['is_read', 'read_at'])
-                return True
-        except Message.DoesNotExist:
-            pass
-        return False
+        # Only mark as read if the user is not the sender
+        now = timezone.now()
+        marked = Message.objects.filter(
+            id=message_id, conversation_id=int(self.conversation_id), is_read=False
+        ).exclude(sender_id=self.user.id).update(is_read=True, read_at=now)
+        if marked:
+            role = 'buyer' if self.user.id == self.buyer_id else 'seller'
+            unread_field = f'{role}_unread_count'
+            conversation = Conversation.objects.filter(id=int(self.conversation_id))
+            # Moving *_last_read also invalidates the history ETag
+            conversation.update(**{
+                unread_field: Greatest(F(unread_field) - 1, 0),
+                f'{role}_last_read': now,
+            })
+            notify_unread_count(
+                self.user.id, int(self.conversation_id), conversation.values_list(unread_field, flat=True).first()
+            )
+        return bool(marked)
+    
+    @database_sync_to_async
+    def mark_read_up_to(self, message_id):
+        """Mark the other participant's messages up to ``message_id`` as read."""
+        from authentication.models import Conversation
+        
+        conversation = Conversation(
+            id=int(self.conversation_id), buyer_id=self.buyer_id, seller_id=self.seller_id
+        )
+        return conversation.mark_read_up_to(self.user, message_id)
+
 
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    One WebSocket per user for everything outside an open chat room.
+    
+    Joins the ``user_<id>`` group and forwards the ``new_message``,
+    ``unread_count`` and ``conversation_update`` events pushed by
+    ``chat_notifications``. On connect the socket gets an ``unread_summary``
+    so clients never need to poll ``api_unread_count``.
+    """
+    
+    async def connect(self):
+        self.user = self.scope.get('user')
+        self.group_name = None
+        
+        if not self.user or not self.user.is_authenticated:
+            await self.close()
+            return
+        
+        self.group_name = user_group(self.user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        
+        await self.send(text_data=json.dumps(await self.unread_summary()))
+    
+    async def disconnect(self, close_code):
+        if self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+    
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'Invalid JSON format'
+            }))
+            return
+        
+        if data.get('type') == 'ping':
+            await self.send(text_data=json.dumps({'type': 'pong'}))
+        elif data.get('type') == 'unread_summary':
+            await self.send(text_data=json.dumps(await self.unread_summary()))
+    
+    async def notify(self, event):
+        """Forward an event from chat_notifications to the WebSocket."""
+        await self.send(text_data=json.dumps(event['event']))
+    
+    @database_sync_to_async
+    def unread_summary(self):
+        """Unread counts per conversation, from the stored counters in one query."""
+        from authentication.chat_views import unread_conversations
+        
+        by_conversation = dict(unread_conversations(self.user).values_list('id', 'unread'))
+        return {
+            'type': 'unread_summary',
+            'total_unread': sum(by_conversation.values()),
+            'by_conversation': {str(conversation_id): unread for conversation_id, unread in by_conversation.items()},
+        }
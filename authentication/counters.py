@@ -0,0 +1,69 @@
+"""
+Denormalized engagement counters stored on ``Post``.
+
+``likes_count``, ``reviews_count``, ``rating_sum`` and ``rating_avg`` are
+kept in step with likes and reviews by the handlers in ``signals.py`` using
+single ``UPDATE ... SET col = col + n`` statements, so concurrent likes or
+reviews never overwrite each other. Rows removed by cascading deletes (for
+example deleting a user) do not fire those signals; run
+``manage.py rebuild_post_counters`` to recompute everything from scratch.
+"""
+
+from django.db.models import Avg, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+from .models import Post, ProductReview
+
+
+def apply_like_delta(post_ids, delta):
+    """Add ``delta`` to ``likes_count`` of every post in ``post_ids``."""
+    if post_ids:
+        Post.objects.filter(pk__in=post_ids).update(likes_count=F('likes_count') + delta)
+
+
+def apply_review_delta(post_id, count_delta, rating_delta):
+    """Shift a post's review count and rating sum, recomputing the average in the same UPDATE."""
+    new_count = F('reviews_count') + count_delta
+    new_sum = F('rating_sum') + rating_delta
+    Post.objects.filter(pk=post_id).update(
+        reviews_count=new_count,
+        rating_sum=new_sum,
+        # SET expressions read the old column values, so derive the average from the new ones
+        rating_avg=Coalesce(
+            Cast(new_sum, FloatField()) / NullIf(new_count, Value(0)),
+            Value(0.0),
+            output_field=FloatField(),
+        ),
+    )
+
+
+def _aggregate_subquery(queryset, fk_name, aggregate, output_field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{fk_name: OuterRef('pk')})
+            .order_by()
+            .values(fk_name)
+            .annotate(value=aggregate)
+            .values('value')[:1]
+        ),
+        Value(0),
+        output_field=output_field,
+    )
+
+
+def rebuild_post_counters(queryset=None):
+    """
+    Recompute the counters for ``queryset`` (default: all posts) from source rows.
+
+    Runs as one ``UPDATE`` with correlated subqueries; returns the number of posts updated.
+    """
+    if queryset is None:
+        queryset = Post.objects.all()
+    likes = Post.likes.through.objects.all()
+    reviews = ProductReview.objects.all()
+    return queryset.update(
+        likes_count=_aggregate_subquery(likes, 'post', Count('pk'), IntegerField()),
+        reviews_count=_aggregate_subquery(reviews, 'product', Count('pk'), IntegerField()),
+        rating_sum=_aggregate_subquery(reviews, 'product', Sum('rating'), IntegerField()),
+        rating_avg=_aggregate_subquery(reviews, 'product', Avg('rating'), FloatField()),
+    )
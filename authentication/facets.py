@@ -0,0 +1,138 @@
+"""
+Listing facet counts for the browse filters.
+
+``listing_facets`` returns how many listings fall in each category, property
+type, district, condition and price band, from a single grouped query over the
+queryset it is given: rows are grouped by all five dimensions at once and the
+per-facet counts are folded together in Python. The number of groups is
+bounded by the distinct combinations actually listed, not by the number of
+listings.
+
+Facets are disjunctive: pass the facet filters the user picked as
+``selected`` instead of applying them to the queryset, and each facet is
+counted with every selection *except its own*, so picking "villa" still shows
+how many apartments there are. Price bands and ``total`` honour every
+selection.
+"""
+
+from django.db.models import Case, CharField, Count, Q, Value, When
+from django.db.models.functions import Lower, Trim
+
+from .models import Post
+
+# (value, label, lower bound inclusive, upper bound exclusive) in RWF
+PRICE_BUCKETS = (
+    ('under_100k', 'Under 100,000', None, 100_000),
+    ('100k_1m', '100,000 - 1,000,000', 100_000, 1_000_000),
+    ('1m_10m', '1,000,000 - 10,000,000', 1_000_000, 10_000_000),
+    ('10m_50m', '10,000,000 - 50,000,000', 10_000_000, 50_000_000),
+    ('50m_plus', '50,000,000 and above', 50_000_000, None),
+)
+
+# Facet name -> Post field; the keys are also the dashboard_api filter parameters
+FACET_FIELDS = {
+    'category': 'category',
+    'property_type': 'property_type',
+    'district': 'location_district',
+    'condition': 'condition',
+}
+
+FACET_CHOICES = {
+    'category': Post.CATEGORY_CHOICES,
+    'property_type': Post.PROPERTY_TYPE_CHOICES,
+    'condition': Post.CONDITION_CHOICES,
+}
+
+
+def price_bucket_expression():
+    whens = []
+    for value, _, low, high in PRICE_BUCKETS:
+        condition = Q()
+        if low is not None:
+            condition &= Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        whens.append(When(condition, then=Value(value)))
+    return Case(*whens, output_field=CharField())
+
+
+def normalize_district(district):
+    # Matches Lower(Trim(...)) in filter_by_facets, so facet and filter agree
+    return (district or '').strip().lower()
+
+
+def filter_by_facets(queryset, selected):
+    """Apply the ``selected`` facet values (``{facet: value}``) to a ``Post`` queryset."""
+    for facet, value in selected.items():
+        if not value:
+            continue
+        if facet == 'district':
+            queryset = queryset.alias(district_key=Lower(Trim('location_district'))).filter(
+                district_key=normalize_district(value)
+            )
+        else:
+            queryset = queryset.filter(**{FACET_FIELDS[facet]: value})
+    return queryset
+
+
+def listing_facets(queryset, selected=None):
+    """
+    Facet counts for ``queryset`` in one query.
+
+    Returns ``{'total', 'category', 'property_type', 'district', 'condition',
+    'price'}``; each facet is a list of ``{'value', 'label', 'count'}``.
+    Choice facets list every choice (zero counts included) in choice order,
+    districts are the ones in use sorted by count, and price bands also carry
+    ``min_price``/``max_price`` for the existing price filters.
+    """
+    selected = {
+        facet: (normalize_district(value) if facet == 'district' else value)
+        for facet, value in (selected or {}).items() if value
+    }
+    rows = (
+        queryset.order_by()
+        .annotate(price_bucket=price_bucket_expression())
+        .values(*FACET_FIELDS.values(), 'price_bucket')
+        .annotate(count=Count('pk'))
+    )
+
+    counts = {facet: {} for facet in (*FACET_FIELDS, 'price')}
+    district_labels = {}
+    total = 0
+    for row in rows:
+        values = {facet: row[field] for facet, field in FACET_FIELDS.items()}
+        district_key = normalize_district(values['district'])
+        values['district'] = district_key
+        if district_key:
+            district_labels.setdefault(district_key, row['location_district'].strip())
+
+        mismatched = {facet for facet, value in selected.items() if values[facet] != value}
+        if not mismatched:
+            total += row['count']
+            bucket = counts['price']
+            bucket[row['price_bucket']] = bucket.get(row['price_bucket'], 0) + row['count']
+        # A row still counts towards the one facet it fails to match
+        for facet in FACET_FIELDS:
+            if mismatched <= {facet} and (facet != 'district' or district_key):
+                bucket = counts[facet]
+                bucket[values[facet]] = bucket.get(values[facet], 0) + row['count']
+
+    facets = {'total': total}
+    for facet, choices in FACET_CHOICES.items():
+        facets[facet] = [
+            {'value': value, 'label': label, 'count': counts[facet].get(value, 0)}
+            for value, label in choices
+        ]
+    facets['district'] = sorted(
+        (
+            {'value': district_labels[key], 'label': district_labels[key], 'count': count}
+            for key, count in counts['district'].items()
+        ),
+        key=lambda entry: (-entry['count'], entry['label']),
+    )
+    facets['price'] = [
+        {'value': value, 'label': label, 'min_price': low, 'max_price': high,
+         'count': counts['price'].get(value, 0)}
+        for value, label, low, high in PRICE_BUCKETS
+    ]
+    return facets
@@ -0,0 +1,210 @@
+"""
+Radius and bounding-box search over listing locations.
+
+Every ``Post`` with coordinates stores their geohash in ``geo_cell`` (see
+``Post.save``). Nearby points share geohash prefixes, and all geohashes that
+start with a prefix form one contiguous range of strings. A search area is
+therefore covered by a handful of coarse cells, and each cell becomes a range
+scan on the ``geo_cell`` index instead of a scan of every listing. The exact
+latitude/longitude bounds and the radius are then checked on those candidates
+only.
+
+Distances use the equirectangular approximation. It needs only arithmetic,
+so it runs unchanged on SQLite and PostgreSQL without PostGIS. Across a
+country the size of Rwanda it is within a fraction of a percent of the
+great-circle distance.
+"""
+
+import math
+
+from django.conf import settings
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Characters stored in Post.geo_cell; 8 is a cell of about 38m x 19m
+GEOHASH_PRECISION = 8
+# A search area is covered by at most this many cells, as coarse as needed
+MAX_COVER_CELLS = 32
+# Areas that only coarser cells (over ~5km) can cover hold a large share of
+# the listings; reading those through the index is slower than a plain scan
+# (see benchmark_geo_search), so they are filtered on the bounds alone
+MIN_INDEXED_PRECISION = 5
+KM_PER_DEGREE = 111.195
+# Keyset ordering for sort=distance, on the filter_near annotation
+DISTANCE_ORDERING = ('geo_distance_sq', 'id')
+
+
+class InvalidGeoQuery(ValueError):
+    """Raised for malformed ``near``, ``radius_km`` or ``bbox`` parameters."""
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate longitude, latitude, starting with longitude
+        value, interval = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """``(height, width)`` in degrees of a geohash cell of ``precision`` characters."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def _successor(cell):
+    """The next geohash of the same length in sort order, or ``None`` after the last."""
+    index = GEOHASH_ALPHABET.index(cell[-1])
+    if index + 1 < len(GEOHASH_ALPHABET):
+        return cell[:-1] + GEOHASH_ALPHABET[index + 1]
+    if len(cell) == 1:
+        return None
+    parent = _successor(cell[:-1])
+    return parent and parent + GEOHASH_ALPHABET[0]
+
+
+def cover_cells(south, west, north, east, max_cells=MAX_COVER_CELLS):
+    """The finest set of at most ``max_cells`` geohash cells covering the box."""
+    best = None
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        height, width = cell_size(precision)
+        last_row, last_column = round(180 / height) - 1, round(360 / width) - 1
+        rows = range(math.floor((south + 90) / height), min(math.floor((north + 90) / height), last_row) + 1)
+        columns = range(math.floor((west + 180) / width), min(math.floor((east + 180) / width), last_column) + 1)
+        if best is not None and len(rows) * len(columns) > max_cells:
+            break
+        best = sorted({
+            encode_geohash(-90 + (row + 0.5) * height, -180 + (column + 0.5) * width, precision)
+            for row in rows for column in columns
+        })
+    return best
+
+
+def cell_ranges(cells):
+    """
+    Merge sorted cells into ``[(low, high), ...]`` bounds on ``geo_cell``.
+
+    Consecutive cells are merged. Bounds are padded to the stored precision
+    with the last alphabet character, so they only compare alphanumerics and
+    sort the same under any database collation.
+    """
+    ranges = []
+    for cell in cells:
+        if ranges and _successor(ranges[-1][1]) == cell:
+            ranges[-1][1] = cell
+        else:
+            ranges.append([cell, cell])
+    pad = GEOHASH_ALPHABET[-1]
+    return [(low, high + pad * (GEOHASH_PRECISION - len(high))) for low, high in ranges]
+
+
+def _cell_filter(south, west, north, east):
+    condition = Q(
+        location_latitude__gte=south, location_latitude__lte=north,
+        location_longitude__gte=west, location_longitude__lte=east,
+    )
+    cells = cover_cells(south, west, north, east)
+    if len(cells[0]) < MIN_INDEXED_PRECISION:
+        return condition
+    cell_condition = Q()
+    for low, high in cell_ranges(cells):
+        cell_condition |= Q(geo_cell__gte=low, geo_cell__lte=high)
+    return cell_condition & condition
+
+
+def _parse_floats(value, count, name):
+    parts = [part.strip() for part in value.split(',')]
+    if len(parts) != count:
+        raise InvalidGeoQuery(f'{name} needs {count} comma-separated numbers')
+    try:
+        numbers = [float(part) for part in parts]
+    except ValueError:
+        raise InvalidGeoQuery(f'{name} needs {count} comma-separated numbers')
+    if not all(math.isfinite(number) for number in numbers):
+        raise InvalidGeoQuery(f'{name} needs finite numbers')
+    return numbers
+
+
+def _check_point(latitude, longitude, name):
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise InvalidGeoQuery(f'{name} is outside valid latitude/longitude ranges')
+
+
+def parse_near(near, radius_km=None):
+    """Parse ``near=lat,lng`` and ``radius_km`` into ``(lat, lng, radius_km)``."""
+    latitude, longitude = _parse_floats(near, 2, 'near')
+    _check_point(latitude, longitude, 'near')
+    max_radius = getattr(settings, 'GEO_MAX_RADIUS_KM', 100)
+    if radius_km in (None, ''):
+        radius = getattr(settings, 'GEO_DEFAULT_RADIUS_KM', 10)
+    else:
+        try:
+            radius = float(radius_km)
+        except ValueError:
+            raise InvalidGeoQuery('radius_km must be a number')
+        if not 0 < radius <= max_radius:
+            raise InvalidGeoQuery(f'radius_km must be between 0 and {max_radius}')
+    return latitude, longitude, radius
+
+
+def parse_bbox(bbox):
+    """Parse ``bbox=west,south,east,north`` (GeoJSON order) into ``(south, west, north, east)``."""
+    west, south, east, north = _parse_floats(bbox, 4, 'bbox')
+    _check_point(south, west, 'bbox')
+    _check_point(north, east, 'bbox')
+    if south > north or west > east:
+        raise InvalidGeoQuery('bbox must be west,south,east,north')
+    return south, west, north, east
+
+
+def filter_bbox(queryset, south, west, north, east):
+    """Listings whose coordinates fall inside the box."""
+    return queryset.filter(_cell_filter(south, west, north, east))
+
+
+def filter_near(queryset, latitude, longitude, radius_km):
+    """
+    Listings within ``radius_km`` of the point.
+
+    Each one is annotated with ``geo_distance_sq``, the squared distance in
+    km², which is what ``DISTANCE_ORDERING`` sorts on; ``distance_km`` turns
+    it back into kilometres.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    dlng = dlat / max(math.cos(math.radians(latitude)), 1e-6)
+    south, north = max(latitude - dlat, -90), min(latitude + dlat, 90)
+    west, east = max(longitude - dlng, -180), min(longitude + dlng, 180)
+
+    return queryset.filter(_cell_filter(south, west, north, east)).annotate(
+        geo_distance_sq=distance_sq_expression(latitude, longitude)
+    ).filter(geo_distance_sq__lte=radius_km * radius_km)
+
+
+def distance_sq_expression(latitude, longitude):
+    """Squared equirectangular distance in km² from the point to a listing."""
+    scale = KM_PER_DEGREE * math.cos(math.radians(latitude))
+    dy = (Cast(F('location_latitude'), FloatField()) - latitude) * KM_PER_DEGREE
+    dx = (Cast(F('location_longitude'), FloatField()) - longitude) * scale
+    return dy * dy + dx * dx
+
+
+def distance_km(post):
+    """Distance from the ``filter_near`` point, or ``None`` without one."""
+    distance_sq = getattr(post, 'geo_distance_sq', None)
+    if distance_sq is None:
+        return None
+    return round(math.sqrt(distance_sq), 2)
@@ -0,0 +1,219 @@
+"""
+Database-backed background jobs.
+
+Slow work (PDF builds, SMTP, QR rendering, payment gateway calls) can be
+handed to ``enqueue`` instead of running on the request thread. The job is a
+``Job`` row; ``manage.py run_jobs`` workers claim due jobs, run the
+registered task function with the job's payload, and store its result or
+error. Nothing outside the database is needed, so it works the same with
+SQLite in development and PostgreSQL in production. Run as many worker
+processes as the load needs.
+
+Tasks are registered with ``@task(name, ...)`` (see ``tasks.py``). Each one
+can set:
+
+- ``concurrency``: how many of its jobs may run at once across all workers,
+  overridable per task with the ``JOBS_CONCURRENCY`` setting.
+- ``max_attempts``: failed jobs are retried after ``backoff * 2**(n-1)``
+  seconds (capped at ``JOBS_MAX_BACKOFF``) until attempts run out. Raise
+  ``PermanentJobError`` to fail at once, e.g. when retrying is pointless or
+  unsafe.
+
+Claiming is a conditional ``UPDATE ... WHERE status = 'queued'``, so two
+workers never run the same job. A job whose worker died is put back in the
+queue once it has been running for ``JOBS_STALE_AFTER`` seconds. Workers
+delete succeeded and failed jobs ``JOBS_KEEP_FINISHED`` seconds after they
+finish.
+
+Without a running worker nothing runs and queued rows stay in the table.
+Jobs queued from signals do not pile up: a listing change merges into the
+waiting ``listings.similar`` job and at most one ``listings.trending`` job
+waits at a time. Report builds and (with ``OTP_SEND_ASYNC``) OTP emails,
+however, wait until a worker starts.
+"""
+
+import logging
+import os
+import socket
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+Task = namedtuple('Task', 'name func concurrency max_attempts backoff')
+TASKS = {}
+
+# Candidates looked at per claim; more than one in case other workers win some
+CLAIM_CANDIDATES = 10
+
+# Finished jobs deleted per statement
+PURGE_BATCH_SIZE = 1000
+
+
+class PermanentJobError(Exception):
+    """Raised by a task to fail its job without further retries."""
+
+
+def task(name, concurrency=None, max_attempts=3, backoff=None):
+    """Register the decorated function as the task ``name``."""
+    def register(func):
+        TASKS[name] = Task(name, func, concurrency, max_attempts, backoff)
+        return func
+    return register
+
+
+def concurrency_limit(task_name):
+    overrides = getattr(settings, 'JOBS_CONCURRENCY', {})
+    if task_name in overrides:
+        return overrides[task_name]
+    registered = TASKS.get(task_name)
+    if registered and registered.concurrency:
+        return registered.concurrency
+    return getattr(settings, 'JOBS_DEFAULT_CONCURRENCY', 2)
+
+
+def retry_delay(task_name, attempts):
+    """Seconds to wait before attempt ``attempts + 1``."""
+    registered = TASKS.get(task_name)
+    base = (registered and registered.backoff) or getattr(settings, 'JOBS_RETRY_BACKOFF', 30)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'JOBS_MAX_BACKOFF', 3600))
+
+
+def enqueue(task_name, user=None, delay=0, **payload):
+    """
+    Queue ``task_name`` to run with ``payload`` as keyword arguments.
+
+    ``payload`` must be JSON-serializable, so pass ids rather than model
+    instances. ``user`` is who may poll the job through ``job_status``.
+    """
+    if task_name not in TASKS:
+        raise KeyError(f"Unknown task '{task_name}'")
+    return Job.objects.create(
+        task=task_name,
+        payload=payload,
+        user=user,
+        max_attempts=TASKS[task_name].max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def job_reference(job):
+    """What async call sites return to clients: the job id and where to poll it."""
+    return {
+        'job_id': job.pk,
+        'status': job.status,
+        'status_url': reverse('job_status', args=[job.pk]),
+    }
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def requeue_stale(now=None):
+    """Put jobs whose worker stopped responding back in the queue; returns how many."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, 'JOBS_STALE_AFTER', 900))
+    stale = Job.objects.filter(status='running', locked_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', error='Worker stopped while running the job', finished_at=now,
+        locked_by='', locked_at=None,
+    )
+    requeued = stale.update(status='queued', run_at=now, locked_by='', locked_at=None)
+    return failed + requeued
+
+
+def purge_finished_jobs(now=None):
+    """Delete jobs that finished more than ``JOBS_KEEP_FINISHED`` seconds ago; returns how many."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, 'JOBS_KEEP_FINISHED', 7 * 24 * 3600))
+    finished = Job.objects.filter(status__in=('succeeded', 'failed'), finished_at__lt=cutoff)
+    purged = 0
+    while True:
+        batch = list(finished.values_list('pk', flat=True)[:PURGE_BATCH_SIZE])
+        if not batch:
+            return purged
+        # Reports keep their artifact; a failed report is re-queued on its next request
+        Job.objects.filter(pk__in=batch).delete()
+        purged += len(batch)
+
+
+def claim_job(worker, tasks=None, now=None):
+    """
+    Claim the oldest due job whose task is under its concurrency limit.
+
+    Returns the claimed ``Job`` (``status='running'``, attempt counted) or
+    ``None`` when nothing can run right now.
+    """
+    now = now or timezone.now()
+    running = dict(
+        Job.objects.filter(status='running').order_by().values('task')
+        .annotate(count=Count('pk')).values_list('task', 'count')
+    )
+    full = [name for name, count in running.items() if count >= concurrency_limit(name)]
+    candidates = Job.objects.filter(status='queued', run_at__lte=now).exclude(task__in=full)
+    if tasks:
+        candidates = candidates.filter(task__in=tasks)
+
+    for job_id, task_name in candidates.order_by('run_at', 'id').values_list('id', 'task')[:CLAIM_CANDIDATES]:
+        claimed = Job.objects.filter(pk=job_id, status='queued').update(
+            status='running', locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            continue  # Another worker got there first
+        # Another worker may have taken the last free slot since the count above
+        if Job.objects.filter(task=task_name, status='running').count() > concurrency_limit(task_name):
+            Job.objects.filter(pk=job_id, locked_by=worker).update(
+                status='queued', locked_by='', locked_at=None, attempts=F('attempts') - 1,
+            )
+            continue
+        return Job.objects.get(pk=job_id)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome; returns the updated ``Job``."""
+    registered = TASKS.get(job.task)
+    mine = Job.objects.filter(pk=job.pk, status='running', locked_by=job.locked_by)
+    try:
+        if registered is None:
+            raise PermanentJobError(f"Unknown task '{job.task}'")
+        result = registered.func(**job.payload)
+    except Exception as error:
+        now = timezone.now()
+        message = f'{type(error).__name__}: {error}'
+        if isinstance(error, PermanentJobError) or job.attempts >= job.max_attempts:
+            logger.exception('Job %s (%s) failed', job.pk, job.task)
+            mine.update(status='failed', error=message, finished_at=now, locked_by='', locked_at=None)
+        else:
+            delay = retry_delay(job.task, job.attempts)
+            logger.warning('Job %s (%s) failed, retrying in %ss: %s', job.pk, job.task, delay, message)
+            mine.update(status='queued', error=message, run_at=now + timedelta(seconds=delay),
+                        locked_by='', locked_at=None)
+    else:
+        mine.update(status='succeeded', result=result, error='', finished_at=timezone.now(),
+                    locked_by='', locked_at=None)
+    job.refresh_from_db()
+    return job
+
+
+def run_pending(worker=None, tasks=None, max_jobs=None):
+    """Run due jobs until none can be claimed (or ``max_jobs`` ran); returns how many ran."""
+    worker = worker or worker_name()
+    requeue_stale()
+    purge_finished_jobs()
+    ran = 0
+    while max_jobs is None or ran < max_jobs:
+        job = claim_job(worker, tasks)
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
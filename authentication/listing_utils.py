@@ -0,0 +1,74 @@
+"""
+Listing card helpers for the marketplace browse endpoints.
+
+A "listing card" is the JSON payload returned for each post by
+``dashboard_api``. Everything the card needs is loaded up-front with the
+stored counters, ``select_related`` and a single prefetch, so rendering a page
+costs the same number of queries whatever the page size.
+"""
+
+from django.db.models import Prefetch
+
+from .models import Post, ProductImage
+
+
+def listing_card_queryset(queryset=None):
+    """
+    Return ``queryset`` (default: all posts) prepared for listing cards.
+
+    Joins the owner and prefetches the gallery images ordered by
+    ``display_order``; like and review figures come from the stored counters
+    on ``Post``. Filtering and ordering already applied are preserved.
+    """
+    if queryset is None:
+        queryset = Post.objects.all()
+
+    return queryset.select_related('user').prefetch_related(
+        Prefetch('auxiliary_images', queryset=ProductImage.objects.order_by('display_order'))
+    )
+
+
+def serialize_listing_card(post, bookmarked_ids=(), liked_ids=()):
+    """
+    Build the JSON-serializable card for a post from ``listing_card_queryset``.
+
+    ``bookmarked_ids`` and ``liked_ids`` should be sets of post ids for the
+    requesting user; no queries are issued here.
+    """
+    avg_rating = post.rating_avg
+    owner = post.user
+
+    return {
+        'id': post.id,
+        'title': post.title,
+        'description': post.description,
+        'price': float(post.price) if post.price else None,
+        'category': post.category,
+        'category_display': post.get_category_display(),
+        'inventory': post.inventory,
+        'created_at': post.created_at.isoformat(),
+        'updated_at': post.updated_at.isoformat(),
+        'total_purchases': post.total_purchases,
+        'image_url': post.image.url if post.image else None,
+        'auxiliary_images': [
+            {
+                'id': img.id,
+                'image_url': img.image.url if img.image else None,
+                'display_order': img.display_order
+            }
+            for img in post.auxiliary_images.all()
+        ],
+        'average_rating': round(avg_rating, 1) if avg_rating else None,
+        'review_count': post.reviews_count,
+        'total_likes': post.likes_count,
+        'is_bookmarked': post.id in bookmarked_ids,
+        'is_liked': post.id in liked_ids,
+        'user': {
+            'id': owner.id,
+            'username': owner.username,
+            'first_name': owner.first_name,
+            'last_name': owner.last_name,
+            'is_vendor_role': owner.is_vendor_role,
+            'profile_picture_url': owner.profile_picture.url if owner.profile_picture else None
+        }
+    }
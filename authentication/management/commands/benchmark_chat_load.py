@@ -0,0 +1,222 @@
+import asyncio
+import json
+import statistics
+import time
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+
+from authentication.chat_persistence import get_write_behind_queue
+from authentication.models import Conversation, User
+
+
+class QueryCounter:
+    """Counts queries on the thread that runs the consumers' database calls."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Participant:
+    """One simulated browser tab: a socket plus a task reading everything it receives."""
+
+    def __init__(self, communicator, user):
+        self.communicator = communicator
+        self.user = user
+        self.arrivals = {}  # client_id -> future resolved with (arrived_at, message id)
+        self.received = 0
+        self.reader = None
+
+    def expect(self, client_id):
+        self.arrivals[client_id] = asyncio.get_running_loop().create_future()
+        return self.arrivals[client_id]
+
+    async def read(self):
+        while True:
+            output = await self.communicator.receive_output(timeout=3600)
+            if output['type'] != 'websocket.send':
+                return
+            self.received += 1
+            event = json.loads(output['text'])
+            if event['type'] == 'chat_message' and event['message']['sender_id'] != self.user.id:
+                future = self.arrivals.pop(event['message']['client_id'], None)
+                if future and not future.done():
+                    future.set_result((time.perf_counter(), event['message']['id']))
+
+    async def send(self, payload):
+        await self.communicator.send_to(text_data=json.dumps(payload))
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive simulated buyer/seller pairs through ChatConsumer via the full ASGI '
+        'application (auth and origin middleware included) on a throwaway test database, '
+        'and report connect time, end-to-end latency, messages/sec and DB queries per message'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=50, help='Concurrent buyer/seller conversations')
+        parser.add_argument('--messages', type=int, default=20, help='Messages per conversation')
+        parser.add_argument('--mode', choices=['sync', 'write_behind'], default='sync',
+                            help='CHAT_PERSISTENCE_MODE to run the consumer in')
+        parser.add_argument('--receipts', choices=['read_up_to', 'read_receipt'], default='read_up_to',
+                            help='Receipt the receiving side sends for every message')
+        parser.add_argument('--redis-url', help='Use channels_redis at this URL instead of InMemoryChannelLayer')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for one delivery')
+
+    def handle(self, *args, **options):
+        self.options = options
+        if options['redis_url']:
+            try:
+                import channels_redis  # noqa: F401
+            except ImportError:
+                raise CommandError('--redis-url needs the channels_redis package')
+            layer = {'BACKEND': 'channels_redis.core.RedisChannelLayer',
+                     'CONFIG': {'hosts': [options['redis_url']]}}
+        else:
+            layer = {'BACKEND': 'channels.layers.InMemoryChannelLayer'}
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(CHANNEL_LAYERS={'default': layer}, CHAT_PERSISTENCE_MODE=options['mode']):
+                pairs = self.create_pairs()
+                result = asyncio.run(self.run(pairs))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.report(result)
+
+    def create_pairs(self):
+        """Users, conversations and logged-in session cookies for every pair."""
+        pairs = []
+        for i in range(self.options['pairs']):
+            seller = User.objects.create_user(f'load_seller_{i}', password=None, is_vendor_role=True)
+            buyer = User.objects.create_user(f'load_buyer_{i}', password=None)
+            conversation = Conversation.objects.create(buyer=buyer, seller=seller)
+            pairs.append((conversation, [(buyer, self.session_cookie(buyer)), (seller, self.session_cookie(seller))]))
+        return pairs
+
+    def session_cookie(self, user):
+        client = Client()
+        client.force_login(user)
+        return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    def origin(self):
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        return f'http://{host}'
+
+    async def run(self, pairs):
+        from InzuLink.asgi import application
+
+        origin = self.origin().encode()
+        connect_times, participants = [], []
+        for conversation, members in pairs:
+            pair = []
+            for user, cookie in members:
+                communicator = WebsocketCommunicator(
+                    application, f'/ws/chat/{conversation.id}/',
+                    headers=[(b'origin', origin), (b'cookie', cookie.encode())],
+                )
+                started = time.perf_counter()
+                connected, _ = await communicator.connect(timeout=self.options['timeout'])
+                if not connected:
+                    raise CommandError(f'Socket for {user.username} was rejected')
+                connect_times.append((time.perf_counter() - started) * 1000)
+                participant = Participant(communicator, user)
+                participant.reader = asyncio.ensure_future(participant.read())
+                pair.append(participant)
+            participants.append((conversation, pair))
+
+        counter = QueryCounter()
+        await self.install_counter(counter)
+        try:
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*(self.converse(conversation, pair) for conversation, pair in participants))
+            elapsed = time.perf_counter() - started
+            if self.options['mode'] == 'write_behind':
+                await get_write_behind_queue().flush()
+            persisted = time.perf_counter() - started
+        finally:
+            await self.remove_counter(counter)
+
+        for _, pair in participants:
+            for participant in pair:
+                await participant.communicator.disconnect()
+                participant.reader.cancel()
+
+        return {
+            'sockets': 2 * len(participants),
+            'connect_ms': connect_times,
+            'latencies_ms': [latency for pair in latencies for latency in pair],
+            'elapsed': elapsed,
+            'persisted': persisted,
+            'queries': counter.count,
+            'received': sum(p.received for _, pair in participants for p in pair),
+        }
+
+    async def converse(self, conversation, pair):
+        """Alternate messages between the two sides, each one typed, delivered and acknowledged."""
+        latencies = []
+        for i in range(self.options['messages']):
+            sender, receiver = pair[i % 2], pair[1 - i % 2]
+            client_id = f'{conversation.id}-{i}'
+            arrival = receiver.expect(client_id)
+
+            sent_at = time.perf_counter()
+            await sender.send({'type': 'typing', 'is_typing': True})
+            await sender.send({'type': 'chat_message', 'message': f'Load test message {i}', 'client_id': client_id})
+            arrived_at, message_id = await asyncio.wait_for(arrival, self.options['timeout'])
+            latencies.append((arrived_at - sent_at) * 1000)
+
+            # Write-behind messages have no id until their batch is written
+            if message_id:
+                await receiver.send({'type': self.options['receipts'], 'message_id': message_id})
+        return latencies
+
+    # Consumers reach the database through database_sync_to_async, which runs
+    # on one shared thread; the counter is installed on that thread's connection.
+
+    @database_sync_to_async
+    def install_counter(self, counter):
+        connection.execute_wrappers.append(counter)
+
+    @database_sync_to_async
+    def remove_counter(self, counter):
+        connection.execute_wrappers.remove(counter)
+
+    def report(self, result):
+        messages = len(result['latencies_ms'])
+        latencies = sorted(result['latencies_ms'])
+        connects = sorted(result['connect_ms'])
+        layer = 'redis' if self.options['redis_url'] else 'in-memory'
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'== {result["sockets"]} sockets, {messages} messages, {self.options["mode"]} persistence, '
+            f'{layer} channel layer =='
+        ))
+        rows = [
+            ('connect p50 / p99 (ms)', f'{percentile(connects, 50):.2f} / {percentile(connects, 99):.2f}'),
+            ('latency p50 / p99 (ms)', f'{percentile(latencies, 50):.2f} / {percentile(latencies, 99):.2f}'),
+            ('latency mean / max (ms)', f'{statistics.mean(latencies):.2f} / {latencies[-1]:.2f}'),
+            ('delivered msg/s', f'{messages / result["elapsed"]:.0f}'),
+            ('persisted msg/s', f'{messages / result["persisted"]:.0f}'),
+            ('frames received', f'{result["received"]}'),
+            ('DB queries / message', f'{result["queries"] / messages:.2f}'),
+        ]
+        for name, value in rows:
+            self.stdout.write(f'{name:<26}{value:>20}')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
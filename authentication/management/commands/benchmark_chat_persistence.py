@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from authentication.chat_persistence import get_write_behind_queue
+from authentication.models import Conversation, Message, User
+from InzuLink.routing import websocket_urlpatterns
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure ChatConsumer messages/sec in one worker with synchronous '
+        'persistence and with the write-behind queue, on a throwaway test database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='Messages sent per mode')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = {}
+            for mode in ('sync', 'write_behind'):
+                with override_settings(CHAT_PERSISTENCE_MODE=mode, CHAT_WRITE_BEHIND_BATCH_SIZE=options['batch_size']):
+                    results[mode] = asyncio.run(self.run_mode(mode, options['messages']))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f'{"mode":<14}{"broadcast msg/s":>18}{"persisted msg/s":>18}{"stored":>10}')
+        for mode, (broadcast_rate, persisted_rate, stored) in results.items():
+            self.stdout.write(f'{mode:<14}{broadcast_rate:>18.0f}{persisted_rate:>18.0f}{stored:>10}')
+
+    @database_sync_to_async
+    def create_conversation(self, mode):
+        seller = User.objects.create_user(f'bench_seller_{mode}', password=None, is_vendor_role=True)
+        buyer = User.objects.create_user(f'bench_buyer_{mode}', password=None)
+        return Conversation.objects.create(buyer=buyer, seller=seller), buyer, seller
+
+    @database_sync_to_async
+    def stored_messages(self, conversation):
+        return Message.objects.filter(conversation=conversation).count()
+
+    async def run_mode(self, mode, count):
+        conversation, buyer, seller = await self.create_conversation(mode)
+        application = URLRouter(websocket_urlpatterns)
+        path = f'/ws/chat/{conversation.id}/'
+
+        sender = WebsocketCommunicator(application, path)
+        sender.scope['user'] = buyer
+        receiver = WebsocketCommunicator(application, path)
+        receiver.scope['user'] = seller
+        await sender.connect()
+        await receiver.connect()
+        await receiver.receive_json_from()  # presence_state
+
+        started = time.perf_counter()
+        for i in range(count):
+            await sender.send_json_to({'type': 'chat_message', 'message': f'Message {i}', 'client_id': f'{mode}-{i}'})
+        received = 0
+        while received < count:
+            event = await receiver.receive_json_from(timeout=30)
+            if event['type'] == 'chat_message':
+                received += 1
+        broadcast_elapsed = time.perf_counter() - started
+
+        if mode == 'write_behind':
+            await get_write_behind_queue().flush()
+        persisted_elapsed = time.perf_counter() - started
+
+        await sender.disconnect()
+        await receiver.disconnect()
+        stored = await self.stored_messages(conversation)
+        return count / broadcast_elapsed, count / persisted_elapsed, stored
@@ -0,0 +1,174 @@
+import math
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from authentication.geo_utils import (
+    DISTANCE_ORDERING, KM_PER_DEGREE, MIN_INDEXED_PRECISION, cell_ranges, cover_cells,
+    distance_sq_expression, encode_geohash, filter_bbox, filter_near,
+)
+from authentication.models import Post, User
+
+BATCH_SIZE = 5000
+
+# Rwanda, roughly: south, west, north, east
+RWANDA = (-2.84, 28.86, -1.05, 30.90)
+# Towns that attract most listings: (name, latitude, longitude, spread in degrees)
+TOWNS = [
+    ('Kigali', -1.9441, 30.0619, 0.08),
+    ('Musanze', -1.4997, 29.6349, 0.04),
+    ('Huye', -2.5967, 29.7394, 0.04),
+    ('Rubavu', -1.6793, 29.2598, 0.04),
+    ('Rwamagana', -1.9487, 30.4347, 0.03),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database with listings spread across Rwanda, then '
+        'compare radius and bounding-box search through the geo_cell index with a '
+        'scan of every listing, checking both return the same rows'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100_000)
+        parser.add_argument('--vendors', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query')
+        parser.add_argument('--no-plans', action='store_true', help='Skip printing query plans')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(42)
+        # Never touch the configured database: work in a fresh test database
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.seed()
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            self.report(self.measure(self.cases()))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self):
+        opts, rng = self.options, self.rng
+        started = time.perf_counter()
+        password = make_password(None)
+        User.objects.bulk_create(
+            [User(username=f'bench_vendor_{i}', password=password, is_vendor_role=True)
+             for i in range(opts['vendors'])],
+            batch_size=BATCH_SIZE,
+        )
+        vendor_ids = list(User.objects.values_list('id', flat=True))
+        categories = [choice for choice, _ in Post.CATEGORY_CHOICES]
+        south, west, north, east = RWANDA
+        now = timezone.now()
+
+        for offset in range(0, opts['posts'], BATCH_SIZE):
+            batch = []
+            for i in range(offset, min(offset + BATCH_SIZE, opts['posts'])):
+                # Two listings in three are in or around a town, the rest anywhere
+                if rng.random() < 2 / 3:
+                    _, lat, lng, spread = rng.choice(TOWNS)
+                    lat, lng = rng.gauss(lat, spread), rng.gauss(lng, spread)
+                else:
+                    lat, lng = rng.uniform(south, north), rng.uniform(west, east)
+                lat, lng = round(lat, 6), round(lng, 6)
+                # bulk_create skips Post.save, so the cell is set here
+                batch.append(Post(
+                    title=f'Benchmark listing {i}',
+                    description='Seeded by benchmark_geo_search',
+                    image='posts/benchmark.jpg',
+                    user_id=rng.choice(vendor_ids),
+                    category=rng.choice(categories),
+                    price=Decimal(rng.randrange(10_000, 500_000_000, 1000)),
+                    inventory=0 if rng.random() < 0.1 else 1,
+                    created_at=now,
+                    location_latitude=Decimal(str(lat)),
+                    location_longitude=Decimal(str(lng)),
+                    geo_cell=encode_geohash(lat, lng),
+                ))
+            Post.objects.bulk_create(batch)
+
+        self.stdout.write(
+            f'Seeded {opts["posts"]} posts in {time.perf_counter() - started:.1f}s on {connection.vendor}'
+        )
+
+    def cases(self):
+        """``(name, indexed queryset, scanning queryset, cell ranges)`` per search."""
+        in_stock = Post.objects.filter(inventory__gt=0)
+        cases = []
+        for name, lat, lng, radius in [
+            ('Kigali 2km', -1.9441, 30.0619, 2),
+            ('Kigali 10km', -1.9441, 30.0619, 10),
+            ('Huye 25km', -2.5967, 29.7394, 25),
+            ('rural 5km', -2.30, 30.60, 5),
+        ]:
+            indexed = filter_near(in_stock, lat, lng, radius).order_by(*DISTANCE_ORDERING)
+            scan = in_stock.annotate(geo_distance_sq=distance_sq_expression(lat, lng)).filter(
+                geo_distance_sq__lte=radius * radius
+            ).order_by(*DISTANCE_ORDERING)
+            dlat = radius / KM_PER_DEGREE
+            dlng = dlat / math.cos(math.radians(lat))
+            cases.append((f'near {name}', indexed, scan, index_ranges(lat - dlat, lng - dlng, lat + dlat, lng + dlng)))
+
+        for name, box in [
+            ('bbox Musanze town', (-1.53, 29.60, -1.47, 29.67)),
+            ('bbox Eastern Province', (-2.40, 30.20, -1.10, 30.90)),
+        ]:
+            south, west, north, east = box
+            indexed = filter_bbox(in_stock, *box).order_by('-created_at', '-id')
+            scan = in_stock.filter(
+                location_latitude__gte=south, location_latitude__lte=north,
+                location_longitude__gte=west, location_longitude__lte=east,
+            ).order_by('-created_at', '-id')
+            cases.append((name, indexed, scan, index_ranges(*box)))
+        return cases
+
+    def time_query(self, queryset, limit):
+        ids = queryset.values_list('id', flat=True)
+        list(ids[:limit])  # warm caches
+        timings = []
+        for _ in range(self.options['repeat']):
+            started = time.perf_counter()
+            list(ids[:limit])
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def measure(self, cases):
+        results = []
+        for name, indexed, scan, ranges in cases:
+            matches = indexed.count()
+            if set(indexed.values_list('id', flat=True)) != set(scan.values_list('id', flat=True)):
+                self.stderr.write(self.style.ERROR(f'{name}: indexed and scanned results differ'))
+            if not self.options['no_plans']:
+                self.stdout.write(f'\n{name}:\n{indexed.explain()}')
+            # A listing page, and every match as a map would request them
+            timings = [self.time_query(queryset, limit) for limit in (20, None) for queryset in (scan, indexed)]
+            results.append((name, matches, ranges, timings))
+        return results
+
+    def report(self, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            '\n== median latency (ms), scan / geo_cell; ranges 0 = bounds only =='
+        ))
+        self.stdout.write(f'{"search":<24}{"matches":>9}{"ranges":>8}{"first 20":>22}{"all matches":>22}')
+        for name, matches, ranges, (page_scan, page_indexed, all_scan, all_indexed) in results:
+            self.stdout.write(
+                f'{name:<24}{matches:>9}{ranges:>8}'
+                f'{f"{page_scan:.2f} / {page_indexed:.2f}":>22}'
+                f'{f"{all_scan:.2f} / {all_indexed:.2f}":>22}'
+            )
+
+
+def index_ranges(south, west, north, east):
+    """How many geo_cell ranges ``filter_near``/``filter_bbox`` scan for the box."""
+    cells = cover_cells(south, west, north, east)
+    if len(cells[0]) < MIN_INDEXED_PRECISION:
+        return 0
+    return len(cell_ranges(cells))
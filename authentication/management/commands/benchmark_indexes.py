@@ -0,0 +1,189 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from authentication.models import Post, Purchase, User
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database with listings and purchases, then report '
+        'query plans and latencies for the hot browse/sales queries with and '
+        'without the Post/Purchase indexes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100_000)
+        parser.add_argument('--purchases', type=int, default=1_000_000)
+        parser.add_argument('--vendors', type=int, default=500)
+        parser.add_argument('--buyers', type=int, default=5_000)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query')
+        parser.add_argument('--no-plans', action='store_true', help='Skip printing query plans')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(42)
+        # Never touch the configured database: work in a fresh test database
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.seed()
+            cases = self.cases()
+            indexes = [(model, index) for model in (Post, Purchase) for index in model._meta.indexes]
+
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    editor.remove_index(model, index)
+            before = self.measure(cases, 'without indexes')
+
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    editor.add_index(model, index)
+            after = self.measure(cases, 'with indexes')
+
+            self.report(cases, before, after)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    # Seeding
+
+    def seed(self):
+        opts, rng = self.options, self.rng
+        started = time.perf_counter()
+        password = make_password(None)
+
+        User.objects.bulk_create(
+            [User(username=f'bench_vendor_{i}', password=password, is_vendor_role=True)
+             for i in range(opts['vendors'])],
+            batch_size=BATCH_SIZE,
+        )
+        User.objects.bulk_create(
+            [User(username=f'bench_buyer_{i}', password=password) for i in range(opts['buyers'])],
+            batch_size=BATCH_SIZE,
+        )
+        self.vendor_ids = list(User.objects.filter(is_vendor_role=True).values_list('id', flat=True))
+        self.buyer_ids = list(User.objects.filter(is_vendor_role=False).values_list('id', flat=True))
+
+        categories = [choice for choice, _ in Post.CATEGORY_CHOICES]
+        now = timezone.now()
+        for offset in range(0, opts['posts'], BATCH_SIZE):
+            Post.objects.bulk_create([
+                Post(
+                    title=f'Benchmark listing {i}',
+                    description='Seeded by benchmark_indexes',
+                    image='posts/benchmark.jpg',
+                    user_id=rng.choice(self.vendor_ids),
+                    category=rng.choice(categories),
+                    price=Decimal(rng.randrange(10_000, 500_000_000, 1000)),
+                    # About one listing in ten is sold out
+                    inventory=0 if rng.random() < 0.1 else rng.randint(1, 5),
+                    total_purchases=rng.randint(0, 50),
+                    trending_score=0 if rng.random() < 0.7 else rng.uniform(0, 200),
+                    rating_avg=round(rng.uniform(0, 5), 2),
+                    reviews_count=rng.randint(0, 40),
+                    created_at=now - timedelta(minutes=rng.randrange(0, 2 * 365 * 24 * 60)),
+                )
+                for i in range(offset, min(offset + BATCH_SIZE, opts['posts']))
+            ])
+        self.post_ids = list(Post.objects.values_list('id', flat=True))
+
+        statuses = [choice for choice, _ in Purchase.STATUS_CHOICES]
+        for offset in range(0, opts['purchases'], BATCH_SIZE):
+            batch = []
+            for i in range(offset, min(offset + BATCH_SIZE, opts['purchases'])):
+                status = rng.choice(statuses)
+                completed_at = None
+                if status == 'completed':
+                    completed_at = now - timedelta(minutes=rng.randrange(0, 2 * 365 * 24 * 60))
+                batch.append(Purchase(
+                    order_id=f'BENCH-{i}',
+                    buyer_id=rng.choice(self.buyer_ids),
+                    property_id=rng.choice(self.post_ids),
+                    final_price=Decimal(rng.randrange(10_000, 500_000_000, 1000)),
+                    status=status,
+                    completed_at=completed_at,
+                ))
+            Purchase.objects.bulk_create(batch)
+
+        self.stdout.write(
+            f'Seeded {opts["posts"]} posts and {opts["purchases"]} purchases '
+            f'in {time.perf_counter() - started:.1f}s on {connection.vendor}'
+        )
+
+    # Queries under test
+
+    def cases(self):
+        vendor_id = self.rng.choice(self.vendor_ids)
+        buyer_id = self.rng.choice(self.buyer_ids)
+        month_start = timezone.localtime().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        next_month_start = (month_start + timedelta(days=32)).replace(day=1)
+        in_stock = Post.objects.filter(inventory__gt=0)
+        completed = Purchase.objects.filter(status='completed').order_by()
+
+        return [
+            ('browse newest', in_stock.order_by('-created_at', '-id')[:20], list),
+            ('browse category', in_stock.filter(category='villa').order_by('-created_at', '-id')[:20], list),
+            ('browse price range',
+             in_stock.filter(price__gte=1_000_000, price__lte=5_000_000).order_by('price', 'id')[:20], list),
+            ('browse popular', in_stock.order_by('-total_purchases', '-created_at', '-id')[:20], list),
+            ('browse trending', in_stock.order_by('-trending_score', '-created_at', '-id')[:20], list),
+            ('browse rating', Post.objects.order_by('-rating_avg', '-reviews_count', '-id')[:20], list),
+            # Aggregates drop Meta.ordering; clear it so the printed plan matches
+            ('browse count', in_stock.order_by(), lambda qs: qs.count()),
+            ('vendor listings', Post.objects.filter(user_id=vendor_id).order_by('-created_at')[:20], list),
+            ('purchases by status',
+             Purchase.objects.filter(status='payment_confirmed').order_by('-created_at')[:20], list),
+            ('buyer completed count',
+             Purchase.objects.filter(buyer_id=buyer_id, status='completed').order_by(), lambda qs: qs.count()),
+            ('vendor sales total',
+             completed.filter(property__user_id=vendor_id),
+             lambda qs: qs.aggregate(total=Sum('final_price'))),
+            ('monthly completed total',
+             completed.filter(completed_at__gte=month_start, completed_at__lt=next_month_start),
+             lambda qs: qs.aggregate(total=Sum('final_price'))),
+        ]
+
+    # Measuring
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def measure(self, cases, label):
+        self.analyze()
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n== {label} =='))
+        results = {}
+        for name, queryset, run in cases:
+            run(queryset.all())  # warm caches
+            timings = []
+            for _ in range(self.options['repeat']):
+                started = time.perf_counter()
+                run(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = timings
+            if not self.options['no_plans']:
+                self.stdout.write(f'\n{name}:\n{queryset.explain()}')
+        return results
+
+    def report(self, cases, before, after):
+        self.stdout.write(self.style.MIGRATE_HEADING('\n== latency (ms, median / max) =='))
+        self.stdout.write(f'{"query":<26}{"without":>20}{"with":>20}{"speedup":>10}')
+        for name, _, _ in cases:
+            old, new = before[name], after[name]
+            old_median, new_median = statistics.median(old), statistics.median(new)
+            speedup = old_median / new_median if new_median else float('inf')
+            self.stdout.write(
+                f'{name:<26}'
+                f'{f"{old_median:.2f} / {max(old):.2f}":>20}'
+                f'{f"{new_median:.2f} / {max(new):.2f}":>20}'
+                f'{f"{speedup:.1f}x":>10}'
+            )
@@ -0,0 +1,122 @@
+import io
+import random
+import statistics
+import tempfile
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, Table
+
+from authentication.models import Post, Purchase, ReportArtifact, User
+from authentication.reports import (
+    REPORT_TYPES, TABLE_STYLE, build_report, render_pdf_report, request_report,
+)
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database with one buyer\'s purchase history, then time '
+        'building the PDF report (single table vs chunked tables), serving an identical '
+        'request from the stored artifact, and rebuilding after the data changes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs of the cached request')
+        parser.add_argument('--skip-single-table', action='store_true',
+                            help='Skip timing the old single-table layout, which is slow')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(42)
+        # Never touch the configured database or media: work in throwaway copies
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+                buyer = self.seed()
+                self.report(self.measure(buyer))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self):
+        rows, rng = self.options['rows'], self.rng
+        started = time.perf_counter()
+        password = make_password(None)
+        vendors = User.objects.bulk_create(
+            [User(username=f'bench_vendor_{i}', password=password, is_vendor_role=True,
+                  first_name='Vendor', last_name=str(i)) for i in range(50)]
+        )
+        buyer = User.objects.create(username='bench_buyer', password=password, first_name='Bench', last_name='Buyer')
+        listings = Post.objects.bulk_create([
+            Post(title=f'Benchmark listing {i}', description='Seeded by benchmark_reports',
+                 image='posts/benchmark.jpg', user=rng.choice(vendors), category='living_room',
+                 price=Decimal(rng.randrange(10_000, 50_000_000, 1000)), inventory=10)
+            for i in range(500)
+        ])
+        now = timezone.now()
+        statuses = [choice for choice, _ in Purchase.STATUS_CHOICES]
+        for offset in range(0, rows, BATCH_SIZE):
+            # bulk_create skips Purchase.save, so order ids are set here
+            Purchase.objects.bulk_create([
+                Purchase(order_id=f'ORD-{i:08d}', buyer=buyer, property=rng.choice(listings),
+                         final_price=Decimal(rng.randrange(10_000, 50_000_000, 1000)),
+                         status=rng.choice(statuses), completed_at=now)
+                for i in range(offset, min(offset + BATCH_SIZE, rows))
+            ])
+        self.stdout.write(f'Seeded {rows} purchases in {time.perf_counter() - started:.1f}s on {connection.vendor}')
+        return buyer
+
+    def measure(self, buyer):
+        results = []
+        title, headers, rows, summary = REPORT_TYPES['purchase_history'].build(buyer, None)
+
+        if not self.options['skip_single_table']:
+            started = time.perf_counter()
+            doc = SimpleDocTemplate(io.BytesIO(), pagesize=A4)
+            doc.build([Table([headers] + rows, style=TABLE_STYLE)])
+            results.append(('render, one table (before)', time.perf_counter() - started))
+
+        started = time.perf_counter()
+        render_pdf_report(io.BytesIO(), title, headers, rows, summary)
+        results.append((f'render, {len(rows)} rows chunked', time.perf_counter() - started))
+
+        started = time.perf_counter()
+        artifact = request_report('purchase_history', buyer, build_now=True)
+        results.append(('first request (query + build + store)', time.perf_counter() - started))
+
+        timings = []
+        for _ in range(self.options['repeat']):
+            started = time.perf_counter()
+            cached = request_report('purchase_history', buyer, build_now=True)
+            timings.append(time.perf_counter() - started)
+        if cached.pk != artifact.pk:
+            self.stderr.write(self.style.ERROR('Identical request did not reuse the stored artifact'))
+        results.append(('identical request (cached artifact)', statistics.median(timings)))
+
+        Purchase.objects.filter(pk=Purchase.objects.filter(buyer=buyer).values('pk')[:1]).update(
+            final_price=Decimal('1'), updated_at=timezone.now()
+        )
+        started = time.perf_counter()
+        pending = request_report('purchase_history', buyer)
+        results.append(('changed data, async request returns', time.perf_counter() - started))
+        started = time.perf_counter()
+        build_report(pending.pk)
+        results.append(('changed data, job build', time.perf_counter() - started))
+        self.stdout.write(
+            f'Stored artifacts: {ReportArtifact.objects.count()}, '
+            f'PDF size {ReportArtifact.objects.get().size / 1024:.0f} KiB'
+        )
+        return results
+
+    def report(self, results):
+        self.stdout.write(self.style.MIGRATE_HEADING('\n== purchase history PDF report (seconds) =='))
+        for name, seconds in results:
+            self.stdout.write(f'{name:<42}{seconds:>10.3f}')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from authentication.counters import rebuild_post_counters
+from authentication.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored like, review and rating counters on every listing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--post', type=int, action='append', dest='post_ids',
+                            help='Only rebuild the given post id (repeatable)')
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.all()
+        if options['post_ids']:
+            queryset = queryset.filter(pk__in=options['post_ids'])
+        count = rebuild_post_counters(queryset)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt counters for {count} listings'))
@@ -0,0 +1,24 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.sales_rollups import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily vendor, listing and platform sales rollups from purchases and listing fees'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only rebuild days from this date on (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since must be a date like 2025-01-31')
+        vendors, properties, days = rebuild_sales_rollups(since)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {vendors} vendor, {properties} listing and {days} platform daily rollups'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from authentication.search_backends import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for property listings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to rebuild')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options['database'])
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} listings with {type(backend).__name__}'
+        ))
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from authentication.similar_listings import rebuild_similar_listings
+
+
+class Command(BaseCommand):
+    help = 'Recompute the similar-listings neighbour index for every listing, e.g. after changing the weights'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        updated = rebuild_similar_listings()
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated the neighbours of {updated} listings in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,55 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.jobs import TASKS, claim_job, purge_finished_jobs, requeue_stale, run_job, worker_name
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued background jobs (PDF reports, OTP emails, QR codes, payment gateway calls). '
+        'Start one process per job to run at once; per-task concurrency limits apply across all of them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the jobs due now, then exit')
+        parser.add_argument('--task', action='append', dest='tasks', metavar='NAME',
+                            help='Only run this task (repeatable)')
+        parser.add_argument('--max-jobs', type=int, help='Exit after running this many jobs')
+        parser.add_argument('--sleep', type=float, default=None,
+                            help='Seconds to wait when the queue is empty (default JOBS_POLL_INTERVAL)')
+
+    def handle(self, *args, **options):
+        unknown = set(options['tasks'] or ()) - set(TASKS)
+        if unknown:
+            raise CommandError(f'Unknown task(s): {", ".join(sorted(unknown))}. Known: {", ".join(sorted(TASKS))}')
+        poll_interval = options['sleep'] if options['sleep'] is not None else getattr(settings, 'JOBS_POLL_INTERVAL', 2)
+        worker = worker_name()
+
+        # Finish the running job before stopping on Ctrl-C or SIGTERM
+        self.stopping = False
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+
+        self.stdout.write(f'Worker {worker} started')
+        ran, last_stale_check = 0, 0
+        while not self.stopping and (options['max_jobs'] is None or ran < options['max_jobs']):
+            if time.monotonic() - last_stale_check > 60:
+                requeue_stale()
+                purge_finished_jobs()
+                last_stale_check = time.monotonic()
+            job = claim_job(worker, options['tasks'])
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(poll_interval)
+                continue
+            job = run_job(job)
+            ran += 1
+            self.stdout.write(f'{job.task} #{job.pk}: {job.status} (attempt {job.attempts}/{job.max_attempts})')
+        self.stdout.write(f'Worker {worker} stopped after {ran} job(s)')
+
+    def stop(self, signum, frame):
+        self.stopping = True
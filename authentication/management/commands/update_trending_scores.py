@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from authentication.tasks import schedule_trending_refresh
+from authentication.trending import update_trending_scores
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the time-decayed trending score of every listing (sort=trending). '
+        'Run it from cron, or pass --schedule to have run_jobs workers refresh the scores periodically'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schedule', action='store_true',
+                            help='Also queue the recurring listings.trending job if it is not queued yet')
+
+    def handle(self, *args, **options):
+        scored = update_trending_scores()
+        self.stdout.write(self.style.SUCCESS(f'{scored} listings have a trending score'))
+        if options['schedule']:
+            job = schedule_trending_refresh()
+            self.stdout.write('Queued the listings.trending job' if job else 'listings.trending is already queued')
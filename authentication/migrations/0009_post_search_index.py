@@ -0,0 +1,62 @@
+from django.db import migrations
+
+from authentication.search_backends import POSTGRES_SEARCH_TABLE, SQLITE_FTS_TABLE
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {POSTGRES_SEARCH_TABLE} ('
+                f'post_id bigint PRIMARY KEY REFERENCES authentication_post (id) '
+                f'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                f'document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {POSTGRES_SEARCH_TABLE}_document_gin '
+                f'ON {POSTGRES_SEARCH_TABLE} USING GIN (document)'
+            )
+            cursor.execute(
+                f"INSERT INTO {POSTGRES_SEARCH_TABLE} (post_id, document) "
+                f"SELECT p.id, "
+                f"setweight(to_tsvector('simple', coalesce(p.title, '')), 'A') || "
+                f"setweight(to_tsvector('simple', coalesce(p.description, '')), 'B') || "
+                f"setweight(to_tsvector('simple', u.username), 'C') "
+                f"FROM authentication_post p JOIN authentication_user u ON u.id = p.user_id "
+                f"ON CONFLICT (post_id) DO NOTHING"
+            )
+        elif connection.vendor == 'sqlite':
+            try:
+                cursor.execute(
+                    f'CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} '
+                    f"USING fts5(title, description, username, prefix='2 3')"
+                )
+            except Exception:
+                # SQLite built without FTS5: search falls back to LIKE
+                return
+            cursor.execute(
+                f'INSERT INTO {SQLITE_FTS_TABLE} (rowid, title, description, username) '
+                f"SELECT p.id, coalesce(p.title, ''), coalesce(p.description, ''), u.username "
+                f'FROM authentication_post p JOIN authentication_user u ON u.id = p.user_id'
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'DROP TABLE IF EXISTS {POSTGRES_SEARCH_TABLE}')
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0008_add_cart_and_delivery_tracking'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
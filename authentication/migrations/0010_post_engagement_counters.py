@@ -0,0 +1,59 @@
+# Generated by Django 5.1.4 on 2026-10-17 23:37
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('authentication', 'Post')
+    ProductReview = apps.get_model('authentication', 'ProductReview')
+    Like = Post.likes.through
+
+    def per_post(queryset, fk_name, aggregate, output_field):
+        return Coalesce(Subquery(
+            queryset.filter(**{fk_name: OuterRef('pk')}).order_by().values(fk_name)
+            .annotate(value=aggregate).values('value')[:1]
+        ), Value(0), output_field=output_field)
+
+    Post.objects.update(
+        likes_count=per_post(Like.objects.all(), 'post', Count('pk'), models.IntegerField()),
+        reviews_count=per_post(ProductReview.objects.all(), 'product', Count('pk'), models.IntegerField()),
+        rating_sum=per_post(ProductReview.objects.all(), 'product', Sum('rating'), models.IntegerField()),
+        rating_avg=per_post(ProductReview.objects.all(), 'product', Avg('rating'), models.FloatField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0009_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_avg',
+            field=models.FloatField(default=0, help_text='Average review rating, 0 when unreviewed'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='reviews_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-rating_avg', '-reviews_count', '-id'], name='post_rating_sort_idx'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
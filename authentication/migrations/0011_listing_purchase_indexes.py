@@ -0,0 +1,49 @@
+# Generated by Django 5.1.4 on 2026-10-17 23:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0010_post_engagement_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('inventory__gt', 0)), fields=['-created_at', '-id'], name='post_instock_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('inventory__gt', 0)), fields=['category', '-created_at', '-id'], name='post_instock_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('inventory__gt', 0)), fields=['price', 'id'], name='post_instock_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('inventory__gt', 0)), fields=['-total_purchases', '-created_at', '-id'], name='post_instock_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', '-created_at'], name='post_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['status', '-created_at'], name='purchase_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['buyer', 'status'], name='purchase_buyer_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['property', 'status'], name='purchase_property_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(condition=models.Q(('status', 'completed')), fields=['completed_at'], name='purchase_completed_at_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.4 on 2026-10-17 23:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_unread_counts(apps, schema_editor):
+    Conversation = apps.get_model('authentication', 'Conversation')
+    Message = apps.get_model('authentication', 'Message')
+
+    for role in ('buyer', 'seller'):
+        last_read = f'{role}_last_read'
+        unread = Message.objects.filter(conversation=OuterRef('pk')).exclude(sender=OuterRef(role))
+
+        def count(messages):
+            return Coalesce(Subquery(
+                messages.order_by().values('conversation').annotate(n=Count('pk')).values('n')[:1]
+            ), Value(0))
+
+        Conversation.objects.filter(**{f'{last_read}__isnull': True}).update(
+            **{f'{role}_unread_count': count(unread)}
+        )
+        Conversation.objects.filter(**{f'{last_read}__isnull': False}).update(
+            **{f'{role}_unread_count': count(unread.filter(created_at__gt=OuterRef(last_read)))}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0011_listing_purchase_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='buyer_unread_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='seller_unread_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(condition=models.Q(('buyer_unread_count__gt', 0)), fields=['buyer', 'status'], name='conv_buyer_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(condition=models.Q(('seller_unread_count__gt', 0)), fields=['seller', 'status'], name='conv_seller_unread_idx'),
+        ),
+        migrations.RunPython(populate_unread_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-17 23:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_last_message(apps, schema_editor):
+    Conversation = apps.get_model('authentication', 'Conversation')
+    Message = apps.get_model('authentication', 'Message')
+    latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-id')
+    Conversation.objects.update(last_message=Subquery(latest.values('pk')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0012_conversation_unread_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, help_text='Most recent message, kept for the inbox', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='authentication.message'),
+        ),
+        migrations.RunPython(populate_last_message, migrations.RunPython.noop),
+    ]
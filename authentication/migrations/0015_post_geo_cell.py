@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 00:02
+
+from django.db import migrations, models
+
+from authentication.geo_utils import encode_geohash
+
+
+def populate_geo_cells(apps, schema_editor):
+    Post = apps.get_model('authentication', 'Post')
+    located = Post.objects.filter(location_latitude__isnull=False, location_longitude__isnull=False)
+    batch = []
+    for post in located.only('id', 'location_latitude', 'location_longitude').iterator(chunk_size=1000):
+        post.geo_cell = encode_geohash(float(post.location_latitude), float(post.location_longitude))
+        batch.append(post)
+        if len(batch) == 1000:
+            Post.objects.bulk_update(batch, ['geo_cell'])
+            batch = []
+    Post.objects.bulk_update(batch, ['geo_cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0014_message_client_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='geo_cell',
+            field=models.CharField(blank=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['geo_cell', 'location_latitude', 'location_longitude'], name='post_geo_cell_idx'),
+        ),
+        migrations.RunPython(populate_geo_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-18 00:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_rollups(apps, schema_editor):
+    from authentication.sales_rollups import rebuild_sales_rollups
+
+    rebuild_sales_rollups(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0015_post_geo_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlatformDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('sales_count', models.IntegerField(default=0)),
+                ('sales_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('listing_fees_count', models.IntegerField(default=0)),
+                ('listing_fees_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PropertyDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('sales_count', models.IntegerField(default=0)),
+                ('sales_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='authentication.post')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='property_daily_sales', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['vendor', 'property'], name='property_sales_vendor_idx')],
+                'constraints': [models.UniqueConstraint(fields=('property', 'day'), name='property_daily_sales_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VendorDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('sales_count', models.IntegerField(default=0)),
+                ('sales_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('listing_fees_count', models.IntegerField(default=0)),
+                ('listing_fees_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('vendor', 'day'), name='vendor_daily_sales_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
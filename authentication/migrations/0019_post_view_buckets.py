@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 00:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0018_report_artifacts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostViewHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('views', models.IntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_views', to='authentication.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour'], name='post_view_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('post', 'hour'), name='post_view_hourly_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 00:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0019_post_view_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='postviewhourly',
+            name='likes',
+            field=models.IntegerField(default=0, help_text='Likes added minus likes removed'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('inventory__gt', 0)), fields=['-trending_score', '-created_at', '-id'], name='post_instock_trending_idx'),
+        ),
+    ]
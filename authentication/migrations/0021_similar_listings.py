@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0020_trending_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='similar_ids',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
@@ -3,10 +3,15 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils import timezone
+from django.db.models.functions import Greatest
 from django.utils.text import slugify
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
 import uuid
 
+from .chat_notifications import notify_new_messages, notify_unread_count
+from .geo_utils import encode_geohash
+
 class User(AbstractUser):
     USER_ROLES = (
         ('user', 'User'),
@@ -113,11 +118,23 @@ class Post(models.Model):
     location_city = models.CharField(max_length=100, blank=True, null=True, help_text="City")
     location_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     location_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Geohash of the coordinates, kept in step by save() (see geo_utils.py)
+    geo_cell = models.CharField(max_length=12, null=True, blank=True, editable=False)
     
     # Stats
     total_purchases = models.IntegerField(default=0)
     view_count = models.IntegerField(default=0, help_text="Number of times listing was viewed")
     inquiry_count = models.IntegerField(default=0, help_text="Number of inquiries received")
+    # Time-decayed engagement, recomputed periodically (see trending.py)
+    trending_score = models.FloatField(default=0, editable=False)
+    # Nearest listings, nearest first, kept up to date by similar_listings.py
+    similar_ids = models.JSONField(default=list, blank=True, editable=False)
+    
+    # Denormalized engagement counters (maintained in signals.py, see counters.py)
+    likes_count = models.IntegerField(default=0)
+    reviews_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    rating_avg = models.FloatField(default=0, help_text="Average review rating, 0 when unreviewed")
     
     # Listing status
     is_active = models.BooleanField(default=True, help_text="Is listing currently active?")
@@ -125,18 +142,27 @@ class Post(models.Model):
     
     def __str__(self):
         return self.title
+    
+    def save(self, *args, **kwargs):
+        self.geo_cell = self.compute_geo_cell()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'location_latitude', 'location_longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geo_cell'}
+        super().save(*args, **kwargs)
+    
+    def compute_geo_cell(self):
+        if self.location_latitude is None or self.location_longitude is None:
+            return None
+        return encode_geohash(float(self.location_latitude), float(self.location_longitude))
         
     def total_likes(self):
-        return self.likes.count()
+        return self.likes_count
     
     def average_rating(self):
-        reviews = self.reviews.all()
-        if reviews:
-            return reviews.aggregate(models.Avg('rating'))['rating__avg']
-        return 0
+        return self.rating_avg
     
     def review_count(self):
-        return self.reviews.count()
+        return self.reviews_count
     
     def is_sold_out(self):
         return self.inventory <= 0 or self.is_sold
@@ -173,6 +199,25 @@ class Post(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serves sort=rating (see pagination_utils.LISTING_SORT_ORDERINGS)
+            models.Index(fields=['-rating_avg', '-reviews_count', '-id'], name='post_rating_sort_idx'),
+            # Browse paths only ever show in-stock listings, so those indexes
+            # are partial where the database supports it
+            models.Index(fields=['-created_at', '-id'], name='post_instock_newest_idx',
+                         condition=models.Q(inventory__gt=0)),
+            models.Index(fields=['category', '-created_at', '-id'], name='post_instock_category_idx',
+                         condition=models.Q(inventory__gt=0)),
+            models.Index(fields=['price', 'id'], name='post_instock_price_idx',
+                         condition=models.Q(inventory__gt=0)),
+            models.Index(fields=['-total_purchases', '-created_at', '-id'], name='post_instock_popular_idx',
+                         condition=models.Q(inventory__gt=0)),
+            models.Index(fields=['-trending_score', '-created_at', '-id'], name='post_instock_trending_idx',
+                         condition=models.Q(inventory__gt=0)),
+            models.Index(fields=['user', '-created_at'], name='post_user_created_idx'),
+            # Radius and bounding-box search scan geohash prefix ranges
+            models.Index(fields=['geo_cell', 'location_latitude', 'location_longitude'], name='post_geo_cell_idx'),
+        ]
 
 class ListingFee(models.Model):
     """
@@ -488,6 +533,82 @@ class Purchase(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', '-created_at'], name='purchase_status_created_idx'),
+            models.Index(fields=['buyer', 'status'], name='purchase_buyer_status_idx'),
+            models.Index(fields=['property', 'status'], name='purchase_property_status_idx'),
+            # Monthly sales figures: completed purchases within a completed_at range
+            models.Index(fields=['completed_at'], name='purchase_completed_at_idx',
+                         condition=models.Q(status='completed')),
+        ]
+
+class VendorDailySales(models.Model):
+    """
+    One vendor's completed sales and paid listing fees on one day.
+
+    This table and the other ``*DailySales`` tables are kept up to date
+    incrementally by ``signals.py`` (see ``sales_rollups.py``).
+    ``manage.py rebuild_sales_rollups`` recomputes them from ``Purchase`` and
+    ``ListingFee``.
+    """
+    vendor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_sales')
+    day = models.DateField()
+    sales_count = models.IntegerField(default=0)
+    sales_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    listing_fees_count = models.IntegerField(default=0)
+    listing_fees_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'day'], name='vendor_daily_sales_unique'),
+        ]
+
+class PropertyDailySales(models.Model):
+    """One listing's completed sales on one day."""
+    property = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='daily_sales')
+    vendor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='property_daily_sales')
+    day = models.DateField()
+    sales_count = models.IntegerField(default=0)
+    sales_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['property', 'day'], name='property_daily_sales_unique'),
+        ]
+        indexes = [
+            # Per-listing breakdown on the vendor statistics pages
+            models.Index(fields=['vendor', 'property'], name='property_sales_vendor_idx'),
+        ]
+
+class PlatformDailySales(models.Model):
+    """All completed sales and paid listing fees on one day."""
+    day = models.DateField(unique=True)
+    sales_count = models.IntegerField(default=0)
+    sales_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    listing_fees_count = models.IntegerField(default=0)
+    listing_fees_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+class PostViewHourly(models.Model):
+    """
+    Deduplicated detail-page views and net likes of one listing in one hour.
+
+    Written by ``view_tracking.py``: views in batches alongside
+    ``Post.view_count``, likes as they happen (the likes table has no
+    timestamps of its own).
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='hourly_views')
+    hour = models.DateTimeField()
+    views = models.IntegerField(default=0)
+    likes = models.IntegerField(default=0, help_text="Likes added minus likes removed")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'hour'], name='post_view_hourly_unique'),
+        ]
+        indexes = [
+            # Recent views across all listings, for trending
+            models.Index(fields=['hour'], name='post_view_hour_idx'),
+        ]
 
 class Bookmark(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookmarks')
@@ -660,11 +781,21 @@ class Conversation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message = models.ForeignKey(
+        'Message', on_delete=models.SET_NULL,
+        null=True, blank=True,
+        related_name='+',
+        help_text="Most recent message, kept for the inbox"
+    )
     
     # Read tracking
     buyer_last_read = models.DateTimeField(null=True, blank=True)
     seller_last_read = models.DateTimeField(null=True, blank=True)
     
+    # Unread counters per participant (bumped by record_new_message, reset by mark_as_read)
+    buyer_unread_count = models.IntegerField(default=0)
+    seller_unread_count = models.IntegerField(default=0)
+    
     def save(self, *args, **kwargs):
         if not self.conversation_id:
             # Generate a unique conversation ID
@@ -683,39 +814,87 @@ class Conversation(models.Model):
     
     def get_unread_count(self, user):
         """Get count of unread messages for a user."""
-        if user == self.buyer:
-            last_read = self.buyer_last_read
-        else:
-            last_read = self.seller_last_read
-        
-        if not last_read:
-            return self.messages.exclude(sender=user).count()
+        if user.pk == self.buyer_id:
+            return self.buyer_unread_count
+        return self.seller_unread_count
+    
+    def record_new_message(self, message):
+        """
+        Point last_message at a just-saved message and bump the recipient's unread counter.
         
-        return self.messages.exclude(sender=user).filter(created_at__gt=last_read).count()
+        Uses a single UPDATE with F() so concurrent senders never lose a count.
+        """
+        unread_field = 'seller_unread_count' if message.sender_id == self.buyer_id else 'buyer_unread_count'
+        Conversation.objects.filter(pk=self.pk).update(
+            last_message=message,
+            last_message_at=message.created_at,
+            **{unread_field: models.F(unread_field) + 1}
+        )
+        self.last_message = message
+        self.last_message_at = message.created_at
+        setattr(self, unread_field, getattr(self, unread_field) + 1)
+        notify_new_messages({self.pk: message})
     
     def mark_as_read(self, user):
         """Mark all messages as read for a user."""
         now = timezone.now()
-        if user == self.buyer:
+        if user.pk == self.buyer_id:
             self.buyer_last_read = now
+            self.buyer_unread_count = 0
+            self.save(update_fields=['buyer_last_read', 'buyer_unread_count'])
         else:
             self.seller_last_read = now
-        self.save(update_fields=['buyer_last_read' if user == self.buyer else 'seller_last_read'])
+            self.seller_unread_count = 0
+            self.save(update_fields=['seller_last_read', 'seller_unread_count'])
         
         # Also update individual message read status
         self.messages.exclude(sender=user).filter(is_read=False).update(
             is_read=True,
             read_at=now
         )
-    
+        notify_unread_count(user.pk, self.pk, 0)
+
+    def mark_read_up_to(self, user, message_id):
+        """
+        Mark the other participant's messages up to ``message_id`` as read for ``user``.
+
+        One bulk UPDATE on messages and one on the conversation (last read time
+        and unread counter, never below zero). Returns the number of messages
+        that changed, so callers can skip broadcasting no-op receipts.
+        """
+        now = timezone.now()
+        marked = self.messages.filter(id__lte=message_id, is_read=False).exclude(sender_id=user.pk).update(
+            is_read=True,
+            read_at=now
+        )
+        role = 'buyer' if user.pk == self.buyer_id else 'seller'
+        unread_field = f'{role}_unread_count'
+        updates = {f'{role}_last_read': now}
+        if marked:
+            updates[unread_field] = Greatest(models.F(unread_field) - marked, 0)
+        Conversation.objects.filter(pk=self.pk).update(**updates)
+        if marked:
+            unread = Conversation.objects.filter(pk=self.pk).values_list(unread_field, flat=True).first()
+            notify_unread_count(user.pk, self.pk, unread)
+        return marked
+
     def get_last_message(self):
         """Get the most recent message in the conversation."""
+        if self.last_message_id:
+            return self.last_message
         return self.messages.order_by('-created_at').first()
     
     class Meta:
         ordering = ['-last_message_at', '-created_at']
         # Ensure unique conversation between buyer and seller for a specific property
         unique_together = ['buyer', 'seller', 'property']
+        indexes = [
+            # Unread badge: only conversations with something unread are indexed
+            models.Index(fields=['buyer', 'status'], name='conv_buyer_unread_idx',
+                         condition=models.Q(buyer_unread_count__gt=0)),
+            models.Index(fields=['seller', 'status'], name='conv_seller_unread_idx',
+                         condition=models.Q(seller_unread_count__gt=0)),
+        ]
 
 
 class Message(models.Model):
@@ -733,6 +912,10 @@ class Message(models.Model):
     
     # Message content
     content = models.TextField(help_text="Message text content")
+    client_id = models.CharField(
+        max_length=64, blank=True, null=True,
+        help_text="Client-generated id used to acknowledge and deduplicate sends"
+    )
     
     # Optional: attachment support for future
     attachment = models.FileField(
@@ -749,8 +932,8 @@ class Message(models.Model):
     is_read = models.BooleanField(default=False)
     read_at = models.DateTimeField(null=True, blank=True)
     
-    # Timestamps
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Timestamps (created_at is set by the sender so write-behind batches keep send time)
+    created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
     # Soft delete (for message deletion without losing history)
@@ -772,7 +955,8 @@ class Message(models.Model):
         """Soft delete the message."""
         self.is_deleted = True
         self.deleted_at = timezone.now()
-        self.save(update_fields=['is_deleted', 'deleted_at'])
+        # updated_at is part of the history ETag (see chat_views.history_etag)
+        self.save(update_fields=['is_deleted', 'deleted_at', 'updated_at'])
     
     def get_display_content(self):
         """Return content or deletion placeholder."""
@@ -786,3 +970,98 @@ class Message(models.Model):
             models.Index(fields=['conversation', 'created_at']),
             models.Index(fields=['sender', 'created_at']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['conversation', 'sender', 'client_id'],
+                condition=models.Q(client_id__isnull=False),
+                name='unique_message_client_id',
+            ),
+        ]
+
+
+class Job(models.Model):
+    """
+    A unit of background work, queued in the database and run by
+    ``manage.py run_jobs`` (see ``authentication/jobs.py``).
+    """
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    )
+
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    # Who may poll the job through the status endpoint
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now, help_text="Not picked up before this time")
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Workers claim the oldest due job
+            models.Index(fields=['status', 'run_at'], name='job_due_idx'),
+            # ...and count running jobs per task for the concurrency limits
+            models.Index(fields=['task', 'status'], name='job_task_status_idx'),
+        ]
+
+
+class ReportArtifact(models.Model):
+    """
+    A generated PDF report in storage, reused for identical requests
+    (see ``authentication/reports.py``).
+    """
+    REPORT_TYPE_CHOICES = (
+        ('purchase_history', 'Purchase history'),
+        ('customer_purchases', 'Customer purchases'),
+        ('vendor_sales', 'Vendor sales'),
+        ('platform_sales', 'Platform sales'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+    )
+
+    # Hash of (report type, subject, date range, data version)
+    key = models.CharField(max_length=64, unique=True)
+    report_type = models.CharField(max_length=30, choices=REPORT_TYPE_CHOICES)
+    # Whose data the report covers; empty for platform-wide reports
+    subject = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='reports')
+    date_from = models.DateField(null=True, blank=True)
+    date_to = models.DateField(null=True, blank=True)
+    data_version = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    job = models.ForeignKey(Job, on_delete=models.SET_NULL, null=True, blank=True, related_name='reports')
+    file = models.CharField(max_length=255, blank=True, help_text="Name in default storage")
+    filename = models.CharField(max_length=150, help_text="Download file name, without extension")
+    size = models.PositiveIntegerField(default=0)
+    row_count = models.PositiveIntegerField(default=0)
+    build_seconds = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_report_type_display()} #{self.pk} ({self.status})"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['report_type', 'subject', 'date_from', 'date_to'], name='report_scope_idx'),
+        ]
@@ -257,8 +257,13 @@ def send_otp_email(user, otp_code, purpose='purchase_confirmation'):
         print(f"Failed to send OTP email: {e}")
         return False
 
-def create_otp(user, purpose='purchase_confirmation'):
-    """Create and send OTP to user"""
+def create_otp(user, purpose='purchase_confirmation', send_async=False):
+    """
+    Create and send OTP to user
+
+    With ``send_async`` the email is sent by an ``otp.send_email`` job:
+    ``email_sent`` is ``None`` and ``email_job`` is the queued ``Job``.
+    """
     # Invalidate any existing unused OTPs for this user and purpose
     OTPVerification.objects.filter(
         user=user,
@@ -277,6 +282,16 @@ def create_otp(user, purpose='purchase_confirmation'):
         expires_at=timezone.now() + timedelta(minutes=5)
     )
     
+    if send_async:
+        from .tasks import send_otp_email_async
+        job = send_otp_email_async(otp)
+        return {
+            'otp_id': otp.id,
+            'email_sent': None,
+            'email_job': job,
+            'expires_at': otp.expires_at
+        }
+    
     # Send OTP via email
     email_sent = send_otp_email(user, otp_code, purpose)
     
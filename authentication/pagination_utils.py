@@ -0,0 +1,222 @@
+"""
+Keyset (cursor) pagination for marketplace listings.
+
+Offset pagination makes the database walk and discard every row before the
+requested page, and needs a full ``COUNT(*)`` to know how many pages exist.
+Keyset pagination instead remembers the sort key of the last row served and
+asks for rows strictly after it, so every page costs the same no matter how
+deep the user scrolls.
+
+Cursors are opaque, URL-safe strings. They encode the sort key values of the
+boundary row, the ordering they belong to and the direction to read in.
+"""
+
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+# Keyset orderings for the ``sort`` options exposed by the listing endpoints.
+# Each ordering ends with the primary key so that it is strictly unique.
+LISTING_SORT_ORDERINGS = {
+    'newest': ('-created_at', '-id'),
+    'price_low': ('price', 'id'),
+    'price_high': ('-price', '-id'),
+    'popular': ('-total_purchases', '-created_at', '-id'),
+    'trending': ('-trending_score', '-created_at', '-id'),
+    'rating': ('-rating_avg', '-reviews_count', '-id'),
+}
+
+# Upper bound for approximate counts; beyond this the total is reported as
+# "at least APPROX_COUNT_CAP" without scanning the rest of the table.
+APPROX_COUNT_CAP = 1000
+
+COUNT_MODES = ('exact', 'approx', 'none')
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded or belongs to another ordering."""
+
+
+def listing_sort_ordering(sort_by):
+    """Return the keyset ordering for a listing ``sort`` value (default: newest)."""
+    return LISTING_SORT_ORDERINGS.get(sort_by, LISTING_SORT_ORDERINGS['newest'])
+
+
+def keyset_ordering(ordering):
+    """Append ``id`` to an ordering so it is unique, matching the last field's direction."""
+    ordering = tuple(ordering)
+    names = {field.lstrip('-') for field in ordering}
+    if 'id' in names or 'pk' in names:
+        return ordering
+    descending = bool(ordering) and ordering[-1].startswith('-')
+    return ordering + ('-id' if descending else 'id',)
+
+
+def _flip(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _decode_value(model, name, value, annotations):
+    if name in annotations:
+        field = annotations[name].output_field
+    else:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return value
+    try:
+        return field.to_python(value)
+    except ValidationError:
+        raise InvalidCursor('Invalid cursor value')
+
+
+def encode_cursor(obj, ordering, direction='next'):
+    """Encode the position of ``obj`` within ``ordering`` as an opaque cursor."""
+    payload = {
+        'o': list(ordering),
+        'v': [_encode_value(getattr(obj, field.lstrip('-'))) for field in ordering],
+        'd': direction,
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering, model, annotations=None):
+    """
+    Decode a cursor produced by ``encode_cursor`` for the same ordering.
+
+    Values are converted with the model field, or the output field of the
+    matching entry in ``annotations``, of the same name. Returns
+    ``(values, direction)``; raises ``InvalidCursor`` otherwise.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        stored_ordering = payload['o']
+        values = payload['v']
+        direction = payload['d']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor('Invalid cursor')
+
+    if list(stored_ordering) != list(ordering) or len(values) != len(ordering):
+        raise InvalidCursor('Cursor does not match the requested sort order')
+    if direction not in ('next', 'prev'):
+        raise InvalidCursor('Invalid cursor direction')
+
+    return [
+        _decode_value(model, field.lstrip('-'), value, annotations or {})
+        for field, value in zip(ordering, values)
+    ], direction
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the filter selecting rows that come after ``values`` in ``ordering``.
+
+    For ``(a, -b, c)`` this is ``a > va OR (a = va AND b < vb) OR
+    (a = va AND b = vb AND c > vc)``, which composite indexes serve directly.
+    """
+    condition = Q()
+    equal_prefix = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal_prefix, **{f'{name}__{lookup}': value})
+        equal_prefix[name] = value
+    return condition
+
+
+class KeysetPage:
+    """A page of results from ``keyset_paginate``; iterable like a ``Page``."""
+
+    def __init__(self, object_list, ordering, has_next, has_previous):
+        self.object_list = object_list
+        self.ordering = ordering
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not (self._has_next and self.object_list):
+            return None
+        return encode_cursor(self.object_list[-1], self.ordering, 'next')
+
+    @property
+    def prev_cursor(self):
+        if not (self._has_previous and self.object_list):
+            return None
+        return encode_cursor(self.object_list[0], self.ordering, 'prev')
+
+
+def keyset_paginate(queryset, ordering, cursor=None, page_size=20):
+    """
+    Return a ``KeysetPage`` of ``queryset`` ordered by ``ordering``.
+
+    ``cursor`` is a value from a previous page's ``next_cursor`` or
+    ``prev_cursor``; ``None`` returns the first page. Reads ``page_size + 1``
+    rows to learn whether another page exists, so no count is required.
+    """
+    ordering = keyset_ordering(ordering)
+    values, direction = (None, 'next')
+    if cursor:
+        values, direction = decode_cursor(cursor, ordering, queryset.model, queryset.query.annotations)
+
+    read_ordering = ordering if direction == 'next' else tuple(_flip(f) for f in ordering)
+    queryset = queryset.order_by(*read_ordering)
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(read_ordering, values))
+
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if direction == 'prev':
+        rows.reverse()
+        return KeysetPage(rows, ordering, has_next=True, has_previous=has_more)
+    return KeysetPage(rows, ordering, has_next=has_more, has_previous=values is not None)
+
+
+def count_results(queryset, mode='exact', cap=APPROX_COUNT_CAP):
+    """
+    Count ``queryset`` according to ``mode``.
+
+    Returns ``(count, is_exact)``. ``'approx'`` counts at most ``cap + 1``
+    rows, so the database stops early on large result sets; ``'none'`` skips
+    counting and returns ``(None, False)``.
+    """
+    if mode == 'none':
+        return None, False
+    if mode == 'approx':
+        bounded = queryset.order_by()[:cap + 1].count()
+        if bounded > cap:
+            return cap, False
+        return bounded, True
+    return queryset.count(), True
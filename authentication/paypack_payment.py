@@ -248,3 +248,33 @@ def initiate_paypack_payment(listing_fee, user, phone_number=None):
     
     return result
 
+
+
+def record_paypack_request(listing_fee, payment_result):
+    """Store the reference of an accepted cashin request on ``listing_fee``; returns the reference."""
+    transaction_ref = payment_result.get('ref') or payment_result.get('transaction_id')
+    listing_fee.payment_method = 'paypack'
+    listing_fee.payment_status = 'pending'  # Will be updated when payment is confirmed
+    listing_fee.momo_transaction_id = transaction_ref  # Reusing field for Paypack ref
+    listing_fee.momo_status = payment_result.get('status', 'PENDING')
+    listing_fee.momo_status_checked_at = timezone.now()
+    listing_fee.save()
+    return transaction_ref
+
+
+def apply_paypack_status(listing_fee, paypack_status, transaction_id):
+    """
+    Record a Paypack status on ``listing_fee``. A successful payment marks
+    the fee paid and activates the listing; a failed one cancels the fee.
+    """
+    listing_fee.momo_status = paypack_status  # Reusing field for Paypack status
+    listing_fee.momo_status_checked_at = timezone.now()
+    if paypack_status == 'SUCCESSFUL':
+        listing_fee.payment_status = 'paid'
+        listing_fee.paid_at = timezone.now()
+        listing_fee.payment_reference = transaction_id
+        listing_fee.listing.is_active = True
+        listing_fee.listing.save()
+    elif paypack_status == 'FAILED':
+        listing_fee.payment_status = 'cancelled'
+    listing_fee.save()
@@ -0,0 +1,401 @@
+"""
+PDF reports: rendering, report definitions and cached artifacts.
+
+A report is identified by its type, its subject (the buyer or vendor whose
+figures it shows; none for platform reports), its date range and a *data
+version*. The data version is a fingerprint of the rows the report is built
+from: one aggregate query (row count, sums, latest ``updated_at``) that
+changes whenever a row is added, edited or removed. ``request_report``
+computes it, hashes everything into ``ReportArtifact.key``, and returns the
+existing artifact for that key when there is one. Identical requests
+therefore download the stored PDF instead of running ReportLab again. The
+first request builds it, inline or through a ``reports.build`` job.
+
+Once a newer artifact is ready, older artifacts of the same report and
+range (stale data versions) are deleted with their files, so storage holds
+one PDF per report and range.
+"""
+
+import hashlib
+import io
+import json
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from .models import PlatformDailySales, PropertyDailySales, Purchase, ReportArtifact, VendorDailySales
+from .sales_rollups import (
+    in_days, month_days, platform_sales_summary, property_sales_breakdown, vendor_sales_breakdown,
+    vendor_sales_summary,
+)
+
+# Bump when the layout or columns change, so stored PDFs are rebuilt
+REPORT_LAYOUT_VERSION = 2
+# ReportLab re-splits one long table on every page, which makes rendering
+# quadratic in the row count; a series of short tables stays linear
+TABLE_CHUNK_ROWS = 200
+# Rows sampled when sizing the columns
+COLUMN_SAMPLE_ROWS = 500
+# Purchase statuses that still need action
+OPEN_PURCHASE_STATUSES = ('pending_payment', 'payment_confirmed', 'documents_processing')
+
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+])
+
+
+# Rendering
+
+def _column_widths(headers, data, available):
+    """Widths fitting the header and a sample of rows, scaled down to ``available`` if needed."""
+    padding = 12
+    widths = [stringWidth(str(header), 'Helvetica-Bold', 12) + padding for header in headers]
+    for row in data[:COLUMN_SAMPLE_ROWS]:
+        for column, value in enumerate(row):
+            widths[column] = max(widths[column], stringWidth(str(value), 'Helvetica', 10) + padding)
+    total = sum(widths)
+    if total > available:
+        widths = [width * available / total for width in widths]
+    return widths
+
+
+def render_pdf_report(output, title, headers, data, summary_data=None):
+    """Write a titled report with optional summary lines and a table of ``data`` to ``output``."""
+    # Create the PDF object
+    doc = SimpleDocTemplate(output, pagesize=A4)
+    elements = []
+
+    # Get styles
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=16,
+        spaceAfter=30,
+        alignment=TA_CENTER
+    )
+
+    # Add title
+    elements.append(Paragraph(title, title_style))
+    elements.append(Spacer(1, 20))
+
+    # Add summary if provided
+    if summary_data:
+        summary_style = ParagraphStyle(
+            'Summary',
+            parent=styles['Normal'],
+            fontSize=12,
+            spaceAfter=20
+        )
+        for key, value in summary_data.items():
+            elements.append(Paragraph(f"<b>{key}:</b> {value}", summary_style))
+        elements.append(Spacer(1, 20))
+
+    # Create the table in chunks that share column widths and repeat the header
+    if data:
+        widths = _column_widths(headers, data, doc.width)
+        for start in range(0, len(data), TABLE_CHUNK_ROWS):
+            elements.append(Table(
+                [headers] + data[start:start + TABLE_CHUNK_ROWS],
+                colWidths=widths, repeatRows=1, style=TABLE_STYLE,
+            ))
+
+    # Build PDF
+    doc.build(elements)
+
+
+# Report definitions
+#
+# Each report type has ``version(subject, days)``, the data version
+# fingerprint, and ``build(subject, days)``, which returns
+# ``(title, headers, rows, summary)``. ``days`` is a ``(first, last)`` pair
+# of dates (either may be ``None``).
+
+ReportType = namedtuple('ReportType', 'version build')
+
+
+def _midnight(day):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def _day_bounds(days):
+    """Aware ``(start, end)`` datetimes for ``days``; ``end`` is exclusive."""
+    first, last = days or (None, None)
+    return (_midnight(first) if first else None), (_midnight(last + timedelta(days=1)) if last else None)
+
+
+def _in_range(queryset, field, days):
+    start, end = _day_bounds(days)
+    if start:
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{field}__lt': end})
+    return queryset
+
+
+def _display_name(user):
+    return user.get_full_name() or user.username
+
+
+def _money(value):
+    return f"RWF {value or 0:,.1f}"
+
+
+def _purchase_fingerprint(purchases):
+    # Listing edits count too: their titles appear in the rows
+    return purchases.aggregate(
+        rows=Count('pk'), updated=Max('updated_at'), listings_updated=Max('property__updated_at'),
+    )
+
+
+def _purchase_rows(purchases, date_field, with_order_id):
+    rows = []
+    purchases = purchases.select_related('property__user').order_by(f'-{date_field}', '-id')
+    for purchase in purchases.iterator(chunk_size=2000):
+        seller = purchase.property.user if purchase.property else None
+        moment = getattr(purchase, date_field)
+        row = [
+            purchase.property.title if purchase.property else '',
+            f"{seller.first_name} {seller.last_name}" if seller else '',
+            timezone.localtime(moment).strftime('%Y-%m-%d %H:%M') if moment else '',
+            _money(purchase.final_price),
+            purchase.status.title(),
+        ]
+        if with_order_id:
+            row.insert(0, purchase.order_id)
+        rows.append(row)
+    return rows
+
+
+def _purchase_history(buyer, days):
+    return _in_range(Purchase.objects.filter(buyer=buyer), 'created_at', days)
+
+
+def build_purchase_history(buyer, days):
+    purchases = _purchase_history(buyer, days)
+    totals = purchases.aggregate(
+        count=Count('pk'),
+        spent=Sum('final_price'),
+        completed=Count('pk', filter=Q(status='completed')),
+        open=Count('pk', filter=Q(status__in=OPEN_PURCHASE_STATUSES)),
+    )
+    summary = {
+        'Total Purchases': totals['count'],
+        'Total Spent': _money(totals['spent']),
+        'Completed Orders': totals['completed'],
+        'Pending Orders': totals['open'],
+    }
+    headers = ['Order ID', 'Property', 'Seller', 'Date', 'Price', 'Status']
+    rows = _purchase_rows(purchases, 'created_at', with_order_id=True)
+    return f"Purchase History Report - {_display_name(buyer)}", headers, rows, summary
+
+
+def _customer_purchases(buyer, days):
+    # Dated by purchase time, like the customer CSV export
+    return _in_range(Purchase.objects.filter(buyer=buyer, status='completed'), 'created_at', days)
+
+
+def build_customer_purchases(buyer, days):
+    purchases = _customer_purchases(buyer, days)
+    month_start, next_month_start = (_midnight(day) for day in month_days())
+    totals = purchases.aggregate(
+        count=Count('pk'),
+        spent=Sum('final_price'),
+        monthly=Sum('final_price', filter=Q(created_at__gte=month_start, created_at__lt=next_month_start)),
+    )
+    summary = {
+        'Total Purchases': totals['count'],
+        'Total Spent': _money(totals['spent']),
+        'Monthly Spent': _money(totals['monthly']),
+    }
+    headers = ['Product', 'Seller', 'Date', 'Price', 'Status']
+    rows = _purchase_rows(purchases, 'created_at', with_order_id=False)
+    return f"Customer Purchase Report - {_display_name(buyer)}", headers, rows, summary
+
+
+def _rollup_fingerprint(queryset):
+    return queryset.aggregate(
+        rows=Count('pk'), sales=Sum('sales_count'), value=Sum('sales_value'),
+        fees=Sum('listing_fees_count'), fees_value=Sum('listing_fees_value'),
+    )
+
+
+def vendor_sales_version(vendor, days):
+    return {
+        **_rollup_fingerprint(in_days(VendorDailySales.objects.filter(vendor=vendor), days)),
+        **in_days(PropertyDailySales.objects.filter(vendor=vendor), days).aggregate(
+            listings_updated=Max('property__updated_at')),
+        # The summary has this month's revenue
+        'month': month_days()[0],
+    }
+
+
+def build_vendor_sales(vendor, days):
+    summary = vendor_sales_summary(vendor, days)
+    headers = ['Product', 'Total Sales', 'Total Revenue', 'Average Price']
+    rows = [
+        [product['property__title'], product['total_sales'],
+         _money(product['total_revenue']), _money(product['avg_price'])]
+        for product in property_sales_breakdown(vendor, days=days)
+    ]
+    summary_data = {
+        'Total Sales': summary['total_sales'],
+        'Total Revenue': _money(summary['total_revenue']),
+        'Monthly Revenue': _money(summary['monthly_total_revenue']),
+        'Commission Rate': '80%',
+    }
+    return f"Vendor Sales Report - {_display_name(vendor)}", headers, rows, summary_data
+
+
+def platform_sales_version(subject, days):
+    return {
+        **_rollup_fingerprint(in_days(PlatformDailySales.objects.all(), days)),
+        'month': month_days()[0],
+    }
+
+
+def build_platform_sales(subject, days):
+    summary = platform_sales_summary(days)
+    headers = ['Vendor', 'Transactions', 'Total Sales Value', 'Average Sale Price']
+    rows = [
+        [vendor['vendor_username'], vendor['total_transactions'],
+         _money(vendor['total_sales_value']), _money(vendor['avg_sale_price'])]
+        for vendor in vendor_sales_breakdown(days)
+    ]
+    summary_data = {
+        'Total Transactions': summary['total_sales'],
+        'Total Transaction Value': _money(summary['total_revenue']),
+        'Total Listing Fees': _money(summary['listing_fees']),
+        'Monthly Transaction Value': _money(summary['monthly_total_revenue']),
+        'Monthly Listing Fees': _money(summary['monthly_listing_fees']),
+    }
+    return "InzuLink Platform Report", headers, rows, summary_data
+
+
+REPORT_TYPES = {
+    'purchase_history': ReportType(
+        version=lambda buyer, days: _purchase_fingerprint(_purchase_history(buyer, days)),
+        build=build_purchase_history,
+    ),
+    'customer_purchases': ReportType(
+        version=lambda buyer, days: {
+            **_purchase_fingerprint(_customer_purchases(buyer, days)), 'month': month_days()[0],
+        },
+        build=build_customer_purchases,
+    ),
+    'vendor_sales': ReportType(version=vendor_sales_version, build=build_vendor_sales),
+    'platform_sales': ReportType(version=platform_sales_version, build=build_platform_sales),
+}
+
+
+# Artifacts
+
+def data_version(report_type, subject, days):
+    fingerprint = REPORT_TYPES[report_type].version(subject, days)
+    encoded = json.dumps([REPORT_LAYOUT_VERSION, fingerprint], sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def report_key(report_type, subject, days, version):
+    # Keyed with SECRET_KEY: the key is also the file name, which must not be guessable
+    first, last = days or (None, None)
+    parts = json.dumps([report_type, subject.pk if subject else None, str(first), str(last), version])
+    return salted_hmac('authentication.reports', parts, algorithm='sha256').hexdigest()
+
+
+def request_report(report_type, subject, days=None, filename='report', user=None, build_now=False):
+    """
+    The artifact for this report as the data stands now.
+
+    An existing artifact with the same key is returned as is (``ready``, or
+    ``pending`` with its build job). Otherwise a new one is created and
+    built inline with ``build_now``, or by a ``reports.build`` job that
+    ``user`` (the requester) may poll.
+    """
+    from .jobs import enqueue
+
+    version = data_version(report_type, subject, days)
+    first, last = days or (None, None)
+    artifact, _ = ReportArtifact.objects.get_or_create(
+        key=report_key(report_type, subject, days, version),
+        defaults={
+            'report_type': report_type, 'subject': subject, 'date_from': first, 'date_to': last,
+            'data_version': version, 'filename': filename,
+        },
+    )
+    if artifact.status == 'ready':
+        return artifact
+    if build_now:
+        build_report(artifact.pk)
+        artifact.refresh_from_db()
+    elif artifact.job is None or artifact.job.status == 'failed':
+        artifact.job = enqueue('reports.build', user=user or subject, artifact_id=artifact.pk)
+        artifact.save(update_fields=['job'])
+    return artifact
+
+
+def build_report(artifact_id):
+    """Render the artifact's PDF into storage and drop older versions of the same report."""
+    artifact = ReportArtifact.objects.select_related('subject').get(pk=artifact_id)
+    if artifact.status == 'ready':
+        return artifact
+    started = time.perf_counter()
+    title, headers, rows, summary = REPORT_TYPES[artifact.report_type].build(
+        artifact.subject, (artifact.date_from, artifact.date_to)
+    )
+    if artifact.date_from or artifact.date_to:
+        summary['Period'] = f"{artifact.date_from or '...'} to {artifact.date_to or '...'}"
+    summary['Report Generated'] = timezone.localtime().strftime('%Y-%m-%d %H:%M:%S')
+
+    buffer = io.BytesIO()
+    render_pdf_report(buffer, title, headers, rows, summary)
+    content = buffer.getvalue()
+    name = default_storage.save(f'reports/{artifact.report_type}/{artifact.key}.pdf', ContentFile(content))
+
+    artifact.status = 'ready'
+    artifact.file = name
+    artifact.size = len(content)
+    artifact.row_count = len(rows)
+    artifact.build_seconds = time.perf_counter() - started
+    artifact.completed_at = timezone.now()
+    artifact.save()
+
+    stale = ReportArtifact.objects.filter(
+        report_type=artifact.report_type, subject=artifact.subject,
+        date_from=artifact.date_from, date_to=artifact.date_to, pk__lt=artifact.pk,
+    )
+    for old in stale:
+        if old.file:
+            default_storage.delete(old.file)
+        old.delete()
+    return artifact
+
+
+def can_access_report(user, artifact):
+    """Buyers see their own reports; vendor and platform reports are also open to InzuLink admins."""
+    if user.is_staff or (artifact.subject_id is not None and artifact.subject_id == user.id):
+        return True
+    return artifact.report_type in ('vendor_sales', 'platform_sales') and user.is_koraquest()
@@ -0,0 +1,257 @@
+"""
+Daily sales rollups behind the statistics pages.
+
+``VendorDailySales``, ``PropertyDailySales`` and ``PlatformDailySales`` hold
+one row per vendor, listing or platform and day. Each row counts completed
+purchases (by ``completed_at`` day) and paid listing fees (by ``paid_at`` day,
+or ``start_date`` when unset). The statistics views sum a few of these rows
+instead of aggregating every ``Purchase`` and ``ListingFee``. The current
+month is a range on ``day``, so no ``__month``/``__year`` extracts are needed.
+
+The handlers in ``signals.py`` work out what a purchase or fee contributed
+before and after each save or delete. They apply the difference with
+``UPDATE ... SET col = col + n`` in the same transaction, so concurrent
+completions never overwrite each other. Changes that skip signals
+(``QuerySet.update``, raw SQL) are not seen. After those, or to backfill,
+run ``manage.py rebuild_sales_rollups``.
+"""
+
+from collections import defaultdict, namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.apps import apps as global_apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import PlatformDailySales, PropertyDailySales, VendorDailySales
+
+Sale = namedtuple('Sale', 'vendor_id property_id day value')
+Fee = namedtuple('Fee', 'vendor_id day value')
+
+
+def _local_day(moment):
+    if isinstance(moment, datetime):
+        return timezone.localtime(moment).date() if timezone.is_aware(moment) else moment.date()
+    return moment
+
+
+def sale_of(status, completed_at, final_price, property_id, vendor_id):
+    """What a purchase in this state contributes to the rollups, or ``None``."""
+    if status != 'completed' or completed_at is None:
+        return None
+    return Sale(vendor_id, property_id, _local_day(completed_at), final_price or Decimal('0'))
+
+
+def fee_of(payment_status, paid_at, start_date, total_amount, vendor_id):
+    """What a listing fee in this state contributes to the rollups, or ``None``."""
+    if payment_status != 'paid':
+        return None
+    return Fee(vendor_id, _local_day(paid_at or start_date), total_amount or Decimal('0'))
+
+
+def _add(model, lookup, deltas):
+    """Add ``deltas`` to the row matching ``lookup``, creating it if a sale or fee is being added."""
+    if model.objects.filter(**lookup).update(**{field: F(field) + delta for field, delta in deltas.items()}):
+        return
+    # Rows are only missing for additions, or when their vendor or listing was deleted
+    if not any(field.endswith('_count') and delta > 0 for field, delta in deltas.items()):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Another transaction created the row first
+        model.objects.filter(**lookup).update(**{field: F(field) + delta for field, delta in deltas.items()})
+
+
+def apply_sale(sale, sign):
+    """Add (``sign=1``) or remove (``sign=-1``) a completed sale from every rollup."""
+    deltas = {'sales_count': sign, 'sales_value': sign * sale.value}
+    _add(PlatformDailySales, {'day': sale.day}, deltas)
+    if sale.vendor_id is not None:
+        _add(VendorDailySales, {'vendor_id': sale.vendor_id, 'day': sale.day}, deltas)
+        _add(PropertyDailySales, {'property_id': sale.property_id, 'vendor_id': sale.vendor_id,
+                                  'day': sale.day}, deltas)
+
+
+def apply_fee(fee, sign):
+    """Add (``sign=1``) or remove (``sign=-1``) a paid listing fee from the rollups."""
+    deltas = {'listing_fees_count': sign, 'listing_fees_value': sign * fee.value}
+    _add(PlatformDailySales, {'day': fee.day}, deltas)
+    _add(VendorDailySales, {'vendor_id': fee.vendor_id, 'day': fee.day}, deltas)
+
+
+def replace_contribution(old, new, apply):
+    """Swap a row's previous contribution for its new one, if it changed."""
+    if old == new:
+        return
+    if old is not None:
+        apply(old, -1)
+    if new is not None:
+        apply(new, 1)
+
+
+def rebuild_sales_rollups(since=None, apps=global_apps):
+    """
+    Recompute the rollups from ``Purchase`` and ``ListingFee``.
+
+    With ``since`` (a date), only days from then on are replaced. ``apps``
+    lets migrations pass their historical models. Returns the number of
+    ``(vendor, property, platform)`` rows written.
+    """
+    Purchase = apps.get_model('authentication', 'Purchase')
+    ListingFee = apps.get_model('authentication', 'ListingFee')
+    VendorDailySales = apps.get_model('authentication', 'VendorDailySales')
+    PropertyDailySales = apps.get_model('authentication', 'PropertyDailySales')
+    PlatformDailySales = apps.get_model('authentication', 'PlatformDailySales')
+
+    sales = (
+        Purchase.objects.filter(status='completed', completed_at__isnull=False)
+        .annotate(day=TruncDate('completed_at'))
+        .order_by()
+        .values('day', 'property_id', vendor_id=F('property__user_id'))
+        .annotate(count=Count('pk'), value=Sum('final_price'))
+    )
+    fees = (
+        ListingFee.objects.filter(payment_status='paid')
+        .annotate(day=Coalesce(TruncDate('paid_at'), 'start_date'))
+        .order_by()
+        .values('day', 'vendor_id')
+        .annotate(count=Count('pk'), value=Sum('total_amount'))
+    )
+    if since is not None:
+        sales, fees = sales.filter(day__gte=since), fees.filter(day__gte=since)
+
+    zero = Decimal('0')
+    vendor_rows = defaultdict(lambda: [0, zero, 0, zero])
+    platform_rows = defaultdict(lambda: [0, zero, 0, zero])
+    property_rows = []
+    for row in sales:
+        value = row['value'] or zero
+        targets = [platform_rows[row['day']]]
+        # Purchases without a listing only count towards the platform
+        if row['vendor_id']:
+            targets.append(vendor_rows[row['vendor_id'], row['day']])
+            property_rows.append(PropertyDailySales(
+                property_id=row['property_id'], vendor_id=row['vendor_id'], day=row['day'],
+                sales_count=row['count'], sales_value=value,
+            ))
+        for totals in targets:
+            totals[0] += row['count']
+            totals[1] += value
+    for row in fees:
+        value = row['value'] or zero
+        for totals in (platform_rows[row['day']], vendor_rows[row['vendor_id'], row['day']]):
+            totals[2] += row['count']
+            totals[3] += value
+
+    def fields(totals):
+        return dict(zip(('sales_count', 'sales_value', 'listing_fees_count', 'listing_fees_value'), totals))
+
+    with transaction.atomic():
+        for model in (VendorDailySales, PropertyDailySales, PlatformDailySales):
+            stale = model.objects.all()
+            if since is not None:
+                stale = stale.filter(day__gte=since)
+            stale.delete()
+        VendorDailySales.objects.bulk_create(
+            [VendorDailySales(vendor_id=vendor_id, day=day, **fields(totals))
+             for (vendor_id, day), totals in vendor_rows.items()],
+            batch_size=1000,
+        )
+        PropertyDailySales.objects.bulk_create(property_rows, batch_size=1000)
+        PlatformDailySales.objects.bulk_create(
+            [PlatformDailySales(day=day, **fields(totals)) for day, totals in platform_rows.items()],
+            batch_size=1000,
+        )
+    return len(vendor_rows), len(property_rows), len(platform_rows)
+
+
+# Reading
+
+def month_days(today=None):
+    """``(first day of this month, first day of next month)`` in the current timezone."""
+    month_start = (today or timezone.localdate()).replace(day=1)
+    if month_start.month == 12:
+        return month_start, date(month_start.year + 1, 1, 1)
+    return month_start, month_start.replace(month=month_start.month + 1)
+
+
+def in_days(queryset, days):
+    """Rows with ``day`` in ``days``, a ``(first, last)`` pair of dates where either may be ``None``."""
+    first, last = days or (None, None)
+    if first:
+        queryset = queryset.filter(day__gte=first)
+    if last:
+        queryset = queryset.filter(day__lte=last)
+    return queryset
+
+
+def _summary(queryset, with_fees=True):
+    month_start, next_month_start = month_days()
+    this_month = Q(day__gte=month_start, day__lt=next_month_start)
+    fields = {'total_sales': 'sales_count', 'total_revenue': 'sales_value'}
+    if with_fees:
+        fields.update(listing_fees='listing_fees_value', fees_paid='listing_fees_count')
+    aggregates = {}
+    for name, field in fields.items():
+        aggregates[name] = Sum(field)
+        aggregates[f'monthly_{name}'] = Sum(field, filter=this_month)
+    totals = queryset.aggregate(**aggregates)
+    return {
+        name: value if value is not None else (0 if name.endswith(('sales', 'paid')) else Decimal('0'))
+        for name, value in totals.items()
+    }
+
+
+def vendor_sales_summary(vendor, days=None):
+    """
+    A vendor's sales and listing fees, overall and this month, in one query.
+
+    Keys: ``total_sales``, ``total_revenue``, ``listing_fees`` (value) and
+    ``fees_paid`` (count), each also prefixed with ``monthly_``. ``days``
+    limits the overall figures to a ``(first, last)`` date range.
+    """
+    return _summary(in_days(VendorDailySales.objects.filter(vendor=vendor), days))
+
+
+def platform_sales_summary(days=None):
+    """``vendor_sales_summary`` for the whole platform."""
+    return _summary(in_days(PlatformDailySales.objects.all(), days))
+
+
+def property_sales_breakdown(vendor, limit=None, days=None):
+    """Sales per listing of ``vendor``, best-selling first, shaped like the old ``values()`` rows."""
+    rows = (
+        in_days(PropertyDailySales.objects.filter(vendor=vendor), days)
+        .values('property_id', 'property__title')
+        .annotate(total_sales=Sum('sales_count'), total_revenue=Sum('sales_value'))
+        .filter(total_sales__gt=0)
+        .order_by('-total_revenue')
+    )
+    if limit:
+        rows = rows[:limit]
+    return [{**row, 'avg_price': row['total_revenue'] / row['total_sales']} for row in rows]
+
+
+def vendor_sales_breakdown(days=None):
+    """Sales per vendor across the platform, highest value first."""
+    rows = (
+        in_days(VendorDailySales.objects.all(), days).values('vendor_id', 'vendor__username')
+        .annotate(total_transactions=Sum('sales_count'), total_sales_value=Sum('sales_value'))
+        .filter(total_transactions__gt=0)
+        .order_by('-total_sales_value')
+    )
+    return [
+        {
+            'vendor_id': row['vendor_id'],
+            'vendor_username': row['vendor__username'],
+            'total_transactions': row['total_transactions'],
+            'total_sales_value': row['total_sales_value'],
+            'avg_sale_price': row['total_sales_value'] / row['total_transactions'],
+        }
+        for row in rows
+    ]
@@ -0,0 +1,179 @@
+"""
+Full-text search backends for property listings.
+
+Listing search used to OR three ``icontains`` filters (title, description and
+owner username), which forces a sequential scan plus a join on every search.
+Each backend here keeps a search index next to the ``Post`` table and
+exposes the same small interface:
+
+- ``search(queryset, query)`` filters a ``Post`` queryset down to matches and
+  annotates ``search_rank`` (higher is more relevant)
+- ``index_post(post)`` / ``remove_post(post_id)`` keep the index in sync and
+  are called from the ``Post`` save/delete signals
+- ``rebuild()`` re-indexes every listing (``manage.py rebuild_search_index``)
+
+``PostgresSearchBackend`` stores a weighted ``tsvector`` per post in
+``authentication_post_search`` with a GIN index. ``SQLiteFTSSearchBackend``
+mirrors listings into the FTS5 virtual table ``authentication_post_fts``.
+Both tables are created by migration ``0009_post_search_index``. Any other
+database, or SQLite built without FTS5, falls back to ``LikeSearchBackend``.
+"""
+
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+POSTGRES_SEARCH_TABLE = 'authentication_post_search'
+POSTGRES_SEARCH_CONFIG = 'simple'
+SQLITE_FTS_TABLE = 'authentication_post_fts'
+
+# Keyset ordering for ``sort=relevance``; only valid on ``search_posts`` results
+RELEVANCE_ORDERING = ('-search_rank', '-id')
+
+_TOKEN_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a free-text query into lowercase word tokens."""
+    return _TOKEN_RE.findall(query.lower())
+
+
+class LikeSearchBackend:
+    """Unindexed fallback reproducing the original ``icontains`` search."""
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(title__icontains=query) |
+            Q(description__icontains=query) |
+            Q(user__username__icontains=query)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+class _IndexedSearchBackend(LikeSearchBackend):
+    """Shared plumbing for backends that keep a shadow index table."""
+
+    match_sql = None
+    rank_sql = None
+
+    def build_query(self, tokens):
+        raise NotImplementedError
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return super().search(queryset, query)
+        search_query = self.build_query(tokens)
+        return queryset.filter(
+            id__in=RawSQL(self.match_sql, [search_query])
+        ).annotate(
+            search_rank=RawSQL(self.rank_sql, [search_query], output_field=FloatField())
+        )
+
+    def _execute(self, sql, params=None):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def rebuild(self):
+        from .models import Post
+
+        self._execute(f'DELETE FROM {self.table}')
+        count = 0
+        for post in Post.objects.using(self.alias).select_related('user').iterator(chunk_size=500):
+            self.index_post(post)
+            count += 1
+        return count
+
+
+class PostgresSearchBackend(_IndexedSearchBackend):
+    """``tsvector`` + GIN index, ranked with ``ts_rank``."""
+
+    table = POSTGRES_SEARCH_TABLE
+    match_sql = (
+        f"SELECT post_id FROM {POSTGRES_SEARCH_TABLE} "
+        f"WHERE document @@ to_tsquery('{POSTGRES_SEARCH_CONFIG}', %s)"
+    )
+    rank_sql = (
+        f"SELECT ts_rank(document, to_tsquery('{POSTGRES_SEARCH_CONFIG}', %s)) "
+        f"FROM {POSTGRES_SEARCH_TABLE} WHERE post_id = authentication_post.id"
+    )
+
+    def build_query(self, tokens):
+        # Prefix match every word, all words required
+        return ' & '.join(f'{token}:*' for token in tokens)
+
+    def index_post(self, post):
+        config = POSTGRES_SEARCH_CONFIG
+        self._execute(
+            f"INSERT INTO {self.table} (post_id, document) VALUES (%s, "
+            f"setweight(to_tsvector('{config}', %s), 'A') || "
+            f"setweight(to_tsvector('{config}', %s), 'B') || "
+            f"setweight(to_tsvector('{config}', %s), 'C')) "
+            f"ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document",
+            [post.pk, post.title or '', post.description or '', post.user.username]
+        )
+
+    def remove_post(self, post_id):
+        self._execute(f'DELETE FROM {self.table} WHERE post_id = %s', [post_id])
+
+
+class SQLiteFTSSearchBackend(_IndexedSearchBackend):
+    """FTS5 shadow table keyed by post id, ranked with ``bm25``."""
+
+    table = SQLITE_FTS_TABLE
+    match_sql = f'SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s'
+    # bm25() is lower-is-better; negate so higher means more relevant
+    rank_sql = (
+        f'SELECT -bm25({SQLITE_FTS_TABLE}, 10.0, 1.0, 5.0) FROM {SQLITE_FTS_TABLE} '
+        f'WHERE {SQLITE_FTS_TABLE} MATCH %s AND rowid = authentication_post.id'
+    )
+
+    def build_query(self, tokens):
+        # Quoted prefix terms; FTS5 ANDs adjacent terms
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def index_post(self, post):
+        self.remove_post(post.pk)
+        self._execute(
+            f'INSERT INTO {self.table} (rowid, title, description, username) VALUES (%s, %s, %s, %s)',
+            [post.pk, post.title or '', post.description or '', post.user.username]
+        )
+
+    def remove_post(self, post_id):
+        self._execute(f'DELETE FROM {self.table} WHERE rowid = %s', [post_id])
+
+
+_backends = {}
+
+
+def get_search_backend(alias='default'):
+    """Return the search backend for a database alias, chosen once per process."""
+    if alias not in _backends:
+        connection = connections[alias]
+        tables = set(connection.introspection.table_names())
+        if connection.vendor == 'postgresql' and POSTGRES_SEARCH_TABLE in tables:
+            backend = PostgresSearchBackend(alias)
+        elif connection.vendor == 'sqlite' and SQLITE_FTS_TABLE in tables:
+            backend = SQLiteFTSSearchBackend(alias)
+        else:
+            backend = LikeSearchBackend(alias)
+        _backends[alias] = backend
+    return _backends[alias]
+
+
+def search_posts(queryset, query):
+    """Filter a ``Post`` queryset by a free-text query, annotating ``search_rank``."""
+    return get_search_backend(queryset.db).search(queryset, query)
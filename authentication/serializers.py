@@ -7,6 +7,7 @@ from .models import (
     UserQRCode, OTPVerification, ProductReview,
     PropertyInquiry, ListingFee
 )
+from .geo_utils import distance_km
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -130,6 +131,7 @@ class PostSerializer(serializers.ModelSerializer):
     reviews = ProductReviewSerializer(many=True, read_only=True)
     property_details = serializers.SerializerMethodField()
     display_size = serializers.SerializerMethodField()
+    distance_km = serializers.SerializerMethodField()
     
     class Meta:
         model = Post
@@ -139,15 +141,15 @@ class PostSerializer(serializers.ModelSerializer):
             'parking_spaces', 'year_built', 'is_furnished', 
             'location_address', 'location_district', 'location_city',
             'location_latitude', 'location_longitude',
-            'total_purchases', 'view_count', 'inquiry_count',
+            'total_purchases', 'view_count', 'inquiry_count', 'trending_score',
             'is_active', 'is_sold', 'created_at', 'updated_at',
             'user', 'likes_count', 'average_rating', 'review_count',
             'is_sold_out', 'auxiliary_images', 'reviews',
-            'property_details', 'display_size'
+            'property_details', 'display_size', 'distance_km'
         ]
         read_only_fields = [
             'id', 'created_at', 'updated_at', 'total_purchases', 
-            'view_count', 'inquiry_count', 'is_sold'
+            'view_count', 'inquiry_count', 'trending_score', 'is_sold'
         ]
     
     def get_likes_count(self, obj):
@@ -159,6 +161,10 @@ class PostSerializer(serializers.ModelSerializer):
     def get_review_count(self, obj):
         return obj.review_count()
     
+    def get_distance_km(self, obj):
+        # Set only when the request was filtered with ?near=
+        return distance_km(obj)
+    
     def get_is_sold_out(self, obj):
         return obj.is_sold_out()
     
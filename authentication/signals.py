@@ -0,0 +1,253 @@
+"""
+Signal handlers for the authentication app.
+
+Keep the listing search index, the similar-listings index, the denormalized
+``Post`` counters and the hourly like buckets in step with ``Post``, like and
+``ProductReview`` rows, the daily sales rollups in step with ``Purchase`` and
+``ListingFee`` rows, move the cache versions in ``cache_utils`` when posts,
+users or purchases change, and tell connected chat and notification sockets
+when a conversation is created or its status changes.
+"""
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache_utils import bump
+from .chat_notifications import notify_conversation_update
+from .counters import apply_like_delta, apply_review_delta, rebuild_post_counters
+from .models import Conversation, ListingFee, Post, ProductReview, Purchase, User
+from .sales_rollups import apply_fee, apply_sale, fee_of, replace_contribution, sale_of
+from .search_backends import get_search_backend
+from .similar_listings import SIMILARITY_FIELDS
+from .tasks import refresh_similar_listings_async
+from .view_tracking import record_likes
+
+# Fields copied into the search index; saves touching only other fields skip re-indexing
+SEARCH_INDEXED_FIELDS = {'title', 'description', 'user'}
+# Saves touching only these fields leave cached data alone
+CACHE_IGNORED_FIELDS = {
+    Post: {'view_count', 'updated_at'},
+    User: {'last_login'},
+}
+
+
+@receiver(post_save, sender=Post)
+def index_post_for_search(sender, instance, raw=False, using='default', update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not SEARCH_INDEXED_FIELDS & set(update_fields):
+        return
+    get_search_backend(using).index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_from_search(sender, instance, using='default', **kwargs):
+    get_search_backend(using).remove_post(instance.pk)
+
+
+def similarity_values(post):
+    return {name: Post._meta.get_field(name).to_python(getattr(post, name)) for name in SIMILARITY_FIELDS}
+
+
+@receiver(pre_save, sender=Post)
+def remember_similarity_values(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._previous_similarity = None
+    if instance.pk and not raw and (update_fields is None or SIMILARITY_FIELDS & set(update_fields)):
+        instance._previous_similarity = (
+            Post.objects.filter(pk=instance.pk).values(*SIMILARITY_FIELDS).first()
+        )
+
+
+@receiver(post_save, sender=Post)
+def refresh_similar_listings_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not SIMILARITY_FIELDS & set(update_fields):
+        return
+    previous = getattr(instance, '_previous_similarity', None)
+    current = similarity_values(instance)
+    if not created and previous is not None:
+        saved = SIMILARITY_FIELDS if update_fields is None else SIMILARITY_FIELDS & set(update_fields)
+        if all(previous[name] == current[name] for name in saved):
+            return  # e.g. an inquiry counter or description save
+        refresh_similar_on_commit(instance.pk, {previous['property_type'], current['property_type']})
+    else:
+        refresh_similar_on_commit(instance.pk, {current['property_type']})
+
+
+@receiver(post_delete, sender=Post)
+def refresh_similar_listings_on_delete(sender, instance, **kwargs):
+    refresh_similar_on_commit(instance.pk, {instance.property_type})
+
+
+def refresh_similar_on_commit(post_id, property_types):
+    # After commit, so the job sees the saved listing (or that it is gone)
+    transaction.on_commit(lambda: refresh_similar_listings_async([post_id], property_types))
+
+
+@receiver(m2m_changed, sender=Post.likes.through)
+def update_likes_count(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        # pk_set only holds rows that were actually added/removed
+        delta = 1 if action == 'post_add' else -1
+        if reverse:
+            # user.liked_posts.add(...): one like for each post in pk_set
+            apply_like_delta(pk_set, delta)
+            record_likes(pk_set, delta)
+        elif pk_set:
+            apply_like_delta([instance.pk], delta * len(pk_set))
+            record_likes([instance.pk], delta * len(pk_set))
+            instance.likes_count += delta * len(pk_set)
+    elif action == 'pre_clear':
+        if reverse:
+            instance._cleared_liked_post_ids = list(instance.liked_posts.values_list('pk', flat=True))
+        else:
+            instance._cleared_likes = instance.likes.count()
+    elif action == 'post_clear':
+        if reverse:
+            rebuild_post_counters(Post.objects.filter(pk__in=instance._cleared_liked_post_ids))
+            record_likes(instance._cleared_liked_post_ids, -1)
+        else:
+            Post.objects.filter(pk=instance.pk).update(likes_count=0)
+            if instance._cleared_likes:
+                record_likes([instance.pk], -instance._cleared_likes)
+            instance.likes_count = 0
+
+
+@receiver(pre_save, sender=ProductReview)
+def remember_previous_rating(sender, instance, raw=False, **kwargs):
+    instance._previous_rating = None
+    if instance.pk and not raw:
+        instance._previous_rating = (
+            ProductReview.objects.filter(pk=instance.pk).values_list('rating', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=ProductReview)
+def update_review_counters_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        apply_review_delta(instance.product_id, 1, instance.rating)
+    elif instance._previous_rating is not None and instance._previous_rating != instance.rating:
+        apply_review_delta(instance.product_id, 0, instance.rating - instance._previous_rating)
+
+
+@receiver(post_delete, sender=ProductReview)
+def update_review_counters_on_delete(sender, instance, **kwargs):
+    apply_review_delta(instance.product_id, -1, -instance.rating)
+
+
+@receiver(pre_save, sender=Purchase)
+def remember_previous_sale(sender, instance, raw=False, **kwargs):
+    instance._previous_sale = None
+    if instance.pk and not raw:
+        previous = Purchase.objects.filter(pk=instance.pk).values_list(
+            'status', 'completed_at', 'final_price', 'property_id', 'property__user_id'
+        ).first()
+        if previous:
+            instance._previous_sale = sale_of(*previous)
+
+
+@receiver(post_save, sender=Purchase)
+def update_sales_rollups_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    vendor_id = instance.property.user_id if instance.property_id else None
+    replace_contribution(instance._previous_sale, sale_of(
+        instance.status, instance.completed_at, instance.final_price, instance.property_id, vendor_id
+    ), apply_sale)
+
+
+@receiver(post_delete, sender=Purchase)
+def update_sales_rollups_on_delete(sender, instance, **kwargs):
+    vendor_id = instance.property.user_id if instance.property_id else None
+    replace_contribution(sale_of(
+        instance.status, instance.completed_at, instance.final_price, instance.property_id, vendor_id
+    ), None, apply_sale)
+
+
+@receiver(pre_save, sender=ListingFee)
+def remember_previous_fee(sender, instance, raw=False, **kwargs):
+    instance._previous_fee = None
+    if instance.pk and not raw:
+        previous = ListingFee.objects.filter(pk=instance.pk).values_list(
+            'payment_status', 'paid_at', 'start_date', 'total_amount', 'vendor_id'
+        ).first()
+        if previous:
+            instance._previous_fee = fee_of(*previous)
+
+
+@receiver(post_save, sender=ListingFee)
+def update_fee_rollups_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    replace_contribution(instance._previous_fee, fee_of(
+        instance.payment_status, instance.paid_at, instance.start_date, instance.total_amount, instance.vendor_id
+    ), apply_fee)
+
+
+@receiver(post_delete, sender=ListingFee)
+def update_fee_rollups_on_delete(sender, instance, **kwargs):
+    replace_contribution(fee_of(
+        instance.payment_status, instance.paid_at, instance.start_date, instance.total_amount, instance.vendor_id
+    ), None, apply_fee)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Purchase)
+def invalidate_cache_on_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= CACHE_IGNORED_FIELDS.get(sender, set()):
+        return
+    bump_on_commit(sender)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Purchase)
+def invalidate_cache_on_delete(sender, instance, **kwargs):
+    bump_on_commit(sender)
+
+
+@receiver(m2m_changed, sender=Post.likes.through)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_cache_on_engagement(sender, **kwargs):
+    # Like and review counters live on Post; m2m_changed fires pre_ and post_ actions
+    if kwargs.get('action', 'post_').startswith('post_'):
+        bump_on_commit(Post)
+
+
+def bump_on_commit(model):
+    # After commit, so a concurrent reader can't re-cache the old rows under the new version
+    transaction.on_commit(lambda: bump(model._meta.model_name))
+
+
+@receiver(post_save, sender=Conversation)
+def broadcast_conversation_status(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+    Push status changes to open ChatConsumers, which cache the status from connect,
+    and new or changed conversations to both participants' notification sockets.
+    """
+    if raw:
+        return
+    if created:
+        notify_conversation_update(instance, created=True)
+        return
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    if update_fields is None and instance.status == 'active':
+        return
+
+    def send():
+        async_to_sync(get_channel_layer().group_send)(f'chat_{instance.pk}', {
+            'type': 'conversation_status',
+            'status': instance.status,
+        })
+
+    transaction.on_commit(send)
+    notify_conversation_update(instance)
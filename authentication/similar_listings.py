@@ -0,0 +1,241 @@
+"""
+"Similar properties" on the listing detail page.
+
+Each listing stores the ids of its ``SIMILAR_LISTINGS_COUNT`` nearest
+neighbours in ``Post.similar_ids``. Neighbours are in-stock, active listings
+of the same property type. Listings are encoded as weighted feature vectors
+(see ``encode_listings``), so the squared Euclidean distance between two
+vectors is the sum of:
+
+- ``category`` and ``district``: the weight once for each side that differs
+  (one-hot columns);
+- ``price``: the weight per doubling of the price, squared. Price bands are
+  relative, so 10M vs 20M is as far apart as 100M vs 200M;
+- ``size`` (log2 of ``size_sqm``) and ``bedrooms``: the weight per unit,
+  squared. Missing values take the mean of their property type.
+
+Distances for a block of listings against all candidates come from one
+matrix product, ``|a|^2 + |b|^2 - 2 a.b`` (``_squared_distances``).
+
+The index is kept up to date incrementally. Saving a listing with changed
+``SIMILARITY_FIELDS``, or deleting one, queues a ``listings.similar`` job for
+it (see ``signals.py``); changes made while a job is waiting are merged into
+it. The job (``refresh_similar_listings``) loads only the property types the
+changed listings are or were in, and recomputes the neighbours of:
+
+- the changed listings themselves;
+- listings that had a changed listing as a neighbour;
+- listings that a changed listing is now closer to than their furthest
+  neighbour.
+
+It does not recompute the whole table. ``manage.py rebuild_similar_listings``
+rebuilds everything, e.g. after changing the weights.
+
+``similar_listings`` serves a detail page. It does one cache lookup, keyed by
+the stored ids, and queries only on a miss.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+from .cache_utils import cached
+from .models import Post
+
+# Fields the neighbour index reads; saves touching none of them skip a refresh
+SIMILARITY_FIELDS = {
+    'property_type', 'category', 'price', 'location_district', 'size_sqm', 'bedrooms',
+    'inventory', 'is_active', 'is_sold',
+}
+
+DEFAULT_WEIGHTS = {'category': 4.0, 'district': 3.0, 'price': 2.0, 'size': 1.0, 'bedrooms': 0.5}
+
+# Listings per distance block, which holds BLOCK_SIZE x candidates float64s
+BLOCK_SIZE = 512
+
+COLUMNS = (
+    'pk', 'property_type', 'category', 'price', 'location_district', 'size_sqm', 'bedrooms',
+    'inventory', 'is_active', 'is_sold', 'similar_ids',
+)
+
+CANDIDATE_FILTER = Q(inventory__gt=0, is_active=True, is_sold=False)
+
+
+def neighbour_count():
+    return getattr(settings, 'SIMILAR_LISTINGS_COUNT', 6)
+
+
+def similarity_weights():
+    return {**DEFAULT_WEIGHTS, **getattr(settings, 'SIMILAR_LISTINGS_WEIGHTS', {})}
+
+
+def _one_hot(values, weight):
+    labels = sorted({value for value in values if value})
+    if not labels:
+        return np.zeros((len(values), 0))
+    column = {label: i for i, label in enumerate(labels)}
+    matrix = np.zeros((len(values), len(labels)))
+    for row, value in enumerate(values):
+        if value:
+            matrix[row, column[value]] = 1.0
+    return matrix * np.sqrt(weight)
+
+
+def _numeric(values, weight, transform=None):
+    column = np.array([np.nan if value is None else float(value) for value in values])
+    if transform is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            column = transform(column)
+        column[~np.isfinite(column)] = np.nan
+    missing = np.isnan(column)
+    column[missing] = 0.0 if missing.all() else np.nanmean(column)
+    return column[:, None] * np.sqrt(weight)
+
+
+def encode_listings(rows, weights=None):
+    """Feature matrix for ``rows`` (dicts with the ``COLUMNS`` keys) of one property type."""
+    weights = weights or similarity_weights()
+    return np.hstack([
+        _one_hot([row['category'] for row in rows], weights['category']),
+        _one_hot([(row['location_district'] or '').strip().lower() for row in rows], weights['district']),
+        _numeric([row['price'] for row in rows], weights['price'], np.log2),
+        _numeric([row['size_sqm'] for row in rows], weights['size'], np.log2),
+        _numeric([row['bedrooms'] for row in rows], weights['bedrooms']),
+    ])
+
+
+def _is_candidate(row):
+    return row['inventory'] > 0 and row['is_active'] and not row['is_sold']
+
+
+def _squared_distances(a, a_ids, b, b_ids):
+    """``len(a) x len(b)`` squared distances, infinite between a listing and itself."""
+    distances = (
+        np.einsum('ij,ij->i', a, a)[:, None] + np.einsum('ij,ij->i', b, b)[None, :] - 2 * a @ b.T
+    )
+    distances[a_ids[:, None] == b_ids[None, :]] = np.inf
+    return distances
+
+
+def _nearest(queries, query_ids, candidates, candidate_ids, k):
+    """For each query row, the ids of its ``k`` nearest candidates (never itself), nearest first."""
+    if not len(candidate_ids) or k <= 0:
+        return [[] for _ in query_ids]
+    distances = _squared_distances(queries, query_ids, candidates, candidate_ids)
+    k = min(k, len(candidate_ids))
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(distances, nearest, axis=1), axis=1, kind='stable')
+    nearest = np.take_along_axis(nearest, order, axis=1)
+    return [
+        [int(candidate_ids[j]) for j in row if np.isfinite(distances[i, j])]
+        for i, row in enumerate(nearest)
+    ]
+
+
+class _Group:
+    """All listings of one property type, encoded once."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.ids = np.array([row['pk'] for row in rows])
+        self.position = {row['pk']: i for i, row in enumerate(rows)}
+        self.features = encode_listings(rows)
+        mask = np.array([_is_candidate(row) for row in rows], dtype=bool)
+        self.candidates = self.features[mask]
+        self.candidate_ids = self.ids[mask]
+
+    def neighbours(self, positions, k):
+        result = []
+        for start in range(0, len(positions), BLOCK_SIZE):
+            block = positions[start:start + BLOCK_SIZE]
+            result.extend(_nearest(self.features[block], self.ids[block], self.candidates, self.candidate_ids, k))
+        return result
+
+    def affected_by(self, changed_ids, k):
+        """Positions whose neighbours may change because ``changed_ids`` changed."""
+        affected = {self.position[pk] for pk in changed_ids if pk in self.position}
+        changed = [self.position[pk] for pk in changed_ids
+                   if pk in self.position and _is_candidate(self.rows[self.position[pk]])]
+        # Distance of every listing to its current furthest neighbour
+        furthest = np.full(len(self.rows), np.inf)
+        for i, row in enumerate(self.rows):
+            stored = row['similar_ids'] or []
+            if set(stored) & changed_ids:
+                affected.add(i)
+            elif len(stored) >= k and stored[-1] in self.position:
+                last = self.features[self.position[stored[-1]]] - self.features[i]
+                furthest[i] = last @ last
+        if changed:
+            to_changed = _squared_distances(self.features, self.ids, self.features[changed], self.ids[changed])
+            affected.update(np.flatnonzero(to_changed.min(axis=1) < furthest).tolist())
+        return sorted(affected)
+
+
+def _load_groups(property_types=None):
+    rows = Post.objects.order_by('pk')
+    if property_types is not None:
+        rows = rows.filter(property_type__in=property_types)
+    groups = defaultdict(list)
+    for row in rows.values(*COLUMNS).iterator(chunk_size=5000):
+        groups[row['property_type']].append(row)
+    return {property_type: _Group(rows) for property_type, rows in groups.items()}
+
+
+def _save(group, positions, neighbour_lists):
+    changed = [
+        Post(pk=group.rows[i]['pk'], similar_ids=ids)
+        for i, ids in zip(positions, neighbour_lists)
+        if ids != (group.rows[i]['similar_ids'] or [])
+    ]
+    # bulk_update fires no signals, so storing neighbours never queues another refresh
+    Post.objects.bulk_update(changed, ['similar_ids'], batch_size=500)
+    return len(changed)
+
+
+def rebuild_similar_listings():
+    """Recompute every listing's neighbours; returns how many lists changed."""
+    k = neighbour_count()
+    updated = 0
+    for group in _load_groups().values():
+        positions = list(range(len(group.rows)))
+        updated += _save(group, positions, group.neighbours(positions, k))
+    return updated
+
+
+def refresh_similar_listings(post_ids, property_types=None):
+    """
+    Update the index after the listings in ``post_ids`` were saved or deleted.
+
+    ``property_types`` are the types the listings had before the change;
+    their current types are looked up. ``None`` checks every group.
+    """
+    k = neighbour_count()
+    changed_ids = set(post_ids)
+    if property_types is not None:
+        property_types = set(property_types) | set(
+            Post.objects.filter(pk__in=changed_ids).values_list('property_type', flat=True)
+        )
+    updated = 0
+    for group in _load_groups(property_types).values():
+        positions = group.affected_by(changed_ids, k)
+        if positions:
+            updated += _save(group, positions, group.neighbours(positions, k))
+    return updated
+
+
+def similar_listings(post):
+    """The stored neighbours of ``post`` that are still in stock, nearest first."""
+    ids = post.similar_ids or []
+    if not ids:
+        return []
+
+    def load():
+        listings = Post.objects.filter(CANDIDATE_FILTER, pk__in=ids).select_related('user').in_bulk()
+        return [listings[pk] for pk in ids if pk in listings]
+
+    return cached(
+        'similar_listings', load, parts=('-'.join(map(str, ids)),), depends_on=('post', 'user'),
+        timeout=getattr(settings, 'SIMILAR_LISTINGS_CACHE_TIMEOUT', 600),
+    )
@@ -0,0 +1,164 @@
+"""
+Background tasks and their ``*_async`` call-site variants.
+
+Each ``*_async`` function queues a job (see ``jobs.py``) and returns the
+``Job`` straight away. Views turn it into a 202 response with
+``job_reference`` and clients poll ``job_status`` for the result. Payloads
+carry ids, never model instances or secrets: the OTP email job reads its
+code from the ``OTPVerification`` row when it runs.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .jobs import PermanentJobError, enqueue, task
+from .models import Job, ListingFee, OTPVerification, ReportArtifact, User
+from .otp_utils import send_otp_email
+from .qr_utils import update_user_qr_code
+from .reports import build_report
+from .similar_listings import refresh_similar_listings
+from .trending import update_trending_scores
+
+
+# PDF reports
+
+@task('reports.build', concurrency=2)
+def build_report_artifact(artifact_id):
+    try:
+        artifact = build_report(artifact_id)
+    except ReportArtifact.DoesNotExist:
+        raise PermanentJobError('Report was replaced by a newer version')
+    return {'report_id': artifact.pk, 'size': artifact.size, 'rows': artifact.row_count}
+
+
+# OTP emails
+
+@task('otp.send_email', concurrency=4, max_attempts=4, backoff=10)
+def deliver_otp_email(otp_id):
+    otp = OTPVerification.objects.select_related('user').get(pk=otp_id)
+    if otp.is_used or otp.is_expired():
+        raise PermanentJobError('OTP was used or expired before it could be sent')
+    # send_otp_email reports SMTP errors by returning False
+    if not send_otp_email(otp.user, otp.otp_code, otp.purpose):
+        raise RuntimeError(f'Could not send OTP email to {otp.user.email}')
+    return {'email': otp.user.email}
+
+
+def send_otp_email_async(otp):
+    """Queue the email for an ``OTPVerification`` created by ``create_otp(send_async=True)``."""
+    return enqueue('otp.send_email', user=otp.user, otp_id=otp.pk)
+
+
+# QR codes
+
+@task('qr.update_user_code', concurrency=2)
+def render_user_qr_code(user_id):
+    user_qr = update_user_qr_code(User.objects.get(pk=user_id))
+    return {
+        'qr_image_url': user_qr.qr_image.url if user_qr.qr_image else None,
+        'expires_at': user_qr.expires_at,
+    }
+
+
+def update_user_qr_code_async(user):
+    return enqueue('qr.update_user_code', user=user, user_id=user.pk)
+
+
+# Paypack
+
+# A cashin prompts the payer's phone, so a failed request is never retried
+# automatically: the vendor starts a new one
+@task('payments.paypack_request', concurrency=4, max_attempts=1)
+def request_paypack_payment(listing_fee_id, user_id, phone_number=None):
+    from .paypack_payment import initiate_paypack_payment, record_paypack_request
+
+    listing_fee = ListingFee.objects.select_related('listing').get(pk=listing_fee_id)
+    payment_result = initiate_paypack_payment(listing_fee, User.objects.get(pk=user_id), phone_number)
+    if not payment_result.get('success'):
+        raise PermanentJobError(payment_result.get('message', 'Failed to initiate payment'))
+    transaction_ref = record_paypack_request(listing_fee, payment_result)
+    return {
+        'transaction_id': transaction_ref,
+        'status': listing_fee.momo_status,
+        'amount': listing_fee.total_amount,
+    }
+
+
+def initiate_paypack_payment_async(listing_fee, user, phone_number=None):
+    return enqueue('payments.paypack_request', user=user, listing_fee_id=listing_fee.pk,
+                   user_id=user.pk, phone_number=phone_number)
+
+
+@task('payments.paypack_status', concurrency=4, max_attempts=5, backoff=15)
+def refresh_paypack_status(listing_fee_id):
+    from .paypack_payment import PaypackPayment, apply_paypack_status
+
+    listing_fee = ListingFee.objects.select_related('listing').get(pk=listing_fee_id)
+    transaction_id = listing_fee.momo_transaction_id
+    try:
+        paypack = PaypackPayment()
+    except ImportError as error:
+        raise PermanentJobError(str(error))
+    status_result = paypack.check_payment_status(transaction_id)
+    if not status_result.get('success'):
+        raise RuntimeError(status_result.get('message', 'Could not check payment status'))
+    apply_paypack_status(listing_fee, status_result.get('status', 'UNKNOWN'), transaction_id)
+    return {
+        'transaction_id': transaction_id,
+        'status': listing_fee.momo_status,
+        'payment_status': listing_fee.payment_status,
+        'checked_at': listing_fee.momo_status_checked_at or timezone.now(),
+    }
+
+
+def check_paypack_status_async(listing_fee, user):
+    return enqueue('payments.paypack_status', user=user, listing_fee_id=listing_fee.pk)
+
+
+# Trending scores
+
+@task('listings.trending', concurrency=1)
+def refresh_trending_scores(reschedule=True):
+    scored = update_trending_scores()
+    if reschedule:
+        schedule_trending_refresh()
+    return {'scored_listings': scored}
+
+
+def schedule_trending_refresh(delay=None):
+    """Queue the next trending refresh unless one is already waiting."""
+    if Job.objects.filter(task='listings.trending', status='queued').exists():
+        return None
+    if delay is None:
+        delay = getattr(settings, 'TRENDING_REFRESH_INTERVAL', 900)
+    return enqueue('listings.trending', delay=delay)
+
+
+# Similar listings
+
+@task('listings.similar', concurrency=1, max_attempts=3)
+def refresh_similar_listing_index(post_ids, property_types=None):
+    return {'updated_listings': refresh_similar_listings(post_ids, property_types)}
+
+
+def refresh_similar_listings_async(post_ids, property_types=None):
+    """
+    Queue a neighbour refresh for ``post_ids``, merged into the waiting job if there is one.
+
+    ``property_types`` are the groups the listings are or were in; without
+    them the job looks at every group.
+    """
+    with transaction.atomic():
+        job = Job.objects.select_for_update().filter(task='listings.similar', status='queued').first()
+        if job is None:
+            return enqueue('listings.similar', post_ids=sorted(set(post_ids)),
+                           property_types=sorted(set(property_types)) if property_types is not None else None)
+        payload = job.payload
+        payload['post_ids'] = sorted(set(payload['post_ids']) | set(post_ids))
+        if payload.get('property_types') is not None and property_types is not None:
+            payload['property_types'] = sorted(set(payload['property_types']) | set(property_types))
+        else:
+            payload['property_types'] = None
+        job.save(update_fields=['payload'])
+        return job
@@ -1,3 +1,1461 @@
-from django.test import TestCase
+import csv
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from InzuLink.routing import websocket_urlpatterns
+
+from .cache_utils import cache_metrics, namespace_versions, reset_cache_metrics
+from .chat_persistence import MessageWriteBehindQueue, write_message_batch
+from .chat_presence import PresenceStore
+from .facets import listing_facets
+from .jobs import TASKS, PermanentJobError, claim_job, enqueue, purge_finished_jobs, run_pending, task
+from .geo_utils import MAX_COVER_CELLS, cell_ranges, cover_cells, encode_geohash
+from .listing_utils import listing_card_queryset, serialize_listing_card
+from .models import (
+    User, Post, ProductImage, ProductReview, Bookmark, Conversation, Message, ListingFee, Purchase, Job,
+    PlatformDailySales, PostViewHourly, PropertyDailySales, PropertyInquiry, ReportArtifact, VendorDailySales
+)
+from .pagination_utils import (
+    LISTING_SORT_ORDERINGS, InvalidCursor, count_results, keyset_paginate, listing_sort_ordering
+)
+from .reports import build_customer_purchases
+from .sales_rollups import (
+    platform_sales_summary, property_sales_breakdown, rebuild_sales_rollups, vendor_sales_breakdown,
+    vendor_sales_summary
+)
+from .search_backends import RELEVANCE_ORDERING, LikeSearchBackend, get_search_backend, search_posts
+from .similar_listings import rebuild_similar_listings, similar_listings
+from .trending import compute_trending_scores, update_trending_scores
+from .view_tracking import ViewCounterBuffer, current_hour, get_view_buffer, views_since, write_view_batch
+
+
+def create_listing(owner, index, **kwargs):
+    """Create a minimal in-stock listing for tests."""
+    fields = {
+        'title': f'Listing {index}',
+        'description': 'A listing used in tests',
+        'image': 'posts/test.jpg',
+        'user': owner,
+        'price': Decimal('1000.00') + index,
+        'category': 'living_room',
+        'inventory': 1,
+    }
+    fields.update(kwargs)
+    return Post.objects.create(**fields)
+
+
+class ListingCardQueryBudgetTests(TestCase):
+    """Listing cards must render in a constant number of queries."""
+
+    def setUp(self):
+        # Dashboard facets are cached; the post version only moves on commit
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        cls.reviewers = [
+            User.objects.create_user(f'reviewer{i}', password='pass12345') for i in range(3)
+        ]
+
+    def add_listings(self, count, start=0):
+        for i in range(start, start + count):
+            post = create_listing(self.vendor, i)
+            for order in range(2):
+                ProductImage.objects.create(product=post, image='product_gallery/test.jpg', display_order=order)
+            for rating, reviewer in enumerate(self.reviewers, start=3):
+                ProductReview.objects.create(product=post, reviewer=reviewer, rating=rating)
+            post.likes.add(*self.reviewers[:2])
+
+    def test_card_fields_match_source_rows(self):
+        self.add_listings(1)
+        Bookmark.objects.create(user=self.buyer, post=Post.objects.get())
+        post = listing_card_queryset().get()
+
+        card = serialize_listing_card(post, {post.id}, set())
+
+        self.assertEqual(card['total_likes'], post.likes.count())
+        self.assertEqual(card['review_count'], post.reviews.count())
+        self.assertEqual(card['average_rating'], 4.0)
+        self.assertEqual([img['display_order'] for img in card['auxiliary_images']], [0, 1])
+        self.assertTrue(card['is_bookmarked'])
+        self.assertFalse(card['is_liked'])
+        self.assertEqual(card['user']['username'], 'vendor')
+
+    def test_card_queryset_is_two_queries(self):
+        self.add_listings(10)
+        with self.assertNumQueries(2):
+            cards = [serialize_listing_card(post) for post in listing_card_queryset()]
+        self.assertEqual(len(cards), 10)
+
+    def test_dashboard_api_query_count_independent_of_page_size(self):
+        self.client.force_login(self.buyer)
+        url = reverse('dashboard_api')
+
+        self.add_listings(3)
+        with CaptureQueriesContext(connection) as small_page:
+            response = self.client.get(url, {'page_size': 100})
+        self.assertEqual(len(response.json()['data']['posts']), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):  # invalidates the cached facets
+            self.add_listings(30, start=3)
+        with CaptureQueriesContext(connection) as large_page:
+            response = self.client.get(url, {'page_size': 100})
+        self.assertEqual(len(response.json()['data']['posts']), 33)
+
+        self.assertEqual(len(small_page), len(large_page))
+        # session + user, bookmarks, likes, count, page, images, and the
+        # session save (SESSION_SAVE_EVERY_REQUEST) wrapped in a savepoint
+        self.assertLessEqual(len(large_page), 10)
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pagination must visit every listing exactly once in sort order."""
+
+    def setUp(self):
+        # Dashboard facets are cached; the post version only moves on commit
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        # Repeated prices and purchase counts exercise the tie-breakers
+        for i in range(23):
+            create_listing(cls.vendor, i, price=Decimal(1000 + (i % 4) * 100), total_purchases=i % 3)
+
+    def walk(self, ordering, page_size=5):
+        pages, cursor = [], None
+        while True:
+            page = keyset_paginate(Post.objects.all(), ordering, cursor, page_size)
+            pages.append(page)
+            if not page.has_next():
+                return pages
+            cursor = page.next_cursor
+
+    def test_forward_walk_matches_offset_order(self):
+        for sort_by, ordering in LISTING_SORT_ORDERINGS.items():
+            with self.subTest(sort=sort_by):
+                pages = self.walk(ordering)
+                walked = [post.id for page in pages for post in page]
+                expected = list(Post.objects.order_by(*ordering).values_list('id', flat=True))
+                self.assertEqual(walked, expected)
+                self.assertFalse(pages[0].has_previous())
+
+    def test_prev_cursor_returns_previous_page(self):
+        ordering = listing_sort_ordering('price_low')
+        pages = self.walk(ordering)
+        for earlier, later in zip(pages, pages[1:]):
+            back = keyset_paginate(Post.objects.all(), ordering, later.prev_cursor, 5)
+            self.assertEqual([p.id for p in back], [p.id for p in earlier])
+
+    def test_cursor_from_other_sort_is_rejected(self):
+        page = keyset_paginate(Post.objects.all(), listing_sort_ordering('newest'), None, 5)
+        with self.assertRaises(InvalidCursor):
+            keyset_paginate(Post.objects.all(), listing_sort_ordering('price_low'), page.next_cursor, 5)
+
+    def test_count_modes(self):
+        self.assertEqual(count_results(Post.objects.all(), 'exact'), (23, True))
+        self.assertEqual(count_results(Post.objects.all(), 'approx', cap=10), (10, False))
+        self.assertEqual(count_results(Post.objects.all(), 'none'), (None, False))
+
+    def test_dashboard_api_cursor_mode(self):
+        self.client.force_login(self.buyer)
+        url = reverse('dashboard_api')
+        params = {'pagination': 'cursor', 'sort': 'popular', 'page_size': 10, 'count': 'exact'}
+        seen = []
+        while True:
+            data = self.client.get(url, params).json()['data']
+            seen.extend(post['id'] for post in data['posts'])
+            pagination = data['pagination']
+            self.assertEqual(pagination['total_items'], 23)
+            if not pagination['has_next']:
+                break
+            params['cursor'] = pagination['next_cursor']
+        self.assertEqual(len(seen), 23)
+        self.assertEqual(len(set(seen)), 23)
+
+
+class ListingSearchTests(TestCase):
+    """Search goes through the full-text index and can be ordered by relevance."""
+
+    def setUp(self):
+        # Dashboard facets are cached; the post version only moves on commit
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('kigali_homes', password='pass12345', is_vendor_role=True)
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        cls.villa = create_listing(cls.vendor, 1, title='Modern villa in Nyarutarama',
+                                   description='Villa with garden and villa pool')
+        cls.flat = create_listing(cls.vendor, 2, title='City flat', description='Close to a villa district')
+        cls.sofa = create_listing(cls.vendor, 3, title='Leather sofa', description='Three seater')
+
+    def search_ids(self, query):
+        return set(search_posts(Post.objects.all(), query).values_list('id', flat=True))
+
+    def test_uses_indexed_backend(self):
+        self.assertNotEqual(type(get_search_backend()), LikeSearchBackend)
+
+    def test_matches_words_prefixes_and_owner(self):
+        self.assertEqual(self.search_ids('villa'), {self.villa.id, self.flat.id})
+        self.assertEqual(self.search_ids('Nyaru'), {self.villa.id})
+        self.assertEqual(self.search_ids('leather sofa'), {self.sofa.id})
+        self.assertEqual(self.search_ids('kigali_homes'), {self.villa.id, self.flat.id, self.sofa.id})
+        self.assertEqual(self.search_ids('penthouse'), set())
+
+    def test_index_follows_save_and_delete(self):
+        self.sofa.title = 'Leather armchair'
+        self.sofa.save()
+        self.assertEqual(self.search_ids('armchair'), {self.sofa.id})
+        self.assertEqual(self.search_ids('sofa'), set())
+
+        self.sofa.delete()
+        self.assertEqual(self.search_ids('armchair'), set())
+
+    def test_relevance_ordering(self):
+        ranked = search_posts(Post.objects.all(), 'villa').order_by(*RELEVANCE_ORDERING)
+        self.assertEqual([post.id for post in ranked], [self.villa.id, self.flat.id])
+
+    def test_dashboard_api_defaults_to_relevance(self):
+        self.client.force_login(self.buyer)
+        data = self.client.get(reverse('dashboard_api'), {'q': 'villa'}).json()['data']
+        self.assertEqual([post['id'] for post in data['posts']], [self.villa.id, self.flat.id])
+        self.assertEqual(data['filters']['sort_by'], 'relevance')
+
+        data = self.client.get(reverse('dashboard_api'), {'q': 'villa', 'pagination': 'cursor'}).json()['data']
+        self.assertEqual([post['id'] for post in data['posts']], [self.villa.id, self.flat.id])
+
+
+class PostCounterTests(TestCase):
+    """Stored like/review/rating counters follow the rows they summarize."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        cls.buyers = [User.objects.create_user(f'buyer{i}', password='pass12345') for i in range(3)]
+
+    def setUp(self):
+        self.post = create_listing(self.vendor, 1)
+
+    def counters(self, post=None):
+        post = Post.objects.get(pk=(post or self.post).pk)
+        return post.likes_count, post.reviews_count, post.rating_sum, post.rating_avg
+
+    def test_likes_from_either_side(self):
+        self.post.likes.add(*self.buyers)
+        self.post.likes.add(self.buyers[0])  # already liked, no change
+        self.assertEqual(self.post.total_likes(), 3)
+        self.buyers[0].liked_posts.remove(self.post)
+        self.assertEqual(self.counters()[0], 2)
+        self.buyers[1].liked_posts.clear()
+        self.assertEqual(self.counters()[0], 1)
+        self.post.likes.clear()
+        self.assertEqual(self.counters()[0], 0)
+
+    def test_like_toggle_view(self):
+        self.client.force_login(self.buyers[0])
+        url = reverse('like_post', args=[self.post.id])
+        self.assertEqual(self.client.post(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()['total_likes'], 1)
+        self.assertEqual(self.client.post(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()['total_likes'], 0)
+
+    def test_review_create_update_delete(self):
+        first = ProductReview.objects.create(product=self.post, reviewer=self.buyers[0], rating=5)
+        ProductReview.objects.create(product=self.post, reviewer=self.buyers[1], rating=2)
+        self.assertEqual(self.counters(), (0, 2, 7, 3.5))
+
+        first.rating = 3
+        first.save()
+        self.assertEqual(self.counters(), (0, 2, 5, 2.5))
+
+        first.delete()
+        self.assertEqual(self.counters(), (0, 1, 2, 2.0))
+        ProductReview.objects.all().delete()
+        self.assertEqual(self.counters(), (0, 0, 0, 0.0))
+
+    def test_rebuild_command_repairs_drift(self):
+        self.post.likes.add(self.buyers[0])
+        ProductReview.objects.create(product=self.post, reviewer=self.buyers[0], rating=4)
+        Post.objects.update(likes_count=9, reviews_count=9, rating_sum=9, rating_avg=1)
+
+        call_command('rebuild_post_counters', stdout=StringIO())
+        self.assertEqual(self.counters(), (1, 1, 4, 4.0))
+
+    def test_rating_sort(self):
+        low = create_listing(self.vendor, 2)
+        unrated = create_listing(self.vendor, 3)
+        ProductReview.objects.create(product=self.post, reviewer=self.buyers[0], rating=5)
+        ProductReview.objects.create(product=low, reviewer=self.buyers[0], rating=2)
+
+        self.client.force_login(self.buyers[1])
+        data = self.client.get(reverse('dashboard_api'), {'sort': 'rating'}).json()['data']
+        self.assertEqual([p['id'] for p in data['posts']], [self.post.id, low.id, unrated.id])
+
+
+class ListingFacetTests(TestCase):
+    """Facet counts come from one grouped query and ignore each facet's own filter."""
+
+    def setUp(self):
+        # Dashboard facets are cached; the post version only moves on commit
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        create_listing(cls.vendor, 1, title='Garden villa', category='villa', property_type='house',
+                       location_district='Gasabo', price=Decimal('80000000'))
+        create_listing(cls.vendor, 2, title='Hillside villa', category='villa', property_type='house',
+                       location_district='gasabo ', price=Decimal('45000000'), condition='new')
+        create_listing(cls.vendor, 3, title='City apartment', category='apartment', property_type='house',
+                       location_district='Kicukiro', price=Decimal('30000000'))
+        create_listing(cls.vendor, 4, title='Sofa', location_district='Gasabo')
+        create_listing(cls.vendor, 5, title='Sold villa', category='villa', inventory=0)
+
+    def counts(self, facet_list):
+        return {entry['value']: entry['count'] for entry in facet_list if entry['count']}
+
+    def test_one_query_with_disjunctive_counts(self):
+        with self.assertNumQueries(1):
+            facets = listing_facets(Post.objects.filter(inventory__gt=0), {'category': 'villa'})
+
+        self.assertEqual(facets['total'], 2)
+        # Category ignores its own selection; the others are narrowed to villas
+        self.assertEqual(self.counts(facets['category']), {'villa': 2, 'apartment': 1, 'living_room': 1})
+        self.assertEqual(self.counts(facets['property_type']), {'house': 2})
+        self.assertEqual(self.counts(facets['district']), {'Gasabo': 2})
+        self.assertEqual(self.counts(facets['condition']), {'good': 1, 'new': 1})
+        self.assertEqual(self.counts(facets['price']), {'10m_50m': 1, '50m_plus': 1})
+
+    def test_dashboard_and_categories_api(self):
+        self.client.force_login(self.buyer)
+        data = self.client.get(reverse('dashboard_api'), {'q': 'villa', 'district': 'GASABO'}).json()['data']
+        self.assertEqual(len(data['posts']), 2)
+        self.assertEqual(data['pagination']['total_items'], 2)
+        self.assertEqual(self.counts(data['facets']['district']), {'Gasabo': 2})
+        self.assertEqual(self.counts(data['facets']['category']), {'villa': 2})
+
+        facets = self.client.get(reverse('categories_api')).json()['data']['facets']
+        self.assertEqual(facets['total'], 4)
+        self.assertEqual(self.counts(facets['district']), {'Gasabo': 3, 'Kicukiro': 1})
+
+    def test_dashboard_facets_only_on_first_page(self):
+        self.client.force_login(self.buyer)
+        url = reverse('dashboard_api')
+        data = self.client.get(url, {'pagination': 'cursor', 'page_size': 2, 'count': 'none'}).json()['data']
+        self.assertEqual(data['facets']['total'], 4)
+        self.assertIsNone(data['pagination']['total_items'])
+
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url, {'cursor': data['pagination']['next_cursor'],
+                                         'count': 'exact'}).json()['data']
+        self.assertIsNone(data['facets'])
+        self.assertEqual(data['pagination']['total_items'], 4)
+        self.assertFalse([q for q in queries if 'GROUP BY' in q['sql']])
+
+        data = self.client.get(url, {'page': 2, 'page_size': 3}).json()['data']
+        self.assertIsNone(data['facets'])
+        self.assertEqual(data['pagination']['total_items'], 4)
+
+
+class GeoSearchTests(TestCase):
+    """Radius and bounding-box search agree with a brute-force scan."""
+
+    def setUp(self):
+        # Dashboard facets are cached; the post version only moves on commit
+        cache.clear()
+
+    KIGALI = (-1.9441, 30.0619)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        cls.admin = User.objects.create_user('admin', password='pass12345', role='inzulink')
+        cls.near = create_listing(cls.vendor, 1, location_latitude=Decimal('-1.950000'),
+                                  location_longitude=Decimal('30.060000'))
+        cls.nearer = create_listing(cls.vendor, 2, location_latitude=Decimal('-1.944500'),
+                                    location_longitude=Decimal('30.062000'))
+        cls.musanze = create_listing(cls.vendor, 3, location_latitude=Decimal('-1.499700'),
+                                     location_longitude=Decimal('29.634900'))
+        create_listing(cls.vendor, 4)  # no coordinates
+
+    def test_geohash_and_cover(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(self.near.geo_cell, encode_geohash(-1.95, 30.06))
+
+        rng = random.Random(7)
+        points = [(rng.uniform(-2.8, -1.1), rng.uniform(28.9, 30.9)) for _ in range(2000)]
+        for south, west, north, east in [(-2.0, 29.9, -1.9, 30.2), (-2.84, 28.86, -1.05, 30.9),
+                                         (-1.95, 30.05, -1.949, 30.051)]:
+            ranges = cell_ranges(cover_cells(south, west, north, east))
+            self.assertLessEqual(len(ranges), MAX_COVER_CELLS)
+            for lat, lng in points:
+                if south <= lat <= north and west <= lng <= east:
+                    cell = encode_geohash(lat, lng)
+                    self.assertTrue(any(low <= cell <= high for low, high in ranges))
+
+    def test_moving_a_listing_updates_its_cell(self):
+        self.musanze.location_latitude = Decimal('-1.944000')
+        self.musanze.location_longitude = Decimal('30.061000')
+        self.musanze.save(update_fields=['location_latitude', 'location_longitude'])
+        self.musanze.refresh_from_db()
+        self.assertEqual(self.musanze.geo_cell, encode_geohash(-1.944, 30.061))
+
+    def test_dashboard_api_near_and_bbox(self):
+        self.client.force_login(self.admin)
+        url = reverse('dashboard_api')
+        data = self.client.get(url, {'near': '%s,%s' % self.KIGALI, 'radius_km': 5}).json()['data']
+        self.assertEqual([post['id'] for post in data['posts']], [self.nearer.id, self.near.id])
+        self.assertEqual(data['filters']['sort_by'], 'distance')
+        self.assertAlmostEqual(data['posts'][1]['distance_km'], 0.72, places=1)
+        self.assertEqual(data['facets']['total'], 2)
+
+        data = self.client.get(url, {'near': '%s,%s' % self.KIGALI, 'radius_km': 100,
+                                     'pagination': 'cursor', 'page_size': 2}).json()['data']
+        self.assertEqual([post['id'] for post in data['posts']], [self.nearer.id, self.near.id])
+        data = self.client.get(url, {'near': '%s,%s' % self.KIGALI, 'radius_km': 100,
+                                     'cursor': data['pagination']['next_cursor']}).json()['data']
+        self.assertEqual([post['id'] for post in data['posts']], [self.musanze.id])
+
+        data = self.client.get(url, {'bbox': '29.5,-1.6,29.7,-1.4'}).json()['data']
+        self.assertEqual([post['id'] for post in data['posts']], [self.musanze.id])
+
+        response = self.client.get(url, {'near': 'kigali'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rest_api_near(self):
+        self.client.force_login(self.admin)
+        url = reverse('post-list')
+        results = self.client.get(url, {'near': '%s,%s' % self.KIGALI}).json()['results']
+        self.assertEqual([post['id'] for post in results], [self.nearer.id, self.near.id])
+        self.assertIsNotNone(results[0]['distance_km'])
+
+        self.assertEqual(self.client.get(url, {'bbox': '30,-1,29,-2'}).status_code, 400)
+
+
+class SalesRollupTests(TestCase):
+    """Daily rollups follow purchases and fees and match a full rebuild."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        cls.admin = User.objects.create_user('admin', password='pass12345', role='inzulink')
+        cls.villa = create_listing(cls.vendor, 1, property_type='house', category='villa')
+        cls.sofa = create_listing(cls.vendor, 2, inventory=5)
+
+    def rollups(self):
+        return (
+            sorted(VendorDailySales.objects.values_list(
+                'vendor_id', 'day', 'sales_count', 'sales_value', 'listing_fees_count', 'listing_fees_value')),
+            sorted(PropertyDailySales.objects.values_list('property_id', 'day', 'sales_count', 'sales_value')),
+            sorted(PlatformDailySales.objects.values_list(
+                'day', 'sales_count', 'sales_value', 'listing_fees_count', 'listing_fees_value')),
+        )
+
+    def test_follows_completion_cancellation_and_fees(self):
+        villa_sale = Purchase.objects.create(buyer=self.buyer, property=self.villa, final_price=Decimal('5000000'))
+        self.assertEqual(vendor_sales_summary(self.vendor)['total_sales'], 0)
+
+        villa_sale.status = 'completed'
+        villa_sale.save()
+        Purchase.objects.create(buyer=self.buyer, property=self.sofa, final_price=Decimal('300000'),
+                                status='completed')
+        fee = ListingFee.objects.create(listing=self.villa, vendor=self.vendor, days_paid=10)
+        fee.payment_status = 'paid'
+        fee.paid_at = timezone.now()
+        fee.save()
+
+        summary = vendor_sales_summary(self.vendor)
+        self.assertEqual(summary['total_sales'], 2)
+        self.assertEqual(summary['monthly_total_revenue'], Decimal('5300000'))
+        self.assertEqual(summary['listing_fees'], Decimal('1000'))  # 10 days at 100
+        self.assertEqual([row['property__title'] for row in property_sales_breakdown(self.vendor)],
+                         ['Listing 1', 'Listing 2'])
+        self.assertEqual(platform_sales_summary()['fees_paid'], 1)
+
+        incremental = self.rollups()
+        rebuild_sales_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+        villa_sale.status = 'cancelled'
+        villa_sale.save()
+        fee.delete()
+        summary = vendor_sales_summary(self.vendor)
+        self.assertEqual((summary['total_sales'], summary['total_revenue']), (1, Decimal('300000')))
+        self.assertEqual(summary['listing_fees'], 0)
+        self.assertEqual(vendor_sales_breakdown()[0]['total_transactions'], 1)
+
+    def test_statistics_views_read_rollups(self):
+        Purchase.objects.create(buyer=self.buyer, property=self.sofa, final_price=Decimal('300000'),
+                                status='completed')
+        self.client.force_login(self.vendor)
+        with self.settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }):
+            response = self.client.get(reverse('sales_statistics'))
+        self.assertEqual(response.context['total_sales'], 1)
+        self.assertEqual(response.context['monthly_revenue'], Decimal('300000'))
+
+        self.client.force_login(self.admin)
+        data = self.client.get(reverse('api_vendor_statistics_modal', args=[self.vendor.id])).json()
+        self.assertEqual(data['statistics']['total_revenue'], 300000.0)
+        self.assertEqual(data['product_stats'][0]['property__title'], 'Listing 2')
+
+
+class StreamingExportTests(TestCase):
+    """Transaction exports stream CSV in chunks and honour the date range."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        cls.admin = User.objects.create_user('admin', password='pass12345', role='inzulink')
+        listing = create_listing(cls.vendor, 1, inventory=10)
+        for day in (1, 15, 28):
+            purchase = Purchase.objects.create(buyer=cls.buyer, property=listing, final_price=Decimal('1000'),
+                                               status='completed')
+            moment = timezone.make_aware(datetime(2025, 3, day, 12))
+            Purchase.objects.filter(pk=purchase.pk).update(created_at=moment - timedelta(days=1), completed_at=moment)
+
+    def export(self, user, **params):
+        self.client.force_login(user)
+        response = self.client.get(reverse('sales_statistics'), params)
+        return response, list(csv.reader(
+            line.decode() for line in b''.join(response.streaming_content).splitlines()))
+
+    def test_platform_and_customer_exports_stream(self):
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            response, rows = self.export(self.admin, export='transactions')
+        self.assertTrue(response.streaming)
+        self.assertEqual(rows[0], ['Order ID', 'Buyer', 'Property', 'Seller', 'Date', 'Price', 'Status'])
+        self.assertEqual([row[4][:10] for row in rows[1:]], ['2025-03-01', '2025-03-15', '2025-03-28'])
+
+        # The customer export keeps its original columns, dated by purchase time
+        _, rows = self.export(self.buyer, export='csv', **{'from': '2025-03-10', 'to': '2025-03-28'})
+        self.assertEqual(rows[0], ['Product', 'Seller', 'Date', 'Price', 'Status'])
+        self.assertEqual([row[2][:10] for row in rows[1:]], ['2025-03-14', '2025-03-27'])
+        self.assertEqual(rows[1][4], 'Completed')
+
+    def test_invalid_range_redirects(self):
+        self.client.force_login(self.vendor)
+        response = self.client.get(reverse('sales_statistics'), {'export': 'transactions', 'from': '2025-13-01'})
+        self.assertRedirects(response, reverse('sales_statistics'), fetch_redirect_response=False)
+
+
+class JobQueueTests(TestCase):
+    """Background jobs retry with backoff, respect concurrency limits and report their status."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.calls = []
+
+        @task('test.flaky', concurrency=1, max_attempts=2, backoff=60)
+        def flaky(fail_times):
+            cls.calls.append(fail_times)
+            if len(cls.calls) <= fail_times:
+                raise RuntimeError('temporary failure')
+            return {'calls': len(cls.calls)}
+
+        @task('test.doomed')
+        def doomed():
+            raise PermanentJobError('never works')
+
+    @classmethod
+    def tearDownClass(cls):
+        TASKS.pop('test.flaky')
+        TASKS.pop('test.doomed')
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True,
+                                              email='vendor@example.com')
+        cls.other = User.objects.create_user('other', password='pass12345')
+
+    def setUp(self):
+        self.calls.clear()
+
+    def test_retries_with_backoff_then_fails(self):
+        job = enqueue('test.flaky', user=self.vendor, fail_times=5)
+        with self.assertLogs('authentication.jobs', 'WARNING'):
+            self.assertEqual(run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=50))
+        self.assertEqual(run_pending(), 0)  # Not due yet
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('authentication.jobs', 'ERROR'):
+            run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIn('temporary failure', job.error)
+
+        doomed = enqueue('test.doomed')
+        with self.assertLogs('authentication.jobs', 'ERROR'):
+            run_pending()
+        doomed.refresh_from_db()
+        self.assertEqual((doomed.status, doomed.attempts), ('failed', 1))
+
+    def test_concurrency_limit_and_status_endpoint(self):
+        first = enqueue('test.flaky', user=self.vendor, fail_times=0)
+        second = enqueue('test.flaky', user=self.vendor, fail_times=0)
+        self.assertEqual(claim_job('worker-a').pk, first.pk)
+        self.assertIsNone(claim_job('worker-b'))  # test.flaky allows one at a time
+
+        Job.objects.filter(pk=first.pk).update(status='succeeded')
+        run_pending()
+        second.refresh_from_db()
+        self.assertEqual(second.result, {'calls': 1})
+
+        self.client.force_login(self.vendor)
+        data = self.client.get(reverse('job_status', args=[second.pk])).json()['data']
+        self.assertEqual((data['status'], data['result']), ('succeeded', {'calls': 1}))
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(reverse('job_status', args=[second.pk])).status_code, 404)
+
+    def test_finished_jobs_are_purged_after_retention(self):
+        now = timezone.now()
+        old = enqueue('test.doomed')
+        recent = enqueue('test.doomed')
+        waiting = enqueue('test.doomed')
+        Job.objects.filter(pk=old.pk).update(status='failed', finished_at=now - timedelta(days=8))
+        Job.objects.filter(pk=recent.pk).update(status='succeeded', finished_at=now - timedelta(days=1))
+
+        with self.settings(JOBS_KEEP_FINISHED=7 * 24 * 3600):
+            self.assertEqual(purge_finished_jobs(now), 1)
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)), {recent.pk, waiting.pk})
+
+    def test_async_otp_email(self):
+        self.client.force_login(self.vendor)
+        url = reverse('otp-send-otp')
+        # Without a worker the email is sent during the request
+        response = self.client.post(url, {'user_id': self.vendor.id, 'async': True}, content_type='application/json')
+        self.assertEqual((response.status_code, len(mail.outbox)), (200, 1))
+        mail.outbox.clear()
+
+        with self.settings(OTP_SEND_ASYNC=True):
+            response = self.client.post(url, {'user_id': self.vendor.id, 'async': True},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(mail.outbox), 0)
+        run_pending()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(Job.objects.get(pk=response.json()['job_id']).status, 'succeeded')
+
+
+class ReportArtifactTests(TestCase):
+    """PDF reports are stored once per data version and served from storage."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        cls.admin = User.objects.create_user('admin', password='pass12345', role='inzulink')
+        cls.listing = create_listing(cls.vendor, 1, inventory=10)
+        Purchase.objects.create(buyer=cls.buyer, property=cls.listing, final_price=Decimal('1000'),
+                                status='completed')
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = self.settings(MEDIA_ROOT=media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_identical_requests_reuse_the_artifact_until_data_changes(self):
+        self.client.force_login(self.buyer)
+        url = reverse('purchase_history')
+        response = self.client.get(url, {'export': 'pdf'})
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        first = ReportArtifact.objects.get()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'export': 'pdf'})
+        self.assertEqual(ReportArtifact.objects.get().completed_at, first.completed_at)
+        self.assertFalse(any('INSERT' in query['sql'] for query in queries.captured_queries))
+
+        Purchase.objects.create(buyer=self.buyer, property=self.listing, final_price=Decimal('2000'))
+        self.client.get(url, {'export': 'pdf'})
+        second = ReportArtifact.objects.get()  # The stale version was deleted
+        self.assertNotEqual(second.key, first.key)
+        self.assertEqual(second.row_count, 2)
+        self.assertFalse(default_storage.exists(first.file))
+
+        self.client.get(url, {'export': 'pdf', 'from': '2000-01-01', 'to': '2000-01-31'})
+        self.assertEqual(ReportArtifact.objects.filter(date_from='2000-01-01').get().row_count, 0)
+
+    def test_customer_report_is_dated_by_purchase_time(self):
+        created = timezone.make_aware(datetime(2025, 3, 14, 12))
+        Purchase.objects.filter(buyer=self.buyer).update(created_at=created, completed_at=created + timedelta(days=30))
+
+        title, headers, rows, summary = build_customer_purchases(self.buyer, (date(2025, 3, 1), date(2025, 3, 31)))
+        self.assertEqual(headers, ['Product', 'Seller', 'Date', 'Price', 'Status'])
+        self.assertEqual([row[2][:10] for row in rows], ['2025-03-14'])
+        self.assertEqual(rows[0][4], 'Completed')
+        self.assertEqual(summary['Monthly Spent'], 'RWF 0.0')
+
+    def test_async_build_poll_and_download(self):
+        self.client.force_login(self.vendor)
+        response = self.client.get(reverse('sales_statistics'), {'export': 'pdf', 'async': '1'})
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        self.assertEqual(self.client.get(status_url).json()['data']['status'], 'pending')
+
+        run_pending()
+        data = self.client.get(status_url).json()['data']
+        self.assertEqual((data['status'], data['rows']), ('ready', 1))
+        download = self.client.get(data['download_url'])
+        self.assertTrue(b''.join(download.streaming_content).startswith(b'%PDF'))
+        # Asking again returns the stored report at once
+        response = self.client.get(reverse('sales_statistics'), {'export': 'pdf', 'async': '1'})
+        self.assertEqual((response.status_code, response.json()['download_url']), (200, data['download_url']))
+
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.get(data['download_url']).status_code, 404)
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(data['download_url']).status_code, 200)
+
+
+class CacheLayerTests(TestCase):
+    """Cached views are served from versioned keys that model saves invalidate."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        cls.post = create_listing(cls.vendor, 1, category='villa')
+
+    def setUp(self):
+        cache.clear()
+        reset_cache_metrics()
+        self.url = reverse('categories_api')
+
+    def villa_count(self):
+        categories = self.client.get(self.url).json()['data']['categories']
+        return next(c['product_count'] for c in categories if c['value'] == 'villa')
+
+    def test_hits_until_a_listing_changes(self):
+        self.assertEqual(self.villa_count(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.villa_count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_listing(self.vendor, 2, category='villa')
+        self.assertEqual(self.villa_count(), 2)
+        self.assertEqual(cache_metrics()['categories'], {'hits': 1, 'misses': 2, 'hit_rate': 0.3333})
+
+    def test_anonymous_home_page_is_cached_until_listings_change(self):
+        home = reverse('home')
+        with self.settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }):
+            self.assertEqual(self.client.get(home)['X-Cache'], 'MISS')
+            with self.assertNumQueries(0):
+                response = self.client.get(home)
+            self.assertEqual(response['X-Cache'], 'HIT')
+            self.assertIn('Cookie', response['Vary'])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                create_listing(self.vendor, 2, title='Lakeside villa')
+            response = self.client.get(home)
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertContains(response, 'Lakeside villa')
+
+            # Logged-in visitors get their own render, from the cached snapshot
+            self.client.force_login(self.vendor)
+            response = self.client.get(home)
+            self.assertFalse(response.has_header('X-Cache'))
+            self.assertEqual(response.context['total_products'], 2)
+
+    def test_view_count_saves_keep_the_cache(self):
+        before = namespace_versions(['post'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.view_count += 1
+            self.post.save(update_fields=['view_count'])
+        self.assertEqual(namespace_versions(['post']), before)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.likes.add(self.vendor)
+        self.assertNotEqual(namespace_versions(['post']), before)
+
+
+class ViewTrackingTests(TestCase):
+    """Listing views are deduplicated, buffered and written in batches."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        cls.listing = create_listing(cls.vendor, 1)
+        cls.other = create_listing(cls.vendor, 2)
+
+    def setUp(self):
+        cache.clear()
+        get_view_buffer().flush()
+
+    def test_detail_views_are_deduplicated_per_viewer(self):
+        url = reverse('post_detail', args=[self.listing.id])
+        with self.settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }):
+            self.client.get(url)
+            self.client.get(url)  # same anonymous visitor
+            self.client.force_login(self.buyer)
+            self.client.get(url)
+            self.client.get(url)
+            self.client.force_login(self.vendor)
+            self.client.get(url)  # the owner
+        self.assertEqual(len(get_view_buffer()), 2)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.view_count, 0)
+
+        self.assertEqual(get_view_buffer().flush(), 2)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.view_count, 2)
+        self.assertEqual(PostViewHourly.objects.get(post=self.listing).views, 2)
+
+    def test_batch_is_a_fixed_number_of_statements(self):
+        now = current_hour()
+        earlier = now - timedelta(hours=1)
+        write_view_batch({(self.listing.id, earlier): 1})
+        deleted = create_listing(self.vendor, 3)
+        counts = {(self.listing.id, earlier): 2, (self.listing.id, now): 3, (self.other.id, now): 4, (deleted.id, now): 5}
+        deleted.delete()
+        # SELECT listings, UPDATE listings, INSERT buckets, SELECT buckets, UPDATE buckets, inside a savepoint
+        with self.assertNumQueries(7):
+            write_view_batch(counts)
+
+        self.assertEqual(Post.objects.get(pk=self.listing.id).view_count, 6)
+        self.assertEqual(Post.objects.get(pk=self.other.id).view_count, 4)
+        self.assertEqual(PostViewHourly.objects.get(post=self.listing, hour=earlier).views, 3)
+        self.assertEqual(views_since(now), {self.listing.id: 3, self.other.id: 4})
+
+    def test_buffer_flushes_at_threshold(self):
+        buffer = ViewCounterBuffer(flush_threshold=3, flush_interval=3600)
+        buffer.add(self.listing.id)
+        buffer.add(self.other.id)
+        self.assertEqual(Post.objects.filter(view_count__gt=0).count(), 0)
+        buffer.add(self.listing.id)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(
+            dict(Post.objects.filter(pk__in=[self.listing.id, self.other.id]).values_list('pk', 'view_count')),
+            {self.listing.id: 2, self.other.id: 1},
+        )
+
+
+class ViewBufferTimerTests(TransactionTestCase):
+    """Buffered views are written after the flush interval even without further views."""
+
+    def test_timer_flushes_an_idle_buffer(self):
+        vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        listing = create_listing(vendor, 1)
+        buffer = ViewCounterBuffer(flush_threshold=100, flush_interval=0.05)
+        buffer.add(listing.id)
+        buffer.add(listing.id)
+
+        def views():
+            return Post.objects.values_list('view_count', flat=True).get(pk=listing.pk)
+
+        deadline = time.monotonic() + 5
+        while views() != 2 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(views(), 2)
+        self.assertEqual(len(buffer), 0)
+
+
+class TrendingTests(TestCase):
+    """Trending scores favour recent engagement over lifetime totals."""
+
+    def setUp(self):
+        # Dashboard facets are cached; the post version only moves on commit
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+        cls.buyers = [User.objects.create_user(f'buyer{i}', password='pass12345') for i in range(3)]
+        cls.old_favourite = create_listing(cls.vendor, 1, total_purchases=50)
+        cls.rising = create_listing(cls.vendor, 2)
+        cls.quiet = create_listing(cls.vendor, 3)
+
+    def test_recent_engagement_outranks_older_engagement(self):
+        now = current_hour()
+        write_view_batch({(self.old_favourite.id, now - timedelta(days=6)): 40, (self.rising.id, now): 10})
+        self.rising.likes.add(self.buyers[0])
+        Bookmark.objects.create(user=self.buyers[1], post=self.rising)
+        PropertyInquiry.objects.create(buyer=self.buyers[2], property=self.rising, message='Still available?')
+        Purchase.objects.create(buyer=self.buyers[0], property=self.quiet, final_price=Decimal('1000'),
+                                status='cancelled')
+
+        self.assertEqual(PostViewHourly.objects.get(post=self.rising, hour=now).likes, 1)
+        scores = compute_trending_scores()
+        self.assertAlmostEqual(scores[self.rising.id], 10 + 3 + 4 + 8, delta=1)
+        self.assertAlmostEqual(scores[self.old_favourite.id], 40 / 8, delta=0.5)  # three half-lives
+        self.assertNotIn(self.quiet.id, scores)  # cancelled purchases don't count
+        # Outside the window nothing counts
+        self.assertEqual(compute_trending_scores(timezone.now() + timedelta(days=30)), {})
+
+        self.assertEqual(update_trending_scores(), 2)
+        self.client.force_login(self.buyers[0])
+        data = self.client.get(reverse('dashboard_api'), {'sort': 'trending'}).json()['data']
+        self.assertEqual([p['id'] for p in data['posts']], [self.rising.id, self.old_favourite.id, self.quiet.id])
+        data = self.client.get(reverse('dashboard_api'), {'sort': 'popular'}).json()['data']
+        self.assertEqual(data['posts'][0]['id'], self.old_favourite.id)
+
+        # Engagement leaving the window resets the score
+        update_trending_scores(timezone.now() + timedelta(days=30))
+        self.assertFalse(Post.objects.filter(trending_score__gt=0).exists())
+
+    def test_cleared_likes_are_recorded_as_unlikes(self):
+        now = current_hour()
+        self.rising.likes.add(*self.buyers)
+        self.buyers[0].liked_posts.add(self.quiet)
+        self.buyers[0].liked_posts.clear()
+        self.rising.likes.clear()
+        likes = dict(PostViewHourly.objects.filter(hour=now).values_list('post_id', 'likes'))
+        self.assertEqual(likes, {self.rising.id: 0, self.quiet.id: 0})
+
+    def test_home_features_trending_listings(self):
+        Post.objects.filter(pk=self.old_favourite.pk).update(trending_score=5)
+        with self.settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }):
+            newest = self.client.get(reverse('home')).context['featured_products']
+            trending = self.client.get(reverse('home'), {'sort': 'trending'}).context['featured_products']
+        self.assertEqual(newest[0], self.quiet)
+        self.assertEqual(trending[0], self.old_favourite)
+
+    def test_refresh_job_requeues_itself_once(self):
+        call_command('update_trending_scores', '--schedule', stdout=StringIO())
+        call_command('update_trending_scores', '--schedule', stdout=StringIO())
+        job = Job.objects.get(task='listings.trending')
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+
+        run_pending(tasks=['listings.trending'])
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(Job.objects.filter(task='listings.trending', status='queued').count(), 1)
+
+
+class SimilarListingsTests(TestCase):
+    """The neighbour index is rebuilt in full or refreshed incrementally to the same result."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='pass12345', is_vendor_role=True)
+
+    def house(self, index, price, district='Gasabo', bedrooms=3, **kwargs):
+        return create_listing(self.vendor, index, property_type='house', category='villa', price=Decimal(price),
+                              location_district=district, bedrooms=bedrooms, size_sqm=Decimal('200'), **kwargs)
+
+    def similar_ids(self, post):
+        return Post.objects.values_list('similar_ids', flat=True).get(pk=post.pk)
+
+    def test_neighbours_match_on_features_and_skip_unavailable_listings(self):
+        home = self.house(1, '100000000')
+        twin = self.house(2, '105000000')
+        pricier = self.house(3, '400000000')
+        elsewhere = self.house(4, '100000000', district='Musanze')
+        sold_out = self.house(5, '100000000', inventory=0)
+        create_listing(self.vendor, 6, property_type='furniture', price=Decimal('100000000'))
+        with self.settings(SIMILAR_LISTINGS_COUNT=3):
+            rebuild_similar_listings()
+
+        self.assertEqual(self.similar_ids(home), [twin.id, elsewhere.id, pricier.id])
+        # A sold-out listing still gets alternatives, but is nobody's alternative
+        self.assertEqual(self.similar_ids(sold_out)[0], home.id)
+        self.assertFalse(any(sold_out.id in ids for ids in Post.objects.values_list('similar_ids', flat=True)))
+
+        home.refresh_from_db()
+        self.assertEqual([p.id for p in similar_listings(home)], [twin.id, elsewhere.id, pricier.id])
+        with self.assertNumQueries(0):
+            similar_listings(home)
+
+    def test_incremental_refresh_matches_full_rebuild(self):
+        rng = random.Random(7)
+        districts = ['Gasabo', 'Kicukiro', 'Nyarugenge']
+        listings = [
+            self.house(i, rng.randrange(10_000_000, 500_000_000), district=rng.choice(districts),
+                       bedrooms=rng.randint(1, 6))
+            for i in range(30)
+        ]
+        rebuild_similar_listings()
+        deleted_id = listings[2].id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            added = self.house(100, 120_000_000, bedrooms=4)
+            listings[0].price = Decimal(130_000_000)
+            listings[0].save()
+            listings[1].inventory = 0
+            listings[1].save(update_fields=['inventory'])
+            listings[2].delete()
+            listings[3].save(update_fields=['description'])  # not a similarity field
+            listings[4].description = 'Freshly painted'
+            listings[4].save()  # a full save that leaves the similarity fields alone
+            create_listing(self.vendor, 101, property_type='furniture')
+        # One job for every change, limited to the groups they touched
+        job = Job.objects.get(task='listings.similar')
+        self.assertEqual(job.payload['post_ids'], sorted([added.id, listings[0].id, listings[1].id, deleted_id,
+                                                          Post.objects.get(title='Listing 101').id]))
+        self.assertEqual(job.payload['property_types'], ['furniture', 'house'])
+        run_pending(tasks=['listings.similar'])
+        incremental = dict(Post.objects.values_list('pk', 'similar_ids'))
+        self.assertEqual(len(incremental[added.id]), 6)
+
+        rebuild_similar_listings()
+        self.assertEqual(dict(Post.objects.values_list('pk', 'similar_ids')), incremental)
+        self.assertFalse(any(deleted_id in ids or listings[1].id in ids for ids in incremental.values()))
+
+    def test_detail_page_shows_similar_listings(self):
+        home = self.house(1, '100000000')
+        twin = self.house(2, '105000000')
+        rebuild_similar_listings()
+        self.addCleanup(get_view_buffer().flush)  # the page view is buffered
+        with self.settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }):
+            response = self.client.get(reverse('post_detail', args=[home.id]))
+        self.assertEqual(response.context['similar_listings'], [twin])
+        self.assertContains(response, 'Similar properties')
+
+
+class ChatPresenceStoreTests(SimpleTestCase):
+    """Presence counts sockets with atomic cache operations."""
+
+    def setUp(self):
+        cache.clear()
+        self.store = PresenceStore(ttl=60)
+
+    def test_online_until_the_last_socket_leaves(self):
+        self.assertTrue(self.store.join(1, 7))
+        self.assertFalse(self.store.join(1, 7))  # second tab
+        self.assertFalse(self.store.touch(1, 7))
+        self.assertFalse(self.store.leave(1, 7))
+        self.assertTrue(self.store.snapshot(1, [7])[7]['online'])
+
+        self.assertTrue(self.store.leave(1, 7))
+        state = self.store.snapshot(1, [7, 8])
+        self.assertFalse(state[7]['online'])
+        self.assertIsNotNone(state[7]['last_seen'])
+        self.assertEqual(state[8], {'online': False, 'last_seen': None})
+
+    def test_touch_after_expiry_reports_coming_back_online(self):
+        self.store.join(1, 7)
+        online_key, sockets_key, _ = self.store.keys(1, 7)
+        cache.delete_many([online_key, sockets_key])  # aged out
+
+        self.assertTrue(self.store.touch(1, 7))
+        self.assertTrue(self.store.snapshot(1, [7])[7]['online'])
+        self.assertTrue(self.store.leave(1, 7))
+
+
+class ChatUnreadCounterTests(TestCase):
+    """Unread badges read stored counters instead of counting messages."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pass12345', is_vendor_role=True)
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        cls.conversations = [
+            Conversation.objects.create(buyer=cls.buyer, seller=cls.seller, property=create_listing(cls.seller, i))
+            for i in range(3)
+        ]
+
+    def send(self, sender, conversation, text='Hello'):
+        self.client.force_login(sender)
+        url = reverse('api_send_message', args=[conversation.id])
+        return self.client.post(url, {'message': text}, content_type='application/json')
+
+    def test_send_increments_recipient_only(self):
+        conversation = self.conversations[0]
+        self.send(self.buyer, conversation)
+        self.send(self.buyer, conversation)
+        self.send(self.seller, conversation)
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.get_unread_count(self.seller), 2)
+        self.assertEqual(conversation.get_unread_count(self.buyer), 1)
+        self.assertIsNotNone(conversation.last_message_at)
+
+    def test_mark_read_resets_counter(self):
+        conversation = self.conversations[0]
+        self.send(self.buyer, conversation)
+        self.client.force_login(self.seller)
+        self.client.post(reverse('api_mark_read', args=[conversation.id]))
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.seller_unread_count, 0)
+        self.assertTrue(conversation.messages.get().is_read)
+
+    def test_unread_badge_is_one_query(self):
+        for conversation in self.conversations[:2]:
+            self.send(self.buyer, conversation)
+        self.send(self.buyer, self.conversations[0])
+
+        self.client.force_login(self.seller)
+        url = reverse('api_unread_count')
+        self.client.get(url)  # warm the session
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url).json()
+        badge_queries = [q for q in queries if 'authentication_conversation' in q['sql']]
+        self.assertEqual(len(badge_queries), 1)
+        self.assertEqual(data['total_unread'], 3)
+        self.assertEqual(data['by_conversation'], {
+            str(self.conversations[0].id): 2, str(self.conversations[1].id): 1
+        })
+
+
+class ChatInboxTests(TestCase):
+    """The inbox is one query per page whatever the number of conversations."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        cls.sellers = [
+            User.objects.create_user(f'seller{i}', password='pass12345', is_vendor_role=True) for i in range(7)
+        ]
+        cls.conversations = []
+        for i, seller in enumerate(cls.sellers):
+            conversation = Conversation.objects.create(buyer=cls.buyer, seller=seller)
+            if i % 2 == 0:
+                for n in range(3):
+                    message = Message.objects.create(conversation=conversation, sender=seller, content=f'msg {n}')
+                    conversation.record_new_message(message)
+            cls.conversations.append(conversation)
+
+    def setUp(self):
+        self.client.force_login(self.buyer)
+
+    def test_last_message_is_denormalized(self):
+        conversation = Conversation.objects.get(pk=self.conversations[0].pk)
+        self.assertEqual(conversation.last_message.content, 'msg 2')
+        self.assertEqual(conversation.last_message_at, conversation.last_message.created_at)
+
+    def test_conversation_pages_cover_inbox_in_constant_queries(self):
+        url = reverse('api_conversations')
+        self.client.get(url)  # warm the session
+        seen, params, page_queries = [], {'limit': 3}, []
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(url, params).json()
+            page_queries.append(len([q for q in queries if 'authentication_conversation' in q['sql']]))
+            seen.extend(conv['id'] for conv in data['conversations'])
+            if not data['has_more']:
+                break
+            params['cursor'] = data['next_cursor']
+
+        self.assertEqual(sorted(seen), sorted(c.id for c in self.conversations))
+        self.assertEqual(set(page_queries), {1})
+        # Conversations with messages come first, each showing its last message
+        first = self.client.get(url).json()['conversations'][0]
+        self.assertEqual(first['last_message']['content'], 'msg 2')
+        self.assertEqual(first['unread_count'], 3)
+
+    def test_chat_list_renders(self):
+        with self.settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }):
+            response = self.client.get(reverse('chat_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_unread'], 12)
+        self.assertEqual(len(response.context['conversations']), 7)
+
+
+class ChatHistoryApiTests(TestCase):
+    """Message history pages by id cursor in both directions and revalidates by ETag."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pass12345', is_vendor_role=True)
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        cls.conversation = Conversation.objects.create(buyer=cls.buyer, seller=cls.seller)
+        cls.ids = [cls.send(cls.seller if n % 2 else cls.buyer, f'msg {n}') for n in range(7)]
+
+    @classmethod
+    def send(cls, sender, text):
+        message = Message.objects.create(conversation=cls.conversation, sender=sender, content=text)
+        cls.conversation.record_new_message(message)
+        return message.id
+
+    def setUp(self):
+        self.client.force_login(self.buyer)
+        self.url = reverse('api_get_messages', args=[self.conversation.id])
+
+    def test_before_walks_back_and_after_walks_forward(self):
+        seen, params = [], {'limit': 3}
+        while True:
+            data = self.client.get(self.url, params).json()
+            seen[:0] = [m['id'] for m in data['messages']]
+            if not data['has_more']:
+                break
+            params['before'] = data['oldest_id']
+        self.assertEqual(seen, self.ids)
+
+        data = self.client.get(self.url, {'after': self.ids[2], 'limit': 2}).json()
+        self.assertEqual([m['id'] for m in data['messages']], self.ids[3:5])
+        self.assertTrue(data['has_more'])
+
+    def test_limit_is_capped_and_compact_drops_sender_details(self):
+        data = self.client.get(self.url, {'limit': 10_000, 'fields': 'compact'}).json()
+        self.assertEqual(len(data['messages']), 7)
+        self.assertEqual(set(data['messages'][0]), {'id', 'content', 'sender_id', 'is_read', 'timestamp'})
+        self.assertEqual(self.client.get(self.url, {'before': 'x'}).status_code, 400)
+
+    def test_unchanged_history_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.send(self.seller, 'new')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_covers_page_and_deletions(self):
+        etag = self.client.get(self.url, {'limit': 3})['ETag']
+        response = self.client.get(self.url, {'limit': 3, 'before': self.ids[4]}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(self.url, {'limit': '3'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Message.objects.get(pk=self.ids[-1]).soft_delete()
+        response = self.client.get(self.url, {'limit': 3}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(self.ids[-1], [m['id'] for m in response.json()['messages']])
+
+
+class ChatWriteBehindBatchTests(TestCase):
+    """Batched message writes update conversations exactly like single sends."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password='pass12345', is_vendor_role=True)
+        cls.buyer = User.objects.create_user('buyer', password='pass12345')
+        cls.conversation = Conversation.objects.create(buyer=cls.buyer, seller=cls.seller)
+
+    def pending(self, sender, client_id):
+        return {
+            'conversation_id': self.conversation.id,
+            'sender_id': sender.id,
+            'content': f'from {sender.username}',
+            'created_at': timezone.now(),
+            'client_id': client_id,
+        }
+
+    def test_batch_updates_counters_and_last_message(self):
+        batch = [self.pending(self.buyer, 'b1'), self.pending(self.buyer, 'b2'), self.pending(self.seller, 's1')]
+        with self.assertNumQueries(6):  # one INSERT and one UPDATE inside two savepoints
+            saved = write_message_batch(batch)
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.seller_unread_count, 2)
+        self.assertEqual(self.conversation.buyer_unread_count, 1)
+        self.assertEqual(self.conversation.last_message_id, saved[(self.seller.id, 's1')])
+        self.assertEqual(self.conversation.last_message_at, batch[-1]['created_at'])
+
+    def test_retried_client_id_is_stored_once(self):
+        write_message_batch([self.pending(self.buyer, 'b1')])
+        saved = write_message_batch([self.pending(self.buyer, 'b1'), self.pending(self.buyer, 'b2')])
+
+        first_id = self.conversation.messages.get(client_id='b1').id
+        # The retry is acknowledged with the id it was first stored under
+        self.assertEqual(saved, {(self.buyer.id, 'b1'): first_id, (self.buyer.id, 'b2'): saved[(self.buyer.id, 'b2')]})
+        self.assertEqual(self.conversation.messages.count(), 2)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.seller_unread_count, 2)
+
+
+class ChatWriteBehindQueueTests(TransactionTestCase):
+    """A message that cannot be written does not hold back the rest of the queue."""
+
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', password='pass12345', is_vendor_role=True)
+        self.buyer = User.objects.create_user('buyer', password='pass12345')
+        self.conversation = Conversation.objects.create(buyer=self.buyer, seller=self.seller)
+
+    def pending(self, conversation_id, client_id):
+        return {
+            'conversation_id': conversation_id,
+            'sender_id': self.buyer.id,
+            'content': 'hello',
+            'created_at': timezone.now(),
+            'client_id': client_id,
+        }
+
+    async def test_failing_message_is_retried_then_dropped(self):
+        queue = MessageWriteBehindQueue(batch_size=100, flush_interval=3600, max_attempts=2)
+        # The conversation was deleted, so this row fails its foreign key check
+        await queue.enqueue(self.pending(self.conversation.id + 1, 'gone'))
+        await queue.enqueue(self.pending(self.conversation.id, 'ok1'))
+
+        with self.assertLogs('authentication.chat_persistence', 'ERROR'):
+            saved = await queue.flush()
+        self.assertEqual(list(saved), [(self.buyer.id, 'ok1')])
+        self.assertEqual(len(queue), 1)
+
+        await queue.enqueue(self.pending(self.conversation.id, 'ok2'))
+        with self.assertLogs('authentication.chat_persistence', 'ERROR') as logs:
+            saved = await queue.flush()
+        self.assertEqual(list(saved), [(self.buyer.id, 'ok2')])
+        self.assertEqual(len(queue), 0)
+        self.assertIn('Dropping chat message gone', logs.output[-1])
+        self.assertEqual(await Message.objects.filter(conversation=self.conversation).acount(), 2)
+
+
+class ChatConsumerAccessTests(TransactionTestCase):
+    """The consumer caches participants at connect and reacts to status control messages."""
+
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', password='pass12345', is_vendor_role=True)
+        self.buyer = User.objects.create_user('buyer', password='pass12345')
+        self.outsider = User.objects.create_user('outsider', password='pass12345')
+        self.conversation = Conversation.objects.create(buyer=self.buyer, seller=self.seller)
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.conversation.id}/')
+        communicator.scope['user'] = user
+        return communicator
+
+    async def connect(self, user):
+        communicator = self.communicator(user)
+        await communicator.connect()
+        self.assertEqual((await communicator.receive_json_from())['type'], 'presence_state')
+        return communicator
+
+    async def test_outsider_is_rejected(self):
+        connected, _ = await self.communicator(self.outsider).connect()
+        self.assertFalse(connected)
+
+    async def test_messages_saved_without_refetching_conversation(self):
+        buyer = await self.connect(self.buyer)
+        await buyer.send_json_to({'type': 'chat_message', 'message': 'Hi', 'client_id': 'c1'})
+        event = await buyer.receive_json_from()
+        self.assertEqual(event['message']['client_id'], 'c1')
+        await buyer.disconnect()
+
+        conversation = await Conversation.objects.aget(pk=self.conversation.pk)
+        self.assertEqual(conversation.seller_unread_count, 1)
+        self.assertEqual(conversation.last_message_id, event['message']['id'])
+
+    async def test_archive_closes_open_sockets(self):
+        seller = await self.connect(self.seller)
+
+        self.conversation.status = 'archived'
+        await database_sync_to_async(self.conversation.save)(update_fields=['status'])
+
+        event = await seller.receive_json_from()
+        self.assertEqual(event, {'type': 'conversation_status', 'status': 'archived'})
+        self.assertEqual((await seller.receive_output())['type'], 'websocket.close')
+
+    async def test_read_up_to_is_one_coalesced_receipt(self):
+        buyer = await self.connect(self.buyer)
+        seller = await self.connect(self.seller)
+        await buyer.receive_json_from()  # seller came online
+        ids = []
+        for i in range(3):
+            await buyer.send_json_to({'type': 'chat_message', 'message': f'Hi {i}'})
+            ids.append((await buyer.receive_json_from())['message']['id'])
+            await seller.receive_json_from()
+
+        await seller.send_json_to({'type': 'read_up_to', 'message_id': ids[1]})
+        self.assertEqual(
+            await buyer.receive_json_from(),
+            {'type': 'read_up_to', 'message_id': ids[1], 'read_by': self.seller.id},
+        )
+        # A stale receipt is dropped without a broadcast
+        await seller.send_json_to({'type': 'read_up_to', 'message_id': ids[0]})
+        self.assertTrue(await buyer.receive_nothing())
+        await buyer.disconnect()
+        await seller.disconnect()
+
+        conversation = await Conversation.objects.aget(pk=self.conversation.pk)
+        self.assertEqual(conversation.seller_unread_count, 1)
+        self.assertIsNotNone(conversation.seller_last_read)
+        read = [m async for m in Message.objects.filter(is_read=True).values_list('id', flat=True)]
+        self.assertEqual(sorted(read), ids[:2])
+
+    async def test_presence_only_broadcasts_transitions(self):
+        buyer = await self.connect(self.buyer)
+        seller = await self.connect(self.seller)
+        self.assertEqual(
+            await buyer.receive_json_from(),
+            {'type': 'presence', 'user_id': self.seller.id, 'username': 'seller', 'online': True},
+        )
+        # A second tab and its closing are silent
+        second_tab = await self.connect(self.seller)
+        await second_tab.disconnect()
+        self.assertTrue(await buyer.receive_nothing())
+
+        await buyer.send_json_to({'type': 'presence'})
+        state = await buyer.receive_json_from()
+        self.assertTrue(state['users'][str(self.seller.id)]['online'])
+
+        await seller.disconnect()
+        event = await buyer.receive_json_from()
+        self.assertEqual((event['type'], event['online']), ('presence', False))
+        await buyer.disconnect()
+
+    async def test_typing_is_throttled_and_toggles_collapse(self):
+        buyer = await self.connect(self.buyer)
+        seller = await self.connect(self.seller)
+        await buyer.receive_json_from()  # seller came online
+        for is_typing in (True, True, False, True, True):
+            await seller.send_json_to({'type': 'typing', 'is_typing': is_typing})
+
+        self.assertTrue((await buyer.receive_json_from())['is_typing'])
+        self.assertTrue(await buyer.receive_nothing(timeout=0.2))
+        # Disconnecting mid-typing still clears the indicator
+        await seller.disconnect()
+        self.assertFalse((await buyer.receive_json_from())['is_typing'])
+        await buyer.disconnect()
+
+    async def test_notification_socket_tracks_all_conversations(self):
+        notifications = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/notifications/')
+        notifications.scope['user'] = self.seller
+        await notifications.connect()
+        self.assertEqual(
+            await notifications.receive_json_from(),
+            {'type': 'unread_summary', 'total_unread': 0, 'by_conversation': {}},
+        )
+
+        buyer = await self.connect(self.buyer)
+        await buyer.send_json_to({'type': 'chat_message', 'message': 'Still available?'})
+        message_id = (await buyer.receive_json_from())['message']['id']
+        event = await notifications.receive_json_from()
+        self.assertEqual(event['type'], 'new_message')
+        self.assertEqual((event['conversation_id'], event['unread_count']), (self.conversation.id, 1))
+        self.assertEqual(event['message']['id'], message_id)
+
+        seller = await self.connect(self.seller)
+        await seller.send_json_to({'type': 'read_up_to', 'message_id': message_id})
+        self.assertEqual(
+            await notifications.receive_json_from(),
+            {'type': 'unread_count', 'conversation_id': self.conversation.id, 'unread_count': 0},
+        )
+        for communicator in (buyer, seller, notifications):
+            await communicator.disconnect()
@@ -0,0 +1,95 @@
+"""
+Trending listings (``sort=trending``).
+
+``Post.trending_score`` sums a listing's recent engagement. Each view, net
+like, bookmark, inquiry and non-cancelled purchase counts
+``TRENDING_WEIGHTS[signal]``, halved for every ``TRENDING_HALF_LIFE_HOURS``
+of age. Engagement older than ``TRENDING_WINDOW_DAYS`` is ignored, so a
+listing that was busy long ago ranks like a quiet one. ``sort=popular``,
+by contrast, orders by lifetime purchases.
+
+Decay changes every score all the time, so the scores are recomputed from
+the hourly engagement counts rather than kept up to date per event.
+``manage.py update_trending_scores`` runs a recompute. It can run from cron,
+or with ``--schedule`` start the ``listings.trending`` job, which
+re-queues itself every ``TRENDING_REFRESH_INTERVAL`` seconds. The score is
+indexed together with the other browse orderings.
+"""
+
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, FloatField, Value, When
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .cache_utils import bump
+from .models import Bookmark, Post, PostViewHourly, PropertyInquiry, Purchase
+
+DEFAULT_WEIGHTS = {'views': 1, 'likes': 3, 'bookmarks': 4, 'inquiries': 8, 'purchases': 12}
+
+UPDATE_BATCH_SIZE = 500
+
+
+def trending_weights():
+    return {**DEFAULT_WEIGHTS, **getattr(settings, 'TRENDING_WEIGHTS', {})}
+
+
+def hourly_engagement(since):
+    """Yield ``(signal, post_id, hour, count)`` for all engagement from ``since`` on."""
+    buckets = PostViewHourly.objects.filter(hour__gte=since).values_list('post_id', 'hour', 'views', 'likes')
+    for post_id, hour, views, likes in buckets.iterator():
+        yield 'views', post_id, hour, views
+        yield 'likes', post_id, hour, likes
+
+    events = (
+        ('bookmarks', Bookmark.objects.all(), 'post'),
+        ('inquiries', PropertyInquiry.objects.all(), 'property'),
+        ('purchases', Purchase.objects.exclude(status='cancelled'), 'property'),
+    )
+    for signal, queryset, listing in events:
+        rows = (
+            queryset.filter(created_at__gte=since).annotate(hour=TruncHour('created_at'))
+            .order_by().values(listing, 'hour').annotate(count=Count('pk'))
+            .values_list(listing, 'hour', 'count')
+        )
+        for post_id, hour, count in rows.iterator():
+            yield signal, post_id, hour, count
+
+
+def compute_trending_scores(now=None):
+    """``{post_id: score}`` for every listing with engagement in the window."""
+    now = now or timezone.now()
+    half_life = getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 48) * 3600
+    since = now - timedelta(days=getattr(settings, 'TRENDING_WINDOW_DAYS', 14))
+    weights = trending_weights()
+
+    scores = Counter()
+    for signal, post_id, hour, count in hourly_engagement(since):
+        age = max((now - hour).total_seconds(), 0)
+        scores[post_id] += weights[signal] * count * 0.5 ** (age / half_life)
+    # Unlikes can leave a listing below zero
+    return {post_id: score for post_id, score in scores.items() if score > 0}
+
+
+def update_trending_scores(now=None):
+    """Recompute ``Post.trending_score`` for all listings; returns how many have a score."""
+    scores = compute_trending_scores(now)
+    with transaction.atomic():
+        # Listings whose engagement left the window go back to zero
+        stale = sorted(set(Post.objects.filter(trending_score__gt=0).values_list('pk', flat=True)) - set(scores))
+        for start in range(0, len(stale), UPDATE_BATCH_SIZE):
+            Post.objects.filter(pk__in=stale[start:start + UPDATE_BATCH_SIZE]).update(trending_score=0)
+
+        items = sorted(scores.items())
+        for start in range(0, len(items), UPDATE_BATCH_SIZE):
+            batch = dict(items[start:start + UPDATE_BATCH_SIZE])
+            Post.objects.filter(pk__in=batch).update(trending_score=Case(
+                *(When(pk=pk, then=Value(score)) for pk, score in batch.items()),
+                output_field=FloatField(),
+            ))
+    # Cached listing pages may be ordered by the old scores
+    bump('post')
+    return len(scores)
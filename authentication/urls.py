@@ -80,6 +80,7 @@ urlpatterns = [
     path('api/chat/<int:conversation_id>/send/', chat_views.api_send_message, name='api_send_message'),
     path('api/chat/<int:conversation_id>/read/', chat_views.api_mark_read, name='api_mark_read'),
     path('api/chat/<int:conversation_id>/archive/', chat_views.api_archive_conversation, name='api_archive_conversation'),
+    path('api/chat/<int:conversation_id>/presence/', chat_views.api_presence, name='api_presence'),
     path('api/chat/unread/', chat_views.api_unread_count, name='api_unread_count'),
     
     # InzuLink specific URLs
@@ -114,6 +115,10 @@ api_endpoints = [
     path('v1/bookmark/<int:post_id>/', views.bookmark_toggle_api, name='bookmark_toggle_api'),
     path('v1/like/<int:post_id>/', views.like_post_api, name='like_post_api'),
     path('v1/categories/', views.categories_api, name='categories_api'),
+    path('v1/cache/stats/', views.api_cache_stats, name='api_cache_stats'),
+    path('v1/jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('v1/reports/<int:report_id>/', views.report_status, name='report_status'),
+    path('v1/reports/<int:report_id>/download/', views.report_download, name='report_download'),
 ]
 
 # Add api_endpoints to main urlpatterns
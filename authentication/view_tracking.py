@@ -0,0 +1,230 @@
+"""
+Buffered listing view counting.
+
+``record_view`` is called by ``post_detail``. It drops repeat views: one view
+per viewer and listing per ``VIEW_COUNT_DEDUPE_WINDOW`` seconds, tracked
+with ``cache.add``. A viewer is the logged-in user, else the session, else
+the client address and user agent. Owners viewing their own listing are not
+counted. Counted views go into a per-process ``ViewCounterBuffer`` instead
+of the database.
+
+The buffer is flushed on the next view once it holds
+``VIEW_COUNT_FLUSH_THRESHOLD`` views, by a timer thread once its oldest view
+is ``VIEW_COUNT_FLUSH_INTERVAL`` seconds old (so a process that stops getting
+views still writes them), and at interpreter exit. A flush is a fixed number of
+statements however many listings it covers (see ``write_view_batch``):
+
+- one ``UPDATE`` adding each listing's views to ``Post.view_count``;
+- one ``UPDATE`` adding them to ``PostViewHourly``, the per-listing hourly
+  buckets that trending and vendor analytics read.
+
+Likes go into the same buckets as they happen (see ``record_likes``).
+
+The updates go through ``QuerySet.update``, so they do not invalidate cached
+listing data or touch ``updated_at``. Views still in the buffer are lost if
+the process dies without running exit handlers (e.g. SIGKILL). That is at
+most one interval's worth, which is acceptable for a popularity signal.
+"""
+
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from .models import Post, PostViewHourly
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_KEY = 'post_view:{post_id}:{viewer}'
+
+
+def current_hour(moment=None):
+    return (moment or timezone.now()).replace(minute=0, second=0, microsecond=0)
+
+
+def viewer_key(request):
+    """Who is viewing: the user, else the session, else a hash of address and user agent."""
+    if request.user.is_authenticated:
+        return f'u{request.user.pk}'
+    session_key = getattr(request, 'session', None) and request.session.session_key
+    if session_key:
+        return f's{session_key}'
+    client = f"{request.META.get('REMOTE_ADDR', '')}|{request.META.get('HTTP_USER_AGENT', '')}"
+    return 'a' + hashlib.sha1(client.encode()).hexdigest()[:20]
+
+
+def _added(amounts):
+    """``Case`` giving each primary key in ``amounts`` its amount, 0 for any other row."""
+    return Case(
+        *(When(pk=pk, then=Value(amount)) for pk, amount in amounts.items()),
+        default=Value(0), output_field=IntegerField(),
+    )
+
+
+def add_to_buckets(field, counts):
+    """
+    Add ``counts`` (``{(post_id, hour): n}``) to ``field`` of the hourly buckets.
+
+    Missing buckets are created first, so this is three statements however
+    many buckets it touches. The listings must exist.
+    """
+    PostViewHourly.objects.bulk_create(
+        [PostViewHourly(post_id=post_id, hour=hour) for post_id, hour in counts],
+        ignore_conflicts=True,
+    )
+    buckets = {
+        (post_id, hour): pk
+        for pk, post_id, hour in PostViewHourly.objects.filter(
+            post_id__in={post_id for post_id, _ in counts}, hour__in={hour for _, hour in counts},
+        ).values_list('pk', 'post_id', 'hour')
+    }
+    amounts = {buckets[key]: n for key, n in counts.items()}
+    PostViewHourly.objects.filter(pk__in=amounts).update(**{field: F(field) + _added(amounts)})
+
+
+def write_view_batch(counts):
+    """
+    Add buffered views to the database.
+
+    ``counts`` maps ``(post_id, hour)`` to a number of views. Listings
+    deleted since they were viewed are skipped.
+    """
+    if not counts:
+        return
+    per_post = Counter()
+    for (post_id, _), views in counts.items():
+        per_post[post_id] += views
+
+    with transaction.atomic():
+        existing = set(Post.objects.filter(pk__in=per_post).values_list('pk', flat=True))
+        counts = {key: views for key, views in counts.items() if key[0] in existing}
+        if not counts:
+            return
+        Post.objects.filter(pk__in=existing).update(
+            view_count=F('view_count') + _added({pk: per_post[pk] for pk in existing})
+        )
+        add_to_buckets('views', counts)
+
+
+def record_likes(post_ids, delta):
+    """Add ``delta`` likes to the current hour's bucket of every listing in ``post_ids``."""
+    if post_ids:
+        hour = current_hour()
+        add_to_buckets('likes', {(post_id, hour): delta for post_id in post_ids})
+
+
+class ViewCounterBuffer:
+    """Per-process tally of listing views waiting to be written."""
+
+    def __init__(self, flush_threshold=None, flush_interval=None):
+        self.flush_threshold = flush_threshold or getattr(settings, 'VIEW_COUNT_FLUSH_THRESHOLD', 500)
+        self.flush_interval = flush_interval or getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 10)
+        self._counts = Counter()
+        self._pending = 0
+        self._started = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._pending
+
+    def add(self, post_id, moment=None):
+        with self._lock:
+            self._counts[post_id, current_hour(moment)] += 1
+            self._pending += 1
+            if self._started is None:
+                self._started = time.monotonic()
+                self._schedule()
+            due = (self._pending >= self.flush_threshold
+                   or time.monotonic() - self._started >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def _schedule(self):
+        # Called with the lock held
+        self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread opened its own database connection
+            connections.close_all()
+
+    def _take(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._pending, self._started = 0, None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        return counts
+
+    def flush(self):
+        """Write everything pending; returns the number of views written."""
+        counts = self._take()
+        if not counts:
+            return 0
+        try:
+            write_view_batch(counts)
+        except Exception:
+            # Keep the views for the next flush
+            with self._lock:
+                self._counts.update(counts)
+                self._pending += sum(counts.values())
+                if self._started is None:
+                    self._started = time.monotonic()
+                    self._schedule()
+            logger.exception('Failed to write %d listing views', sum(counts.values()))
+            return 0
+        return sum(counts.values())
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_view_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = ViewCounterBuffer()
+            atexit.register(_buffer.flush)
+    return _buffer
+
+
+def record_view(request, post):
+    """Count a view of ``post`` unless this viewer was already counted within the window."""
+    if request.user.is_authenticated and request.user.pk == post.user_id:
+        return False
+    window = getattr(settings, 'VIEW_COUNT_DEDUPE_WINDOW', 1800)
+    if not cache.add(DEDUPE_KEY.format(post_id=post.pk, viewer=viewer_key(request)), 1, window):
+        return False
+    get_view_buffer().add(post.pk)
+    return True
+
+
+def views_since(since, post_ids=None):
+    """``{post_id: views}`` from the hourly buckets starting at or after ``since``."""
+    buckets = PostViewHourly.objects.filter(hour__gte=current_hour(since))
+    if post_ids is not None:
+        buckets = buckets.filter(post_id__in=post_ids)
+    return dict(buckets.order_by().values('post_id').annotate(total=Sum('views')).values_list('post_id', 'total'))
+
+
+def vendor_views_by_hour(vendor, since):
+    """``[(hour, views), ...]`` over all of ``vendor``'s listings, oldest first."""
+    return list(
+        PostViewHourly.objects.filter(post__user=vendor, hour__gte=current_hour(since))
+        .order_by('hour').values('hour').annotate(total=Sum('views')).values_list('hour', 'total')
+    )
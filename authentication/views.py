@@ -1,41 +1,72 @@
 import os
 import csv
+import hashlib
 import io
 import json
 import logging
-from datetime import datetime
+from datetime import datetime, time, timedelta
 from decimal import Decimal
 
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib import messages
 from django.contrib.auth import login, authenticate, login as auth_login, logout as auth_logout
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, JsonResponse, Http404
+from django.http import FileResponse, HttpResponse, JsonResponse, Http404, StreamingHttpResponse
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_protect
 from django.views.decorators.http import require_http_methods
 from django.db.models import Q, Sum, Count, Avg
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.core.files.storage import default_storage
 from django.core.paginator import Paginator
-
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.pdfgen import canvas
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from django.conf import settings
 
 from .forms import SignUpForm, ProductReviewForm, PropertyListingForm, PropertyInquiryForm, ListingFeePaymentForm
 from .models import (
     User, Post, Purchase, Bookmark, ProductImage, UserQRCode, 
     OTPVerification, ProductReview, PropertyInquiry, ListingFee,
-    Cart, CartItem
+    Cart, CartItem, Job, ReportArtifact
+)
+from .cache_utils import NAMESPACES, cache_anonymous_page, cache_metrics, cached, namespace_versions
+from .facets import filter_by_facets, listing_facets
+from .geo_utils import (
+    DISTANCE_ORDERING, InvalidGeoQuery, distance_km, filter_bbox, filter_near, parse_bbox, parse_near
+)
+from .jobs import job_reference
+from .listing_utils import listing_card_queryset, serialize_listing_card
+from .sales_rollups import (
+    platform_sales_summary, property_sales_breakdown, vendor_sales_breakdown, vendor_sales_summary
+)
+from .search_backends import RELEVANCE_ORDERING, search_posts
+from .similar_listings import similar_listings
+from .pagination_utils import (
+    COUNT_MODES, InvalidCursor, count_results, keyset_paginate, listing_sort_ordering
 )
 from .qr_utils import update_user_qr_code, decode_qr_data, get_user_purchases_from_qr
+from .reports import can_access_report, request_report
+from .tasks import (
+    check_paypack_status_async, initiate_paypack_payment_async, update_user_qr_code_async,
+)
 from .otp_utils import create_otp, verify_otp
+from .view_tracking import record_view
 from django.views.decorators.csrf import csrf_exempt
 
+def _month_bounds(moment=None):
+    """Return (start of month, start of next month) in the current timezone.
+
+    Filtering on a half-open range instead of ``__month``/``__year`` lets the
+    database use the ``completed_at`` index.
+    """
+    moment = timezone.localtime(moment)
+    month_start = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if month_start.month == 12:
+        next_month_start = month_start.replace(year=month_start.year + 1, month=1)
+    else:
+        next_month_start = month_start.replace(month=month_start.month + 1)
+    return month_start, next_month_start
+
 def generate_csv_report(data, filename, headers):
     """Generate CSV report from data"""
     response = HttpResponse(content_type='text/csv')
@@ -47,84 +78,198 @@ def generate_csv_report(data, filename, headers):
     
     return response
 
-def generate_pdf_report(data, filename, title, headers, summary_data=None):
-    """Generate PDF report from data"""
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="{filename}.pdf"'
-    
-    # Create the PDF object
-    doc = SimpleDocTemplate(response, pagesize=A4)
-    elements = []
-    
-    # Get styles
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        spaceAfter=30,
-        alignment=TA_CENTER
-    )
-    
-    # Add title
-    elements.append(Paragraph(title, title_style))
-    elements.append(Spacer(1, 20))
-    
-    # Add summary if provided
-    if summary_data:
-        summary_style = ParagraphStyle(
-            'Summary',
-            parent=styles['Normal'],
-            fontSize=12,
-            spaceAfter=20
-        )
-        for key, value in summary_data.items():
-            elements.append(Paragraph(f"<b>{key}:</b> {value}", summary_style))
-        elements.append(Spacer(1, 20))
-    
-    # Create table
-    if data:
-        table = Table([headers] + data)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        elements.append(table)
-    
-    # Build PDF
-    doc.build(elements)
+class _Echo:
+    """Pseudo-buffer for csv.writer: ``write`` hands the formatted line back."""
+
+    def write(self, value):
+        return value
+
+def stream_csv_report(rows, filename, headers):
+    """
+    Stream a CSV report line by line.
+
+    ``rows`` is consumed lazily while the response is sent, so with a
+    generator over ``export_rows`` memory stays flat however many rows the
+    report has.
+    """
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow(headers)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
     return response
 
+def export_rows(queryset, make_row):
+    """Yield ``make_row(obj)`` for each object, fetched in chunks of ``EXPORT_CHUNK_SIZE``."""
+    chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        yield make_row(obj)
+
+def export_days(request):
+    """
+    ``(first, last)`` dates from the optional ``?from=`` and ``?to=`` (YYYY-MM-DD).
+
+    Both days are inclusive and either is ``None`` when not given. Raises
+    ``ValueError`` for malformed dates or a range that ends before it starts.
+    """
+    days = []
+    for name in ('from', 'to'):
+        value = request.GET.get(name)
+        day = parse_date(value) if value else None
+        if value and day is None:
+            raise ValueError(f"'{name}' must be a date in YYYY-MM-DD format")
+        days.append(day)
+    first, last = days
+    if first and last and first > last:
+        raise ValueError("'from' must not be after 'to'")
+    return first, last
+
+def export_date_range(request):
+    """``export_days`` as aware datetimes; ``end`` is the start of the day after ``to``."""
+    first, last = export_days(request)
+    start = timezone.make_aware(datetime.combine(first, time.min)) if first else None
+    end = timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min)) if last else None
+    return start, end
+
+def filter_date_range(queryset, field, start, end):
+    if start:
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{field}__lt': end})
+    return queryset
+
+def _seller_name(purchase):
+    seller = purchase.property.user if purchase.property else None
+    return f"{seller.first_name} {seller.last_name}" if seller else ''
+
+def _purchase_export_row(purchase, moment, titled_status=False):
+    """Property, seller, date, price and status columns shared by the purchase exports."""
+    return [
+        purchase.property.title if purchase.property else '',
+        _seller_name(purchase),
+        timezone.localtime(moment).strftime('%Y-%m-%d %H:%M') if moment else '',
+        f"RWF {purchase.final_price:,.1f}",
+        purchase.status.title() if titled_status else purchase.get_status_display(),
+    ]
+
+def stream_purchase_export(request, purchases, filename, date_field='completed_at',
+                           with_order_id=False, with_buyer=False, property_header='Property',
+                           titled_status=False):
+    """
+    Stream ``purchases`` as CSV, narrowed to the request's date range on ``date_field``.
+
+    Redirects back to the page with an error message when the range is
+    invalid. ``property_header`` and ``titled_status`` (``status.title()``
+    instead of the display label) keep older exports in their original format.
+    """
+    try:
+        start, end = export_date_range(request)
+    except ValueError as error:
+        messages.error(request, str(error))
+        return redirect(request.path)
+
+    purchases = filter_date_range(purchases, date_field, start, end).select_related(
+        'buyer', 'property', 'property__user'
+    ).order_by(date_field, 'id')
+    headers = [property_header, 'Seller', 'Date', 'Price', 'Status']
+    if with_buyer:
+        headers.insert(0, 'Buyer')
+    if with_order_id:
+        headers.insert(0, 'Order ID')
+
+    def make_row(purchase):
+        row = _purchase_export_row(purchase, getattr(purchase, date_field), titled_status)
+        if with_buyer:
+            row.insert(0, purchase.buyer.username)
+        if with_order_id:
+            row.insert(0, purchase.order_id)
+        return row
+
+    return stream_csv_report(export_rows(purchases, make_row), filename, headers)
+
+def report_reference(artifact, user):
+    """What the report endpoints return: the report's state and where to poll or download it."""
+    data = {
+        'report_id': artifact.pk,
+        'report_type': artifact.report_type,
+        'status': artifact.status,
+        'status_url': reverse('report_status', args=[artifact.pk]),
+        'download_url': reverse('report_download', args=[artifact.pk]) if artifact.status == 'ready' else None,
+        'date_from': artifact.date_from.isoformat() if artifact.date_from else None,
+        'date_to': artifact.date_to.isoformat() if artifact.date_to else None,
+    }
+    if artifact.status == 'ready':
+        data.update(size=artifact.size, rows=artifact.row_count, build_seconds=artifact.build_seconds)
+    elif artifact.job_id and (artifact.job.user_id == user.id or user.is_staff):
+        data['job'] = job_reference(artifact.job)
+        if artifact.job.status == 'failed':
+            data['status'] = 'failed'
+            data['error'] = artifact.job.error
+    return data
+
+def report_file_response(artifact):
+    return FileResponse(default_storage.open(artifact.file), as_attachment=True,
+                        filename=f'{artifact.filename}.pdf', content_type='application/pdf')
+
+def pdf_report_response(request, report_type, subject, filename):
+    """
+    Serve a PDF report from its stored artifact, building it first if the
+    data changed since the last one.
+
+    Plain ``?export=pdf`` builds a missing report inline and downloads it.
+    With ``?async=1`` a missing report is built by a job and the response is
+    a 202 with the report's ``status_url``, which gives the ``download_url``
+    once it is ready. ``?from=``/``?to=`` limit the report to a date range.
+    """
+    try:
+        days = export_days(request)
+    except ValueError as error:
+        messages.error(request, str(error))
+        return redirect(request.path)
+    
+    build_async = request.GET.get('async') == '1'
+    artifact = request_report(report_type, subject, days, filename, user=request.user, build_now=not build_async)
+    if not build_async:
+        return report_file_response(artifact)
+    return JsonResponse(report_reference(artifact, request.user), status=200 if artifact.status == 'ready' else 202)
+
+def home_snapshot(sort_by='newest'):
+    """Everything the home page shows that doesn't depend on the visitor."""
+    categories = category_counts()
+    return {
+        'featured_products': list(
+            Post.objects.filter(inventory__gt=0).select_related('user')
+            .order_by(*listing_sort_ordering(sort_by))[:12]
+        ),
+        'categories': categories,
+        'total_products': sum(category['product_count'] for category in categories),
+        'total_vendors': User.objects.filter(is_vendor_role=True).count(),
+    }
+
+@cache_anonymous_page('home', depends_on=('post', 'user'), timeout=getattr(settings, 'HOME_PAGE_CACHE_TIMEOUT', 60))
 def home(request):
     """
     Home page view displaying featured products
     """
-    # Get all available products (with inventory > 0)
-    featured_products = Post.objects.filter(inventory__gt=0).order_by('-created_at')[:12]
-    
-    # Get products by category
-    categories = Post.CATEGORY_CHOICES
+    # Featured listings are the newest, or the trending ones with ?sort=trending
+    sort_by = 'trending' if request.GET.get('sort') == 'trending' else 'newest'
     
-    # Get some statistics
-    total_products = Post.objects.filter(inventory__gt=0).count()
-    total_vendors = User.objects.filter(is_vendor_role=True).count()
+    # Featured listings, totals and category counts are shared by every visitor
+    snapshot = cached(
+        'home_snapshot', lambda: home_snapshot(sort_by), parts=(sort_by,), depends_on=('post', 'user'),
+        timeout=getattr(settings, 'HOME_SNAPSHOT_TIMEOUT', 300)
+    )
     
     context = {
-        'featured_products': featured_products,
-        'categories': categories,
-        'total_products': total_products,
-        'total_vendors': total_vendors,
+        'sort_by': sort_by,
+        'featured_products': snapshot['featured_products'],
+        'categories': snapshot['categories'],
+        'total_products': snapshot['total_products'],
+        'total_vendors': snapshot['total_vendors'],
     }
     
     return render(request, 'authentication/home.html', context)
@@ -377,6 +522,17 @@ def get_token_user(request):
     except:
         return None
 
+def dashboard_facets_key(request, user, selected_facets):
+    """Cache key part for the facets of one dashboard_api filter combination."""
+    params = [
+        request.GET.get(name, '').strip()
+        for name in ('q', 'min_price', 'max_price', 'near', 'radius_km', 'bbox')
+    ]
+    params += [selected_facets[facet] for facet in sorted(selected_facets)]
+    # Vendors never see their own listings
+    params.append(user.pk if user.is_vendor_role else '')
+    return hashlib.sha1(json.dumps(params, default=str).encode()).hexdigest()
+
 @csrf_exempt
 @require_http_methods(['GET'])
 def dashboard_api(request):
@@ -399,7 +555,15 @@ def dashboard_api(request):
         category = request.GET.get('category', '')
         min_price = request.GET.get('min_price', '')
         max_price = request.GET.get('max_price', '')
-        sort_by = request.GET.get('sort', 'newest')
+        near = request.GET.get('near', '').strip()
+        bbox = request.GET.get('bbox', '').strip()
+        sort_by = request.GET.get('sort') or (
+            'relevance' if search_query else 'distance' if near else 'newest'
+        )
+        if sort_by == 'relevance' and not search_query:
+            sort_by = 'newest'
+        if sort_by == 'distance' and not near:
+            sort_by = 'newest'
         page_number = request.GET.get('page', 1)
         page_size = int(request.GET.get('page_size', 20))  # Allow custom page size
         
@@ -421,17 +585,21 @@ def dashboard_api(request):
         
         # Apply search filter if provided
         if search_query:
-            posts = posts.filter(
-                Q(title__icontains=search_query) |
-                Q(description__icontains=search_query) |
-                Q(user__username__icontains=search_query)
-            )
+            posts = search_posts(posts, search_query)
         
-        # Apply category filter if provided
-        if category:
-            # Convert to lowercase to match the model's CATEGORY_CHOICES keys
-            category = category.lower()
-            posts = posts.filter(category=category)
+        # Apply location filters (see geo_utils.py)
+        try:
+            if near:
+                near_point = parse_near(near, request.GET.get('radius_km'))
+                posts = filter_near(posts, *near_point)
+            if bbox:
+                posts = filter_bbox(posts, *parse_bbox(bbox))
+        except InvalidGeoQuery as e:
+            return JsonResponse({
+                'success': False,
+                'message': 'Invalid location filter',
+                'errors': {'location': [str(e)]}
+            }, status=400)
         
         # Apply price range filters
         if min_price:
@@ -446,81 +614,109 @@ def dashboard_api(request):
             except ValueError:
                 pass
         
+        # Facet filters (category, property_type, district, condition); the
+        # facet counts are taken before they are applied, see facets.py
+        # Convert category to lowercase to match the model's CATEGORY_CHOICES keys
+        category = category.lower()
+        selected_facets = {
+            'category': category,
+            'property_type': request.GET.get('property_type', '').strip().lower(),
+            'district': request.GET.get('district', '').strip(),
+            'condition': request.GET.get('condition', '').strip().lower(),
+        }
+        # The facet pass groups the whole filtered set, so by default it only
+        # runs for the first page (?facets=1/0 overrides) and is cached until
+        # a listing changes
+        cursor = request.GET.get('cursor')
+        first_page = cursor is None and str(page_number) == '1'
+        if request.GET.get('facets', '1' if first_page else '0') in ('1', 'true'):
+            facets = cached(
+                'dashboard_facets', lambda: listing_facets(posts, selected_facets),
+                parts=(dashboard_facets_key(request, user, selected_facets),), depends_on=('post',),
+            )
+        else:
+            facets = None
+        posts = filter_by_facets(posts, selected_facets)
+        
         # Apply sorting
-        if sort_by == 'price_low':
+        if sort_by == 'relevance':
+            posts = posts.order_by(*RELEVANCE_ORDERING)
+        elif sort_by == 'price_low':
             posts = posts.order_by('price')
         elif sort_by == 'price_high':
             posts = posts.order_by('-price')
         elif sort_by == 'popular':
             posts = posts.order_by('-total_purchases', '-created_at')
+        elif sort_by == 'trending':
+            posts = posts.order_by(*listing_sort_ordering('trending'))
         elif sort_by == 'rating':
-            # Order by average rating (implement this later)
-            posts = posts.order_by('-created_at')
+            posts = posts.order_by(*listing_sort_ordering('rating'))
+        elif sort_by == 'distance':
+            posts = posts.order_by(*DISTANCE_ORDERING)
         else:  # newest (default)
             posts = posts.order_by('-created_at')
         
-        # Get total count before pagination
-        total_products = posts.count()
-        
-        # Get user's bookmarked posts
-        bookmarked_posts = [bookmark.post.id for bookmark in Bookmark.objects.filter(user=user)]
-        
-        # Get user's liked posts
-        liked_posts = [post.id for post in Post.objects.filter(likes=user)]
-        
-        # Pagination
-        paginator = Paginator(posts, page_size)
-        try:
-            page_obj = paginator.get_page(page_number)
-        except Exception:
-            page_obj = paginator.get_page(1)
+        # Get user's bookmarked and liked post ids (one query each)
+        bookmarked_posts = set(Bookmark.objects.filter(user=user).values_list('post_id', flat=True))
+        liked_posts = set(Post.likes.through.objects.filter(user=user).values_list('post_id', flat=True))
+        
+        # Pagination - listing cards are annotated/prefetched so the page
+        # costs a fixed number of queries regardless of page_size.
+        # Cursor (keyset) mode is opt-in via ?pagination=cursor or ?cursor=...
+        if cursor is not None or request.GET.get('pagination') == 'cursor':
+            count_mode = request.GET.get('count', 'approx')
+            if count_mode not in COUNT_MODES:
+                count_mode = 'approx'
+            if sort_by == 'relevance':
+                ordering = RELEVANCE_ORDERING
+            elif sort_by == 'distance':
+                ordering = DISTANCE_ORDERING
+            else:
+                ordering = listing_sort_ordering(sort_by)
+            try:
+                page_obj = keyset_paginate(listing_card_queryset(posts), ordering, cursor, page_size)
+            except InvalidCursor:
+                page_obj = keyset_paginate(listing_card_queryset(posts), ordering, None, page_size)
+            total_products, total_is_exact = count_results(posts, count_mode)
+            pagination_data = {
+                'mode': 'cursor',
+                'page_size': page_size,
+                'total_items': total_products,
+                'total_is_exact': total_is_exact,
+                'has_next': page_obj.has_next(),
+                'has_previous': page_obj.has_previous(),
+                'next_cursor': page_obj.next_cursor,
+                'prev_cursor': page_obj.prev_cursor,
+            }
+        else:
+            paginator = Paginator(listing_card_queryset(posts), page_size)
+            if facets is not None:
+                paginator.count = facets['total']  # spares the COUNT(*) query
+            try:
+                page_obj = paginator.get_page(page_number)
+            except Exception:
+                page_obj = paginator.get_page(1)
+            total_products = paginator.count
+            pagination_data = {
+                'mode': 'page',
+                'current_page': page_obj.number,
+                'total_pages': paginator.num_pages,
+                'page_size': page_size,
+                'total_items': total_products,
+                'has_next': page_obj.has_next(),
+                'has_previous': page_obj.has_previous(),
+                'next_page': page_obj.next_page_number() if page_obj.has_next() else None,
+                'previous_page': page_obj.previous_page_number() if page_obj.has_previous() else None
+            }
         
         # Convert posts to JSON-serializable format
-        posts_data = []
-        for post in page_obj:
-            # Get auxiliary images
-            auxiliary_images = ProductImage.objects.filter(product=post).order_by('display_order')
-            aux_images_data = []
-            for img in auxiliary_images:
-                aux_images_data.append({
-                    'id': img.id,
-                    'image_url': img.image.url if img.image else None,
-                    'display_order': img.display_order
-                })
-            
-            # Calculate average rating if reviews exist
-            reviews = ProductReview.objects.filter(product=post)
-            avg_rating = reviews.aggregate(avg=Avg('rating'))['avg']
-            avg_rating = round(avg_rating, 1) if avg_rating else None
-            
-            post_data = {
-                'id': post.id,
-                'title': post.title,
-                'description': post.description,
-                'price': float(post.price) if post.price else None,
-                'category': post.category,
-                'category_display': post.get_category_display(),
-                'inventory': post.inventory,
-                'created_at': post.created_at.isoformat(),
-                'updated_at': post.updated_at.isoformat(),
-                'total_purchases': post.total_purchases,
-                'image_url': post.image.url if post.image else None,
-                'auxiliary_images': aux_images_data,
-                'average_rating': avg_rating,
-                'review_count': reviews.count(),
-                'total_likes': post.total_likes(),
-                'is_bookmarked': post.id in bookmarked_posts,
-                'is_liked': post.id in liked_posts,
-                'user': {
-                    'id': post.user.id,
-                    'username': post.user.username,
-                    'first_name': post.user.first_name,
-                    'last_name': post.user.last_name,
-                    'is_vendor_role': post.user.is_vendor_role,
-                    'profile_picture_url': post.user.profile_picture.url if post.user.profile_picture else None
-                }
-            }
-            posts_data.append(post_data)
+        posts_data = [
+            serialize_listing_card(post, bookmarked_posts, liked_posts)
+            for post in page_obj
+        ]
+        if near:
+            for card, post in zip(posts_data, page_obj):
+                card['distance_km'] = distance_km(post)
         
         # Get all categories for the filter dropdown
         categories_data = []
@@ -536,31 +732,32 @@ def dashboard_api(request):
             'message': 'Dashboard data retrieved successfully',
             'data': {
                 'posts': posts_data,
-                'pagination': {
-                    'current_page': page_obj.number,
-                    'total_pages': paginator.num_pages,
-                    'page_size': page_size,
-                    'total_items': total_products,
-                    'has_next': page_obj.has_next(),
-                    'has_previous': page_obj.has_previous(),
-                    'next_page': page_obj.next_page_number() if page_obj.has_next() else None,
-                    'previous_page': page_obj.previous_page_number() if page_obj.has_previous() else None
-                },
+                'pagination': pagination_data,
                 'filters': {
                     'search_query': search_query,
                     'selected_category': category,
                     'min_price': min_price,
                     'max_price': max_price,
                     'sort_by': sort_by,
+                    'selected_property_type': selected_facets['property_type'],
+                    'selected_district': selected_facets['district'],
+                    'selected_condition': selected_facets['condition'],
+                    'near': near,
+                    'radius_km': near_point[2] if near else None,
+                    'bbox': bbox,
                     'available_categories': categories_data,
                     'available_sorts': [
+                        {'value': 'relevance', 'label': 'Best Match'},
                         {'value': 'newest', 'label': 'Newest First'},
                         {'value': 'price_low', 'label': 'Price: Low to High'},
                         {'value': 'price_high', 'label': 'Price: High to Low'},
                         {'value': 'popular', 'label': 'Most Popular'},
-                        {'value': 'rating', 'label': 'Highest Rated'}
+                        {'value': 'trending', 'label': 'Trending'},
+                        {'value': 'rating', 'label': 'Highest Rated'},
+                        {'value': 'distance', 'label': 'Nearest First'}
                     ]
                 },
+                'facets': facets,
                 'user_info': {
                     'id': user.id,
                     'username': user.username,
@@ -572,7 +769,7 @@ def dashboard_api(request):
                     'total_products': total_products,
                     'products_on_page': len(posts_data),
                     'search_applied': bool(search_query),
-                    'filters_applied': bool(category or min_price or max_price),
+                    'filters_applied': bool(min_price or max_price or near or bbox or any(selected_facets.values())),
                     'sort_applied': sort_by != 'newest'
                 }
             }
@@ -654,7 +851,7 @@ def like_post_api(request, post_id):
         
         post = get_object_or_404(Post, id=post_id)
         
-        if user in post.likes.all():
+        if post.likes.filter(pk=user.pk).exists():
             post.likes.remove(user)
             liked = False
             status_text = 'removed'
@@ -681,27 +878,37 @@ def like_post_api(request, post_id):
             'errors': {'server': [str(e)]}
         }, status=500)
 
+def category_counts():
+    """In-stock listing count for every category, including empty ones."""
+    counts = dict(
+        Post.objects.filter(inventory__gt=0).order_by().values_list('category').annotate(count=Count('id'))
+    )
+    return [
+        {'value': value, 'label': label, 'product_count': counts.get(value, 0)}
+        for value, label in Post.CATEGORY_CHOICES
+    ]
+
+
+def in_stock_facets():
+    """Facet counts over every in-stock listing."""
+    return listing_facets(Post.objects.filter(inventory__gt=0))
+
 @csrf_exempt
 @require_http_methods(['GET'])
 def categories_api(request):
     """API endpoint to get all available categories"""
     try:
-        categories_data = []
-        for choice in Post.CATEGORY_CHOICES:
-            # Get count of products in each category
-            count = Post.objects.filter(category=choice[0], inventory__gt=0).count()
-            categories_data.append({
-                'value': choice[0],
-                'label': choice[1],
-                'product_count': count
-            })
+        # One grouped count, cached until a listing changes
+        categories_data = cached('categories', category_counts, depends_on=('post',))
+        facets = cached('listing_facets', in_stock_facets, depends_on=('post',))
         
         return JsonResponse({
             'success': True,
             'message': 'Categories retrieved successfully',
             'data': {
                 'categories': categories_data,
-                'total_categories': len(categories_data)
+                'total_categories': len(categories_data),
+                'facets': facets,
             }
         }, status=200)
         
@@ -712,6 +919,71 @@ def categories_api(request):
             'errors': {'server': [str(e)]}
         }, status=500)
 
+
+@login_required
+@require_http_methods(['GET'])
+def api_cache_stats(request):
+    """Cache hit/miss counts of this worker, for staff and InzuLink admins."""
+    if not (request.user.is_staff or request.user.is_koraquest()):
+        return JsonResponse({'success': False, 'message': 'Not allowed'}, status=403)
+    
+    return JsonResponse({
+        'success': True,
+        'data': {
+            'backend': settings.CACHES['default']['BACKEND'],
+            'versions': namespace_versions(NAMESPACES),
+            'metrics': cache_metrics(),
+        }
+    })
+
+@login_required
+@require_http_methods(['GET'])
+def job_status(request, job_id):
+    """Poll a background job started by one of the ``async`` call sites."""
+    job = Job.objects.filter(pk=job_id).first()
+    # Other users' jobs look the same as missing ones
+    if job is None or not (job.user_id == request.user.id or request.user.is_staff):
+        return JsonResponse({'success': False, 'message': 'Job not found'}, status=404)
+    
+    return JsonResponse({
+        'success': True,
+        'data': {
+            'job_id': job.pk,
+            'task': job.task,
+            'status': job.status,
+            'attempts': job.attempts,
+            'max_attempts': job.max_attempts,
+            'result': job.result if job.status == 'succeeded' else None,
+            'error': job.error or None,
+            # When a queued job will next be tried, e.g. after a failed attempt
+            'run_at': job.run_at.isoformat() if job.status == 'queued' else None,
+            'created_at': job.created_at.isoformat(),
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        }
+    })
+
+@login_required
+@require_http_methods(['GET'])
+def report_status(request, report_id):
+    """Poll a PDF report requested with ``?export=pdf&async=1``."""
+    artifact = ReportArtifact.objects.select_related('job').filter(pk=report_id).first()
+    if artifact is None or not can_access_report(request.user, artifact):
+        return JsonResponse({'success': False, 'message': 'Report not found'}, status=404)
+    
+    return JsonResponse({'success': True, 'data': report_reference(artifact, request.user)})
+
+@login_required
+@require_http_methods(['GET'])
+def report_download(request, report_id):
+    """Download a ready PDF report."""
+    artifact = ReportArtifact.objects.filter(pk=report_id).first()
+    if artifact is None or not can_access_report(request.user, artifact):
+        return JsonResponse({'success': False, 'message': 'Report not found'}, status=404)
+    if artifact.status != 'ready':
+        return JsonResponse({'success': False, 'message': 'Report is not ready yet'}, status=409)
+    
+    return report_file_response(artifact)
+
 @login_required
 def dashboard(request):
     # Get filter parameters from the request
@@ -719,7 +991,9 @@ def dashboard(request):
     category = request.GET.get('category', '')
     min_price = request.GET.get('min_price', '')
     max_price = request.GET.get('max_price', '')
-    sort_by = request.GET.get('sort', 'newest')
+    sort_by = request.GET.get('sort') or ('relevance' if search_query else 'newest')
+    if sort_by == 'relevance' and not search_query:
+        sort_by = 'newest'
     
     # Start with all products (no job posts anymore)
     posts = Post.objects.all()
@@ -733,11 +1007,7 @@ def dashboard(request):
     
     # Apply search filter if provided
     if search_query:
-        posts = posts.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(user__username__icontains=search_query)
-        )
+        posts = search_posts(posts, search_query)
     
     # Apply category filter if provided
     if category:
@@ -759,15 +1029,18 @@ def dashboard(request):
             pass
     
     # Apply sorting
-    if sort_by == 'price_low':
+    if sort_by == 'relevance':
+        posts = posts.order_by(*RELEVANCE_ORDERING)
+    elif sort_by == 'price_low':
         posts = posts.order_by('price')
     elif sort_by == 'price_high':
         posts = posts.order_by('-price')
     elif sort_by == 'popular':
         posts = posts.order_by('-total_purchases', '-created_at')
+    elif sort_by == 'trending':
+        posts = posts.order_by(*listing_sort_ordering('trending'))
     elif sort_by == 'rating':
-        # Order by average rating (we'll implement this later)
-        posts = posts.order_by('-created_at')
+        posts = posts.order_by(*listing_sort_ordering('rating'))
     else:  # newest (default)
         posts = posts.order_by('-created_at')
     
@@ -775,15 +1048,34 @@ def dashboard(request):
     categories = Post.CATEGORY_CHOICES
     
     # Get user's bookmarked posts for easier template rendering
-    bookmarked_posts = [bookmark.post.id for bookmark in Bookmark.objects.filter(user=request.user)]
+    bookmarked_posts = set(Bookmark.objects.filter(user=request.user).values_list('post_id', flat=True))
     
     # Get user's liked posts for easier template rendering
-    liked_posts = [post.id for post in Post.objects.filter(likes=request.user)]
-    
-    # Pagination
-    paginator = Paginator(posts, 20)  # 20 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    liked_posts = set(Post.likes.through.objects.filter(user=request.user).values_list('post_id', flat=True))
+    
+    # Pagination - cursor (keyset) mode is opt-in via ?pagination=cursor or ?cursor=...
+    posts = posts.select_related('user')
+    cursor = request.GET.get('cursor')
+    cursor_pagination = cursor is not None or request.GET.get('pagination') == 'cursor'
+    cursor_query = ''
+    if cursor_pagination:
+        ordering = RELEVANCE_ORDERING if sort_by == 'relevance' else listing_sort_ordering(sort_by)
+        try:
+            page_obj = keyset_paginate(posts, ordering, cursor, 20)
+        except InvalidCursor:
+            page_obj = keyset_paginate(posts, ordering, None, 20)
+        count_mode = request.GET.get('count', 'approx')
+        total_products, _ = count_results(posts, count_mode if count_mode in COUNT_MODES else 'approx')
+        query = request.GET.copy()
+        query.pop('cursor', None)
+        query.pop('page', None)
+        query['pagination'] = 'cursor'
+        cursor_query = query.urlencode()
+    else:
+        paginator = Paginator(posts, 20)  # 20 products per page
+        page_number = request.GET.get('page')
+        page_obj = paginator.get_page(page_number)
+        total_products = paginator.count
     
     context = {
         'posts': page_obj,
@@ -795,7 +1087,9 @@ def dashboard(request):
         'categories': categories,
         'bookmarked_posts': bookmarked_posts,
         'liked_posts': liked_posts,
-        'total_products': posts.count(),
+        'total_products': total_products,
+        'cursor_pagination': cursor_pagination,
+        'cursor_query': cursor_query,
     }
     
     return render(request, 'authentication/dashboard.html', context)
@@ -820,6 +1114,8 @@ def post_detail(request, post_id):
         # ).exists()
         has_purchased = False  # Always allow purchases
     
+    record_view(request, post)
+    
     # Get auxiliary images for the product
     auxiliary_images = ProductImage.objects.filter(product=post).order_by('display_order')
     
@@ -839,6 +1135,8 @@ def post_detail(request, post_id):
         'auxiliary_images': auxiliary_images,
         'reviews': reviews,
         'user_review': user_review,
+        # Precomputed neighbours, one cache lookup (see similar_listings.py)
+        'similar_listings': similar_listings(post),
     }
     
     return render(request, 'authentication/post_detail.html', context)
@@ -959,37 +1257,13 @@ def purchase_history(request):
     
     # Check if export is requested
     export_format = request.GET.get('export')
-    if export_format in ['csv', 'pdf']:
-        # Prepare data for export
-        headers = ['Order ID', 'Property', 'Seller', 'Date', 'Price', 'Status']
-        data = []
-        
-        for purchase in purchases:
-            data.append([
-                purchase.order_id,
-                purchase.property.title,
-                f"{purchase.property.user.first_name} {purchase.property.user.last_name}",
-                purchase.created_at.strftime('%Y-%m-%d %H:%M'),
-                f"RWF {purchase.final_price:,.1f}",
-                purchase.status.title()
-            ])
-        
-        # Summary data for PDF
-        summary_data = {
-            'Total Purchases': purchases.count(),
-            'Total Spent': f"RWF {(purchases.aggregate(total=Sum('final_price'))['total'] or 0):,.1f}",
-            'Completed Orders': purchases.filter(status='completed').count(),
-            'Pending Orders': purchases.filter(status__in=['pending', 'processing']).count(),
-            'Report Generated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
-        
+    if export_format == 'csv':
         filename = f"purchase_history_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        title = f"Purchase History Report - {request.user.get_full_name() or request.user.username}"
-        
-        if export_format == 'csv':
-            return generate_csv_report(data, filename, headers)
-        elif export_format == 'pdf':
-            return generate_pdf_report(data, filename, title, headers, summary_data)
+        return stream_purchase_export(request, purchases, filename, date_field='created_at', with_order_id=True,
+                                      titled_status=True)
+    if export_format == 'pdf':
+        filename = f"purchase_history_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        return pdf_report_response(request, 'purchase_history', request.user, filename)
     
     context = {
         'purchases': purchases
@@ -1021,7 +1295,10 @@ def vendor_dashboard(request):
     purchases = Purchase.objects.filter(property__user=request.user)
     
     # Calculate statistics
-    total_sales = purchases.filter(status='completed').count()
+    total_sales = cached(
+        'vendor_completed_sales', purchases.filter(status='completed').count,
+        parts=(request.user.pk,), depends_on=('purchase',)
+    )
     total_revenue = request.user.total_sales
     
     # Get recent purchases
@@ -1312,7 +1589,7 @@ def like_post(request, post_id):
         try:
             post = get_object_or_404(Post, id=post_id)
             
-            if request.user in post.likes.all():
+            if post.likes.filter(pk=request.user.pk).exists():
                 post.likes.remove(request.user)
                 liked = False
             else:
@@ -1575,9 +1852,10 @@ def inzulink_dashboard(request):
     # Note: Commission system removed - using listing fees instead
     total_commission = 0  # Placeholder for backward compatibility
     
+    month_start, next_month_start = _month_bounds()
     monthly_commission = completed_purchases.filter(
-        completed_at__month=timezone.now().month,
-        completed_at__year=timezone.now().year
+        completed_at__gte=month_start,
+        completed_at__lt=next_month_start
     ).count()  # Changed to count instead of commission sum
     
     context = {
@@ -1880,6 +2158,10 @@ def update_qr_code_ajax(request):
     print(f"CSRF Token in META: {request.META.get('HTTP_X_CSRFTOKEN', 'Not found')}")
     
     if request.method == 'POST':
+        if request.POST.get('async') == '1':
+            job = update_user_qr_code_async(request.user)
+            return JsonResponse({'success': True, **job_reference(job)}, status=202)
+        
         user_qr = update_user_qr_code(request.user)
         
         return JsonResponse({
@@ -1932,34 +2214,20 @@ def sales_statistics(request):
             status='completed'
         ).select_related('property', 'buyer')
         
-        # Calculate vendor statistics
-        total_sales = purchases.count()
-        total_revenue = purchases.aggregate(
-            total=Sum('final_price')
-        )['total'] or 0
-        
-        # Monthly statistics
-        current_month = timezone.now().month
-        current_year = timezone.now().year
-        monthly_purchases = purchases.filter(
-            completed_at__month=current_month,
-            completed_at__year=current_year
-        )
-        monthly_revenue = monthly_purchases.aggregate(
-            total=Sum('final_price')
-        )['total'] or 0
-        
-        # Property-wise breakdown (sales by property)
-        product_stats = purchases.values('property__title').annotate(
-            total_sales=Count('id'),
-            total_revenue=Sum('final_price'),
-            avg_price=Avg('final_price')
-        ).order_by('-total_revenue')
+        # Totals and the per-property breakdown come from the daily rollups
+        summary = vendor_sales_summary(request.user)
+        total_sales = summary['total_sales']
+        total_revenue = summary['total_revenue']
+        monthly_revenue = summary['monthly_total_revenue']
+        product_stats = property_sales_breakdown(request.user)
         
         # Recent transactions
         recent_transactions = purchases.order_by('-completed_at')[:10]
         
         # Handle export for vendor
+        if export_format == 'transactions':
+            filename = f"vendor_transactions_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            return stream_purchase_export(request, purchases, filename, with_order_id=True, with_buyer=True)
         if export_format in ['csv', 'pdf']:
             if export_format == 'csv':
                 headers = ['Product', 'Total Sales', 'Total Revenue', 'Average Price']
@@ -1974,32 +2242,15 @@ def sales_statistics(request):
                 filename = f"vendor_sales_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
                 return generate_csv_report(data, filename, headers)
             elif export_format == 'pdf':
-                headers = ['Product', 'Total Sales', 'Total Revenue', 'Average Price']
-                data = []
-                for product in product_stats:
-                    data.append([
-                        product['property__title'],
-                        product['total_sales'],
-                        f"RWF {product['total_revenue']:,.1f}",
-                        f"RWF {product['avg_price']:,.1f}"
-                    ])
-                summary_data = {
-                    'Total Sales': total_sales,
-                    'Total Revenue': f"RWF {total_revenue:,.1f}",
-                    'Monthly Revenue': f"RWF {monthly_revenue:,.1f}",
-                    'Commission Rate': '80%',
-                    'Report Generated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
                 filename = f"vendor_sales_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                title = f"Vendor Sales Report - {request.user.get_full_name() or request.user.username}"
-                return generate_pdf_report(data, filename, title, headers, summary_data)
+                return pdf_report_response(request, 'vendor_sales', request.user, filename)
         
         context = {
             'user_type': 'vendor',
             'total_sales': total_sales,
             'total_revenue': total_revenue,
             'monthly_revenue': monthly_revenue,
-            'monthly_sales': monthly_purchases.count(),
+            'monthly_sales': summary['monthly_total_sales'],
             'product_stats': product_stats,
             'recent_transactions': recent_transactions,
             'commission_rate': 80,  # Vendor gets 80%
@@ -2012,34 +2263,13 @@ def sales_statistics(request):
             status='completed'
         ).select_related('property', 'buyer', 'property__user')
         
-        # Calculate InzuLink statistics (total transactions)
-        total_transactions = purchases.count()
-        total_transaction_value = purchases.aggregate(
-            total=Sum('final_price')
-        )['total'] or 0
-        
-        # Get listing fee revenue
-        from authentication.models import ListingFee
-        total_listing_fees = ListingFee.objects.filter(
-            payment_status='paid'
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        # Monthly statistics
-        current_month = timezone.now().month
-        current_year = timezone.now().year
-        monthly_purchases = purchases.filter(
-            completed_at__month=current_month,
-            completed_at__year=current_year
-        )
-        monthly_transaction_value = monthly_purchases.aggregate(
-            total=Sum('final_price')
-        )['total'] or 0
-        
-        monthly_listing_fees = ListingFee.objects.filter(
-            payment_status='paid',
-            start_date__month=current_month,
-            start_date__year=current_year
-        ).aggregate(total=Sum('amount'))['total'] or 0
+        # Platform totals, listing fees and the vendor breakdown come from the daily rollups
+        summary = platform_sales_summary()
+        total_transactions = summary['total_sales']
+        total_transaction_value = summary['total_revenue']
+        total_listing_fees = summary['listing_fees']
+        monthly_transaction_value = summary['monthly_total_revenue']
+        monthly_listing_fees = summary['monthly_listing_fees']
         
         # Revenue breakdown (listing fees instead of commission)
         commission_breakdown = {
@@ -2048,29 +2278,15 @@ def sales_statistics(request):
             'total_revenue': total_listing_fees  # Platform revenue is now from listing fees
         }
         
-        # Vendor-wise breakdown - get unique vendors with their stats
-        vendor_stats = []
-        
-        # Use values() to get unique vendors with their aggregated stats
-        vendor_aggregates = purchases.values('property__user__id', 'property__user__username').annotate(
-            total_transactions=Count('id'),
-            total_sales_value=Sum('final_price'),
-            avg_sale_price=Avg('final_price')
-        ).order_by('-total_sales_value')
-        
-        for vendor_data in vendor_aggregates:
-            vendor_stats.append({
-                'vendor_id': vendor_data['property__user__id'],
-                'vendor_username': vendor_data['property__user__username'],
-                'total_transactions': vendor_data['total_transactions'],
-                'total_sales_value': vendor_data['total_sales_value'] or 0,
-                'avg_sale_price': vendor_data['avg_sale_price'] or 0
-            })
+        vendor_stats = vendor_sales_breakdown()
         
         # Recent transactions
         recent_transactions = purchases.order_by('-completed_at')[:10]
         
         # Handle export for InzuLink
+        if export_format == 'transactions':
+            filename = f"platform_transactions_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            return stream_purchase_export(request, purchases, filename, with_order_id=True, with_buyer=True)
         if export_format in ['csv', 'pdf']:
             if export_format == 'csv':
                 headers = ['Vendor', 'Transactions', 'Total Sales Value', 'Average Sale Price']
@@ -2085,33 +2301,15 @@ def sales_statistics(request):
                 filename = f"platform_sales_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
                 return generate_csv_report(data, filename, headers)
             elif export_format == 'pdf':
-                headers = ['Vendor', 'Transactions', 'Total Sales Value', 'Average Sale Price']
-                data = []
-                for vendor in vendor_stats:
-                    data.append([
-                        vendor['vendor_username'],
-                        vendor['total_transactions'],
-                        f"RWF {vendor['total_sales_value']:,.1f}",
-                        f"RWF {vendor['avg_sale_price']:,.1f}"
-                    ])
-                summary_data = {
-                    'Total Transactions': total_transactions,
-                    'Total Transaction Value': f"RWF {total_transaction_value:,.1f}",
-                    'Total Listing Fees': f"RWF {total_listing_fees:,.1f}",
-                    'Monthly Transaction Value': f"RWF {monthly_transaction_value:,.1f}",
-                    'Monthly Listing Fees': f"RWF {monthly_listing_fees:,.1f}",
-                    'Report Generated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
                 filename = f"platform_sales_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                title = f"InzuLink Platform Report - {request.user.get_full_name() or request.user.username}"
-                return generate_pdf_report(data, filename, title, headers, summary_data)
+                return pdf_report_response(request, 'platform_sales', None, filename)
         
         context = {
             'user_type': 'inzulink',
             'total_transactions': total_transactions,
             'total_revenue': total_listing_fees,  # Platform revenue from listing fees
             'monthly_revenue': monthly_listing_fees,
-            'monthly_transactions': monthly_purchases.count(),
+            'monthly_transactions': summary['monthly_total_sales'],
             'commission_breakdown': commission_breakdown,
             'vendor_stats': vendor_stats,
             'recent_transactions': recent_transactions,
@@ -2137,31 +2335,13 @@ def sales_statistics(request):
         )['total'] or 0
         
         # Handle export for customer
-        if export_format in ['csv', 'pdf']:
-            headers = ['Product', 'Seller', 'Date', 'Price', 'Status']
-            data = []
-            for purchase in purchases:
-                data.append([
-                    purchase.property.title,
-                    f"{purchase.property.user.first_name} {purchase.property.user.last_name}",
-                    purchase.created_at.strftime('%Y-%m-%d %H:%M'),
-                    f"RWF {purchase.final_price:,.1f}",
-                    purchase.status.title()
-                ])
-            
-            if export_format == 'csv':
-                filename = f"customer_purchases_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                return generate_csv_report(data, filename, headers)
-            elif export_format == 'pdf':
-                summary_data = {
-                    'Total Purchases': purchases.count(),
-                    'Total Spent': f"RWF {total_spent:,.1f}",
-                    'Monthly Spent': f"RWF {monthly_spent:,.1f}",
-                    'Report Generated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-                filename = f"customer_purchases_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                title = f"Customer Purchase Report - {request.user.get_full_name() or request.user.username}"
-                return generate_pdf_report(data, filename, title, headers, summary_data)
+        if export_format == 'csv':
+            filename = f"customer_purchases_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            return stream_purchase_export(request, purchases, filename, date_field='created_at',
+                                          property_header='Product', titled_status=True)
+        if export_format == 'pdf':
+            filename = f"customer_purchases_{request.user.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            return pdf_report_response(request, 'customer_purchases', request.user, filename)
         
         context = {
             'user_type': 'customer',
@@ -2184,50 +2364,24 @@ def vendor_statistics_for_inzulink(request, vendor_id):
     # Get the vendor
     vendor = get_object_or_404(User, id=vendor_id, is_vendor_role=True)
     
+    if request.GET.get('export') == 'pdf':
+        filename = f"vendor_sales_{vendor.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        return pdf_report_response(request, 'vendor_sales', vendor, filename)
+    
     # Get all purchases for this vendor
     purchases = Purchase.objects.filter(
         property__user=vendor,
         status='completed'
     ).select_related('property', 'buyer')
     
-    # Calculate vendor statistics (as if InzuLink is viewing the vendor's dashboard)
-    total_sales = purchases.count()
-    total_revenue = purchases.aggregate(
-        total=Sum('final_price')
-    )['total'] or 0
-    
-    # Monthly statistics
-    current_month = timezone.now().month
-    current_year = timezone.now().year
-    monthly_purchases = purchases.filter(
-        completed_at__month=current_month,
-        completed_at__year=current_year
-    )
-    monthly_revenue = monthly_purchases.aggregate(
-        total=Sum('final_price')
-    )['total'] or 0
-    
-    # Property-wise breakdown
-    product_stats = purchases.values('property__title').annotate(
-        total_sales=Count('id'),
-        total_revenue=Sum('final_price'),
-        avg_price=Avg('final_price')
-    ).order_by('-total_revenue')
-    
-    # Get listing fees paid by this vendor
-    from authentication.models import ListingFee
-    vendor_listing_fees = ListingFee.objects.filter(
-        vendor=vendor,
-        payment_status='paid'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    # Monthly listing fees
-    monthly_listing_fees = ListingFee.objects.filter(
-        vendor=vendor,
-        payment_status='paid',
-        start_date__month=current_month,
-        start_date__year=current_year
-    ).aggregate(total=Sum('amount'))['total'] or 0
+    # Sales and listing fee totals come from the daily rollups
+    summary = vendor_sales_summary(vendor)
+    total_sales = summary['total_sales']
+    total_revenue = summary['total_revenue']
+    monthly_revenue = summary['monthly_total_revenue']
+    vendor_listing_fees = summary['listing_fees']
+    monthly_listing_fees = summary['monthly_listing_fees']
+    product_stats = property_sales_breakdown(vendor)
     
     # Recent transactions
     recent_transactions = purchases.order_by('-completed_at')[:10]
@@ -2245,7 +2399,7 @@ def vendor_statistics_for_inzulink(request, vendor_id):
         'total_sales': total_sales,
         'total_revenue': total_revenue,
         'monthly_revenue': monthly_revenue,
-        'monthly_sales': monthly_purchases.count(),
+        'monthly_sales': summary['monthly_total_sales'],
         'product_stats': product_stats,
         'recent_transactions': recent_transactions,
         'listing_fees': vendor_listing_fees,
@@ -2298,19 +2452,18 @@ def pay_listing_fee(request, listing_id):
                 listing_fee.auto_renew = auto_renew
                 listing_fee.save()  # This will calculate total_amount
                 
+                if request.POST.get('async') == '1':
+                    # Call Paypack from a job; the page polls the job for the reference
+                    job = initiate_paypack_payment_async(listing_fee, request.user, phone_number)
+                    return JsonResponse(job_reference(job), status=202)
+                
                 # Initiate Paypack payment
-                from .paypack_payment import initiate_paypack_payment
+                from .paypack_payment import initiate_paypack_payment, record_paypack_request
                 payment_result = initiate_paypack_payment(listing_fee, request.user, phone_number)
                 
                 if payment_result.get('success'):
                     # Payment request sent successfully
-                    transaction_ref = payment_result.get('ref') or payment_result.get('transaction_id')
-                    listing_fee.payment_method = 'paypack'
-                    listing_fee.payment_status = 'pending'  # Will be updated when payment is confirmed
-                    listing_fee.momo_transaction_id = transaction_ref  # Reusing field for Paypack ref
-                    listing_fee.momo_status = payment_result.get('status', 'PENDING')
-                    listing_fee.momo_status_checked_at = timezone.now()
-                    listing_fee.save()
+                    transaction_ref = record_paypack_request(listing_fee, payment_result)
                     
                     # Redirect to payment status page
                     messages.info(
@@ -2385,8 +2538,12 @@ def check_payment_status(request, listing_id, transaction_id):
         momo_transaction_id=transaction_id  # Reusing field for Paypack ref
     )
     
+    if request.GET.get('async') == '1':
+        job = check_paypack_status_async(listing_fee, request.user)
+        return JsonResponse(job_reference(job), status=202)
+    
     # Check payment status with Paypack API
-    from .paypack_payment import PaypackPayment
+    from .paypack_payment import PaypackPayment, apply_paypack_status
     try:
         paypack = PaypackPayment()
         status_result = paypack.check_payment_status(transaction_id)
@@ -2396,33 +2553,20 @@ def check_payment_status(request, listing_id, transaction_id):
     
     if status_result.get('success'):
         paypack_status = status_result.get('status', 'UNKNOWN')
-        listing_fee.momo_status = paypack_status  # Reusing field for Paypack status
-        listing_fee.momo_status_checked_at = timezone.now()
+        # Updates the listing fee, and activates the listing once paid
+        apply_paypack_status(listing_fee, paypack_status, transaction_id)
         
-        # If payment successful, update listing fee
         if paypack_status == 'SUCCESSFUL':
-            listing_fee.payment_status = 'paid'
-            listing_fee.paid_at = timezone.now()
-            listing_fee.payment_reference = transaction_id
-            
-            # Activate the listing
-            property_listing.is_active = True
-            property_listing.save()
-            
             messages.success(
                 request,
                 f'Payment confirmed! Your listing is now active for {listing_fee.days_paid} days. '
                 f'Total: RWF {listing_fee.total_amount:,.2f}'
             )
-            listing_fee.save()
             return redirect('vendor_dashboard')
         elif paypack_status == 'FAILED':
-            listing_fee.payment_status = 'cancelled'
-            listing_fee.save()
             messages.error(request, 'Payment failed. Please try again.')
         else:
             # Still pending
-            listing_fee.save()
             messages.info(request, f'Payment status: {paypack_status}. Please wait for confirmation.')
     else:
         messages.warning(request, 'Could not check payment status. Please try again later.')
@@ -22,12 +22,20 @@ class ChatWebSocket {
         this.statusText = document.getElementById('statusText');
         this.typingIndicator = document.getElementById('typingIndicator');
         this.typingUser = document.getElementById('typingUser');
+        this.presenceStatus = document.getElementById('presenceStatus');
         this.loadMoreBtn = document.getElementById('loadMoreBtn');
         this.loadMoreContainer = document.getElementById('loadMoreContainer');
         this.oldestMessageId = null;
         this.useWebSocket = false;
         this.pollingInterval = null;
         this.messagesLoaded = false;
+
+        // Coalesced read receipts: remember the newest incoming message id and
+        // send one "read_up_to" per readReceiptDelay instead of one per message
+        this.readReceiptDelay = 500;
+        this.readReceiptTimer = null;
+        this.pendingReadUpTo = 0;
+        this.sentReadUpTo = 0;
         
         // Check for PythonAnywhere early - check hostname, URL, or WebSocket URL
         this.isPythonAnywhere = this.detectPythonAnywhere();
@@ -238,8 +246,11 @@ class ChatWebSocket {
                 newestId = Math.max(...ids);
             }
             
-            // Fetch recent messages (last 20 to catch any new ones)
-            const url = `/auth/api/chat/${this.conversationId}/messages/?limit=20`;
+            // Fetch only what arrived after the newest message we have; the
+            // browser revalidates with If-None-Match, so quiet polls are 304s
+            const url = newestId
+                ? `/auth/api/chat/${this.conversationId}/messages/?after=${newestId}`
+                : `/auth/api/chat/${this.conversationId}/messages/?limit=20`;
             const response = await fetch(url);
             const data = await response.json();
             
@@ -339,6 +350,13 @@ class ChatWebSocket {
             });
         }
 
+        // Receipts held back while the tab was hidden go out once it is visible
+        document.addEventListener('visibilitychange', () => {
+            if (!document.hidden) {
+                this.flushReadReceipt();
+            }
+        });
+
         // Load more messages
         if (this.loadMoreBtn) {
             this.loadMoreBtn.addEventListener('click', () => {
@@ -389,10 +407,12 @@ class ChatWebSocket {
         }
 
         if (this.useWebSocket && this.isConnected()) {
-            // Send via WebSocket
+            // Send via WebSocket; the client_id identifies the message until
+            // the server acknowledges it with its database id
             this.socket.send(JSON.stringify({
                 type: 'chat_message',
-                message: message
+                message: message,
+                client_id: this.generateClientId()
             }));
         } else {
             // Send via HTTP API (fallback for non-WebSocket environments)
@@ -436,6 +456,13 @@ class ChatWebSocket {
         }
     }
 
+    generateClientId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    }
+
     getCsrfToken() {
         // Get CSRF token from cookie or meta tag
         const name = 'csrftoken';
@@ -464,12 +491,20 @@ class ChatWebSocket {
             case 'read_receipt':
                 this.updateReadReceipt(data.message_id);
                 break;
+            case 'read_up_to':
+                this.markReadUpTo(data.message_id);
+                break;
+            case 'message_ack':
+                this.acknowledgeMessages(data.messages);
+                break;
             case 'pong':
                 // Keep-alive response
                 break;
-            case 'user_join':
-            case 'user_leave':
-                // Optional: show user join/leave notifications
+            case 'presence':
+                this.updatePresence(data.user_id, { online: data.online, last_seen: Date.now() / 1000 });
+                break;
+            case 'presence_state':
+                Object.entries(data.users).forEach(([userId, state]) => this.updatePresence(parseInt(userId), state));
                 break;
             case 'error':
                 console.error('Chat error:', data.message);
@@ -486,14 +521,21 @@ class ChatWebSocket {
             this.typingIndicator.classList.remove('active');
         }
 
-        // Check if message already exists
-        const existing = this.messagesArea.querySelector(`[data-message-id="${messageData.id}"]`);
-        if (existing) return;
+        // Check if message already exists. Messages broadcast before they are
+        // saved have no id yet and are keyed on their client_id instead.
+        const hasId = messageData.id !== null && messageData.id !== undefined;
+        if (hasId && this.messagesArea.querySelector(`[data-message-id="${messageData.id}"]`)) return;
+        if (messageData.client_id && this.findByClientId(messageData.client_id)) return;
 
         const messageDiv = document.createElement('div');
         const isMine = messageData.sender_id === this.getCurrentUserId();
         messageDiv.className = `message ${isMine ? 'mine' : ''}`;
-        messageDiv.dataset.messageId = messageData.id;
+        if (hasId) {
+            messageDiv.dataset.messageId = messageData.id;
+        }
+        if (messageData.client_id) {
+            messageDiv.dataset.clientId = messageData.client_id;
+        }
 
         const avatar = this.createAvatar(messageData.sender_avatar, messageData.sender_name);
         const content = this.createMessageContent(messageData, isMine);
@@ -508,14 +550,61 @@ class ChatWebSocket {
             this.messagesArea.appendChild(messageDiv);
         }
 
-        // Track oldest message for pagination
-        if (!this.oldestMessageId || messageData.id < this.oldestMessageId) {
-            this.oldestMessageId = messageData.id;
+        if (hasId) {
+            this.trackMessageId(messageData.id, isMine);
         }
 
         this.scrollToBottom();
     }
 
+    trackMessageId(messageId, isMine) {
+        // Track oldest message for pagination
+        if (!this.oldestMessageId || messageId < this.oldestMessageId) {
+            this.oldestMessageId = messageId;
+        }
+
+        if (!isMine) {
+            this.queueReadReceipt(messageId);
+        }
+    }
+
+    findByClientId(clientId) {
+        return this.messagesArea.querySelector(`[data-client-id="${CSS.escape(clientId)}"]`);
+    }
+
+    acknowledgeMessages(messages) {
+        // Write-behind mode: messages now have their database ids
+        if (!this.messagesArea) return;
+        messages.forEach(ack => {
+            const messageDiv = this.findByClientId(ack.client_id);
+            if (!messageDiv || messageDiv.dataset.messageId) return;
+            messageDiv.dataset.messageId = ack.id;
+            this.trackMessageId(ack.id, ack.sender_id === this.getCurrentUserId());
+        });
+    }
+
+    queueReadReceipt(messageId) {
+        this.pendingReadUpTo = Math.max(this.pendingReadUpTo, messageId);
+        if (!this.readReceiptTimer) {
+            this.readReceiptTimer = setTimeout(() => this.flushReadReceipt(), this.readReceiptDelay);
+        }
+    }
+
+    flushReadReceipt() {
+        clearTimeout(this.readReceiptTimer);
+        this.readReceiptTimer = null;
+        if (this.pendingReadUpTo <= this.sentReadUpTo || document.hidden) {
+            return;
+        }
+        if (this.useWebSocket && this.isConnected()) {
+            this.socket.send(JSON.stringify({
+                type: 'read_up_to',
+                message_id: this.pendingReadUpTo
+            }));
+            this.sentReadUpTo = this.pendingReadUpTo;
+        }
+    }
+
     createAvatar(avatarUrl, senderName) {
         const avatarDiv = document.createElement('div');
         avatarDiv.className = 'message-avatar';
@@ -579,6 +668,18 @@ class ChatWebSocket {
         return `${displayHours}:${minutes.toString().padStart(2, '0')} ${ampm}`;
     }
 
+    updatePresence(userId, state) {
+        if (!this.presenceStatus || parseInt(this.presenceStatus.dataset.userId) !== userId) return;
+
+        if (state.online) {
+            this.presenceStatus.textContent = '· Online';
+        } else if (state.last_seen) {
+            this.presenceStatus.textContent = `· Last seen ${this.formatTime(state.last_seen * 1000)}`;
+        } else {
+            this.presenceStatus.textContent = '';
+        }
+    }
+
     showTypingIndicator(username, isTyping) {
         if (!this.typingIndicator || !this.typingUser) return;
 
@@ -607,6 +708,15 @@ class ChatWebSocket {
         }
     }
 
+    markReadUpTo(messageId) {
+        this.messagesArea.querySelectorAll('.message.mine[data-message-id]').forEach(el => {
+            const id = parseInt(el.dataset.messageId);
+            if (!isNaN(id) && id <= messageId) {
+                this.updateReadReceipt(id);
+            }
+        });
+    }
+
     loadOlderMessages() {
         if (!this.oldestMessageId) return;
 